@@ -0,0 +1,344 @@
+import math
+import os
+import time
+from datetime import datetime
+from dataclasses import dataclass, field
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+from backup.compression import zstandard
+from backup.run_history import RunHistory
+
+MB = 1024 * 1024
+
+DEFAULT_ENGINES = {'postgres': 'pg_dump', 'mongodb': 'mongodump'}
+# backup option (and its default) that sets how many parallel jobs an
+# engine runs; pg_dump's custom format is always written by one process
+JOB_OPTIONS = {
+    'parallel_copy': ('workers', 4),
+    'mongodump': ('parallel_collections', 4),
+}
+# engines whose own compression is the one worth tuning: the backup option
+# that sets the level, and the codec it applies. pg_dump --compress=N is
+# gzip level N; compressing its archive again in the artifact stage only
+# costs time, so for these engines the artifact stage stores it as it is
+INLINE_CODECS = {
+    'pg_dump': ('compress_level', 'gzip'),
+}
+
+# rough compression ratio and single-core speed (MB/s of input) on a
+# typical SQL dump; history replaces them for the codecs that were used
+# and rescales them for the rest
+CODEC_PROFILES = {
+    ('gzip', 1): (2.8, 60.0),
+    ('gzip', 6): (3.3, 25.0),
+    ('gzip', 9): (3.4, 8.0),
+    ('zstd', 3): (3.3, 250.0),
+    ('zstd', 9): (3.6, 60.0),
+    ('zstd', 19): (4.1, 3.0),
+    ('xz', 1): (3.8, 12.0),
+    ('xz', 6): (4.4, 3.0),
+}
+DEFAULT_CODECS = ['gzip-1', 'gzip-6', 'gzip-9', 'zstd-3', 'zstd-9', 'zstd-19', 'xz-6']
+
+# parallel speedup assumed between job counts that were not both measured
+DUMP_SCALING = 0.7
+TRANSFER_SCALING = 0.8
+# plans this close in size count as equally small
+SIZE_TOLERANCE = 0.01
+
+
+@dataclass
+class Plan:
+    jobs: int
+    codec: str
+    level: int
+    concurrency: int
+    input_bytes: int
+    output_bytes: int
+    stage_seconds: Dict[str, float]
+    fits: bool = True
+    # compression runs inside the dump, its time is part of the dump stage
+    inline: bool = False
+    window_seconds: float = 0
+    runs: int = 0
+    alternatives: List[str] = field(default_factory=list)
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.stage_seconds.values())
+
+    @property
+    def codec_label(self) -> str:
+        return 'none' if self.codec == 'none' else f"{self.codec}-{self.level}"
+
+    def params(self) -> Dict:
+        return {'jobs': self.jobs, 'codec': self.codec, 'level': self.level, 'concurrency': self.concurrency}
+
+
+def parse_codec(label: str) -> Tuple[str, int]:
+    if label == 'none':
+        return 'none', 0
+    codec, _, level = label.partition('-')
+    return codec, int(level)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def format_bytes(count: float) -> str:
+    if count >= 1024 ** 3:
+        return f"{count / 1024 ** 3:.1f}GB"
+    return f"{count / MB:.1f}MB"
+
+
+def scaled_rate(observed: Dict[int, List[float]], count: int, exponent: float) -> float:
+    # measured rate for this count, or the nearest measured count scaled
+    # by a sublinear speedup
+    if count in observed:
+        return median(observed[count])
+    nearest = min(observed, key=lambda measured: abs(math.log(count / measured)))
+    return median(observed[nearest]) * (count / nearest) ** exponent
+
+
+def candidate_counts(observed: Dict[int, List[float]], limit: int) -> List[int]:
+    # never more than twice the largest count measured so far, so the
+    # tuner walks up in steps instead of jumping to an untested extreme
+    ceiling = min(limit, 2 * max(observed)) if observed else 1
+    counts = {1, ceiling}
+    step = 2
+    while step < ceiling:
+        counts.add(step)
+        step *= 2
+    return sorted(count for count in counts if count <= ceiling)
+
+
+class Autotuner:
+    def __init__(self, settings: Dict, history: RunHistory, upload_limit_mbps: Optional[float] = None):
+        self.settings = settings
+        self.history = history
+        self.window_seconds = settings.get('window_minutes', 240) * 60
+        self.margin = settings.get('safety_margin', 0.85)
+        self.max_jobs = settings.get('max_jobs', os.cpu_count() or 4)
+        self.max_concurrency = settings.get('max_concurrency', 8)
+        self.upload_limit = upload_limit_mbps * MB if upload_limit_mbps else None
+        codecs = [parse_codec(label) for label in settings.get('codecs', DEFAULT_CODECS)]
+        self.codecs = [(codec, level) for codec, level in codecs if codec != 'zstd' or zstandard is not None]
+
+    def predict_input(self, runs: List[Dict], key: str = 'bytes') -> int:
+        # size of the next dump from the trend over the recent runs
+        points = [(run['started_at'], run['stages']['dump'][key]) for run in runs]
+        latest_at, latest = points[-1]
+        first_at, first = points[0]
+        if latest_at <= first_at:
+            return latest
+        growth = (latest - first) / (latest_at - first_at)
+        return int(max(latest / 2, latest + growth * (time.time() - latest_at)))
+
+    def compress_model(self, runs: List[Dict]) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        observed = {}
+        for run in runs:
+            stage = run['stages'].get('compress')
+            params = run['params']
+            if not stage or params['codec'] == 'none' or not stage['seconds']:
+                continue
+            key = (params['codec'], params['level'])
+            observed.setdefault(key, []).append((stage['bytes_in'] / max(stage['bytes_out'], 1),
+                                                 stage['bytes_in'] / stage['seconds']))
+
+        model = {}
+        for key, samples in observed.items():
+            model[key] = (median(ratio for ratio, _ in samples), median(rate for _, rate in samples))
+
+        # calibrate the other codecs from the most recent one measured: how
+        # compressible this data is and how fast this host is
+        reference = None
+        for run in reversed(runs):
+            key = (run['params']['codec'], run['params']['level'])
+            if key in model and key in CODEC_PROFILES:
+                reference = key
+                break
+        exponent, speed = 1.0, 1.0
+        if reference:
+            prior_ratio, prior_rate = self.prior(reference)
+            ratio, rate = model[reference]
+            exponent = math.log(max(ratio, 1.0)) / math.log(prior_ratio)
+            speed = rate / prior_rate
+        for key in self.codecs:
+            if key not in model and key in CODEC_PROFILES:
+                prior_ratio, prior_rate = self.prior(key)
+                model[key] = (prior_ratio ** exponent, prior_rate * speed)
+        if ('none', 0) in self.codecs:
+            model[('none', 0)] = (1.0, float('inf'))
+        return model
+
+    def inline_model(self, runs: List[Dict]) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        # ratio and rate of the whole dump per level, in bytes of table data;
+        # the engine reads and compresses in one process, so the time of a
+        # level that was never used is the measured reading time plus the
+        # estimated time to compress at that level
+        observed = {}
+        for run in runs:
+            dump = run['stages']['dump']
+            key = (run['params']['codec'], run['params']['level'])
+            observed.setdefault(key, []).append((dump['bytes_in'] / max(dump['bytes'], 1),
+                                                 dump['bytes_in'] / dump['seconds']))
+        model = {}
+        for key, samples in observed.items():
+            model[key] = (median(ratio for ratio, _ in samples), median(rate for _, rate in samples))
+
+        reference = None
+        for run in reversed(runs):
+            key = (run['params']['codec'], run['params']['level'])
+            if key in model and key in CODEC_PROFILES:
+                reference = key
+                break
+        if not reference:
+            return model
+        prior_ratio, prior_rate = self.prior(reference)
+        ratio, rate = model[reference]
+        exponent = math.log(max(ratio, 1.0)) / math.log(prior_ratio)
+        # the compressing share of the measured time is capped, some of it
+        # is always spent reading from the server
+        compress_time = min(0.9 / rate, 1 / prior_rate)
+        read_time = 1 / rate - compress_time
+        speed = (1 / prior_rate) / compress_time
+        for key in self.codecs:
+            if key not in model and key in CODEC_PROFILES:
+                prior_ratio, prior_rate = self.prior(key)
+                model[key] = (prior_ratio ** exponent, 1 / (read_time + 1 / (prior_rate * speed)))
+        return model
+
+    @staticmethod
+    def prior(key: Tuple[str, int]) -> Tuple[float, float]:
+        ratio, rate = CODEC_PROFILES[key]
+        if key[0] == 'zstd':
+            # zstd runs on every core
+            rate *= os.cpu_count() or 1
+        return ratio, rate * MB
+
+    def plan(self, db_type: str, engine: str, compress: bool, current: Dict) -> Optional[Plan]:
+        runs = self.history.runs(db_type, engine, limit=self.settings.get('history_runs', 20))
+        runs = [run for run in runs if run.get('stages', {}).get('dump', {}).get('seconds')]
+        inline = compress and engine in INLINE_CODECS
+        if inline:
+            # only runs that recorded how much table data went into the dump
+            runs = [run for run in runs if run['stages']['dump'].get('bytes_in')]
+        if not runs:
+            return None
+
+        input_bytes = self.predict_input(runs, 'bytes_in' if inline else 'bytes')
+        dump_rates, transfer_rates = {}, {}
+        for run in runs:
+            dump = run['stages']['dump']
+            dump_rates.setdefault(run['params']['jobs'], []).append(dump['bytes'] / dump['seconds'])
+            transfer = run['stages'].get('transfer')
+            if transfer and transfer['seconds']:
+                transfer_rates.setdefault(run['params']['concurrency'], []).append(
+                    transfer['bytes'] / transfer['seconds'])
+
+        jobs_options = candidate_counts(dump_rates, self.max_jobs) if engine in JOB_OPTIONS else [current['jobs']]
+        concurrency_options = [1]
+        if transfer_rates and not self.upload_limit:
+            concurrency_options = candidate_counts(transfer_rates, self.max_concurrency)
+        if inline:
+            inline_codec = INLINE_CODECS[engine][1]
+            codec_model = self.inline_model(runs)
+            codec_options = [key for key in self.codecs if key in codec_model and key[0] == inline_codec]
+        else:
+            codec_model = self.compress_model(runs) if compress else {}
+            codec_options = [key for key in self.codecs if key in codec_model] if compress else [('none', 0)]
+        if not codec_options:
+            codec_options = [(current['codec'], current['level'])]
+            codec_model.setdefault(codec_options[0], (1.0, float('inf')))
+
+        plans = []
+        for jobs in jobs_options:
+            dump_seconds = input_bytes / scaled_rate(dump_rates, jobs, DUMP_SCALING)
+            for codec, level in codec_options:
+                ratio, rate = codec_model.get((codec, level), (1.0, float('inf')))
+                output_bytes = int(input_bytes / ratio)
+                compress_seconds = input_bytes / rate if codec != 'none' else 0.0
+                stages = {'dump': dump_seconds, 'compress': compress_seconds}
+                if inline:
+                    # the rate is that of the whole dump at this level
+                    stages = {'dump': compress_seconds, 'compress': 0.0}
+                for concurrency in concurrency_options:
+                    transfer_seconds = 0.0
+                    if transfer_rates:
+                        transfer_rate = scaled_rate(transfer_rates, concurrency, TRANSFER_SCALING)
+                        if self.upload_limit:
+                            transfer_rate = min(transfer_rate, self.upload_limit)
+                        transfer_seconds = output_bytes / transfer_rate
+                    plans.append(Plan(jobs, codec, level, concurrency, input_bytes, output_bytes,
+                                      {**stages, 'transfer': transfer_seconds}, inline=inline,
+                                      window_seconds=self.window_seconds, runs=len(runs)))
+
+        budget = self.window_seconds * self.margin
+        fitting = [plan for plan in plans if plan.seconds <= budget]
+        fastest = min(plans, key=lambda plan: plan.seconds)
+        if fitting:
+            smallest = min(plan.output_bytes for plan in fitting)
+            # among the smallest plans, the fewest database jobs, then the quickest
+            chosen = min((plan for plan in fitting if plan.output_bytes <= smallest * (1 + SIZE_TOLERANCE)),
+                         key=lambda plan: (plan.jobs, plan.seconds))
+        else:
+            chosen = fastest
+            chosen.fits = False
+
+        smaller = [plan for plan in plans if plan.output_bytes < chosen.output_bytes * (1 - SIZE_TOLERANCE)]
+        if smaller:
+            best = min(smaller, key=lambda plan: (plan.output_bytes, plan.seconds))
+            chosen.alternatives.append(
+                f"{best.codec_label} would be {format_bytes(best.output_bytes)} but take "
+                f"{format_duration(best.seconds)}, over the {format_duration(budget)} budget")
+        if fastest.seconds < chosen.seconds * 0.9:
+            chosen.alternatives.append(
+                f"fastest: {fastest.codec_label} with {fastest.jobs} jobs and {fastest.concurrency} streams, "
+                f"{format_duration(fastest.seconds)} for {format_bytes(fastest.output_bytes)}")
+        return chosen
+
+
+def format_run(run: Dict) -> str:
+    params = run['params']
+    codec = 'none' if params['codec'] == 'none' else f"{params['codec']}-{params['level']}"
+    started = datetime.fromtimestamp(run['started_at']).strftime('%Y-%m-%d %H:%M')
+    line = (f"{started} {'ok' if run.get('success') else 'FAILED':<6} {run['engine']:<13} "
+            f"jobs {params['jobs']:<2} {codec:<7} streams {params['concurrency']:<2}")
+    stages = run.get('stages', {})
+    if 'dump' in stages:
+        dump = stages['dump']
+        line += f" dump {format_bytes(dump['bytes'])} @ {dump['bytes'] / max(dump['seconds'], 0.001) / MB:.1f}MB/s"
+    if 'compress' in stages:
+        stage = stages['compress']
+        line += (f", compress {stage['bytes_in'] / max(stage['bytes_out'], 1):.1f}x "
+                 f"@ {stage['bytes_in'] / max(stage['seconds'], 0.001) / MB:.1f}MB/s")
+    if 'transfer' in stages:
+        stage = stages['transfer']
+        line += f", transfer {format_bytes(stage['bytes'])} @ {stage['bytes'] / max(stage['seconds'], 0.001) / MB:.1f}MB/s"
+    if 'seconds' in run:
+        line += f", total {format_duration(run['seconds'])}"
+    return line
+
+
+def format_plan(plan: Plan) -> List[str]:
+    if plan.inline:
+        stages = f"dump and compress {format_duration(plan.stage_seconds['dump'])}"
+        source = "table data"
+    else:
+        stages = (f"dump {format_duration(plan.stage_seconds['dump'])}, "
+                  f"compress {format_duration(plan.stage_seconds['compress'])}")
+        source = "dump"
+    lines = [
+        f"Autotuned from {plan.runs} runs: {plan.jobs} jobs, {plan.codec_label}, {plan.concurrency} upload streams",
+        f"Predicted {format_bytes(plan.input_bytes)} {source} -> {format_bytes(plan.output_bytes)} in "
+        f"{format_duration(plan.seconds)} ({stages}, "
+        f"transfer {format_duration(plan.stage_seconds['transfer'])}), window {format_duration(plan.window_seconds)}",
+    ]
+    if not plan.fits:
+        lines.append("No plan fits the window, using the fastest one")
+    lines.extend(f"Alternative: {line}" for line in plan.alternatives)
+    return lines
@@ -1,19 +1,46 @@
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List, Tuple
 import os
-from datetime import datetime
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 from logger import DatabaseLogger
 from backup.postgres_backup import pg_backup
+from backup.mongodb_backup import mongo_backup
+from backup.parallel_copy_backup import parallel_copy_backup
+from backup.resource_governor import ResourceGovernor
+from backup.autotuner import DEFAULT_ENGINES, INLINE_CODECS, JOB_OPTIONS, Autotuner, Plan, format_plan
+from backup.run_history import RunHistory
+from backup.regression import RegressionDetector, format_regression
+from backup.source_selection import Source, select_source
+from backup.content_profile import ContentProfile, profile_content
+from connectors.postgres_connector import get_connection
+from backup.encryption import Keyring
+from backup.pipeline import is_artifact, prepare_artifact, unpack_artifact
+from backup.progress import ProgressCallback, ProgressTracker
 from storage.local_storage import LocalStorageManager
-from storage.cloud_storage import CloudStorageManager
-from restore.restore import restore_backup
+from storage.cloud_storage import EXPORT_PREFIX, CloudStorageManager
+from storage.download_cache import DownloadCache
+from storage.fanout import FanOut, GCSSink, LocalSink
+from restore.restore import prepared_backup, restore_backup
+from restore.multi_restore import multi_target_restore
+from restore.verify import verify_backup_file
+from export.columnar_export import export_columnar
+from export.columnar_query import ExportSource, query_table
 from notifications.notifier import SlackNotifier
+from contextlib import nullcontext
 import json
-from pathlib import Path
+
+# supabase_backup_mydb_20240101120000.dump -> supabase_backup_mydb
+SERIES_PATTERN = re.compile(r'([a-z]+_backup_.+?)_\d{14}')
+
 
 class BackupManager:
-    def __init__(self, config: Optional[Dict] = None):
+    def __init__(self, config: Optional[Dict] = None, progress_callbacks: Optional[List[ProgressCallback]] = None):
         self.logger = DatabaseLogger()
+        self.progress_callbacks = list(progress_callbacks or [])
 
         if config is None:
             current_file = Path(__file__)
@@ -31,13 +58,22 @@ class BackupManager:
                 raise Exception(f"Failed to load config.json: {str(e)}")
 
         self.config = config
-        self.local_storage = LocalStorageManager(config['local_storage_dir'])
-        self.cloud_storage = CloudStorageManager() if config.get('use_cloud') else None
+        self.local_storage = LocalStorageManager(
+            config['local_storage_dir'],
+            fsync_policy=config.get('local_fsync', 'file'),
+            dedupe=config.get('local_dedupe', True)
+        )
+        self.keyring = Keyring(config.get('encryption'))
+        self.cloud_storage = CloudStorageManager(self.keyring, config.get('cloud_storage')) if config.get('use_cloud') else None
+        self.download_cache = DownloadCache.from_config(config)
+        self.run_history = RunHistory.from_config(config)
         
         os.makedirs(config['local_storage_dir'], exist_ok=True)
         
         self.backup_functions = {
             'postgres': pg_backup,
+            'postgres:parallel_copy': parallel_copy_backup,
+            'mongodb': mongo_backup,
         }
 
         self.notifier = None
@@ -51,60 +87,350 @@ class BackupManager:
             except Exception as e:
                 self.logger.error(f"Failed to initialize Slack notifier: {str(e)}")
 
+    def engine_options(self, db_type: str, stage: str) -> Dict:
+        return self.config.get(db_type.lower(), {}).get(stage, {})
+
+    def backup_sinks(self, store_locally: bool, store_in_cloud: bool, blob_name: str,
+                     metadata: Dict, governor: Optional[ResourceGovernor] = None,
+                     concurrency: int = 1) -> List:
+        destinations = self.config.get('destinations')
+        if destinations is None:
+            destinations = []
+            if store_locally:
+                destinations.append({'name': 'local', 'type': 'local'})
+            if store_in_cloud:
+                destinations.append({'name': 'cloud', 'type': 'gcs'})
+
+        sinks, names = [], set()
+        for destination in destinations:
+            kind = destination.get('type', 'local')
+            name = destination.get('name', kind)
+            if name in names:
+                # results and run history are reported per destination name
+                raise ValueError(f"Duplicate destination name: {name}, give each destination its own 'name'")
+            names.add(name)
+            required = destination.get('required', True)
+            if kind == 'local':
+                if not store_locally:
+                    continue
+                storage = self.local_storage
+                if destination.get('path'):
+                    storage = LocalStorageManager(
+                        destination['path'],
+                        fsync_policy=self.config.get('local_fsync', 'file'),
+                        dedupe=self.config.get('local_dedupe', True)
+                    )
+                sinks.append(LocalSink(name, storage, required=required))
+            elif kind == 'gcs':
+                if not store_in_cloud or not self.cloud_storage:
+                    continue
+                bucket = self.cloud_storage.bucket
+                if destination.get('bucket'):
+                    bucket = self.cloud_storage.named_bucket(destination['bucket'])
+                sinks.append(GCSSink(name, bucket, blob_name, metadata, governor, required=required,
+                                     concurrency=concurrency))
+            else:
+                raise ValueError(f"Unsupported destination type: {kind}")
+        return sinks
+
+    def add_progress_callback(self, callback: ProgressCallback):
+        self.progress_callbacks.append(callback)
+
+    def progress_tracker(self, operation: str) -> Optional[ProgressTracker]:
+        if not self.progress_callbacks:
+            return None
+        return ProgressTracker(operation, self.progress_callbacks)
+
     def notify(self, operation: str, success: bool, details: Optional[str] = None, error: Optional[str] = None):
         if self.notifier:
             self.notifier.send_notification(operation, success, details, error)
 
 
+    def backup_settings(self, db_type: str, compress: bool) -> Tuple[Callable, Dict, str, Dict]:
+        backup_options = dict(self.engine_options(db_type, 'backup'))
+        engine = backup_options.pop('engine', None)
+        codec = backup_options.pop('codec', 'gzip')
+        level = backup_options.pop('level', 9)
+        concurrency = backup_options.pop('upload_concurrency', 1)
+        backup_func = self.backup_functions.get(f"{db_type.lower()}:{engine}" if engine else db_type.lower())
+        if not backup_func:
+            raise ValueError(f"Unsupported database type: {db_type}" + (f" with engine {engine}" if engine else ""))
+
+        engine = engine or DEFAULT_ENGINES.get(db_type.lower(), db_type.lower())
+        job_option, default_jobs = JOB_OPTIONS.get(engine, (None, 1))
+        if compress and engine in INLINE_CODECS:
+            # the engine compresses as it dumps, its level is the one tuned
+            level_option, codec = INLINE_CODECS[engine]
+            level = backup_options.get(level_option, 9)
+        params = {
+            'jobs': backup_options.get(job_option, default_jobs),
+            'codec': codec if compress else 'none',
+            'level': level if compress else 0,
+            'concurrency': concurrency,
+        }
+        return backup_func, backup_options, engine, params
+
+    def autotune(self, db_type: str, engine: str, compress: bool, current: Dict,
+                 force: bool = False) -> Optional[Plan]:
+        settings = self.config.get('autotune', {})
+        if not settings.get('enabled') and not force:
+            return None
+        limits = self.config.get('resource_limits', {}).get(db_type.lower(), {})
+        tuner = Autotuner(settings, self.run_history, limits.get('upload_mbps'))
+        plan = tuner.plan(db_type.lower(), engine, compress, current)
+        if not plan:
+            print("Autotune: no run history yet, using the configured settings")
+            return None
+        for line in format_plan(plan):
+            print(line)
+        self.logger.log_database_action("autotune", {
+            "db_type": db_type, "engine": engine, "params": plan.params(), "fits": plan.fits,
+            "predicted_seconds": round(plan.seconds), "predicted_bytes": plan.output_bytes
+        })
+        return plan
+
+    def backup_source(self, db_type: str) -> Optional[Source]:
+        settings = self.engine_options(db_type, 'sources')
+        if db_type.lower() != 'postgres' or not settings:
+            return None
+        source = select_source(settings)
+        print(f"Backup source: {source.describe()}")
+        return source
+
+    def content_aware(self, db_type: str, engine: str, compress: bool, backup_options: Dict, params: Dict,
+                      source: Optional[Source] = None) -> Optional[ContentProfile]:
+        settings = self.config.get('content_aware', {})
+        if not settings.get('enabled') or not compress:
+            return None
+        # every engine compresses its own output when asked to, compressing
+        # the finished dump again costs CPU for a few percent at best
+        if engine not in INLINE_CODECS:
+            params['codec'], params['level'] = 'none', 0
+        if db_type.lower() != 'postgres':
+            return None
+
+        connection = get_connection(host=source.host if source else None, port=source.port if source else None)
+        if not connection:
+            return None
+        try:
+            profile = profile_content(connection, settings)
+        finally:
+            connection.close()
+        print(f"Content profile: {profile.summary()}")
+        level = settings.get('incompressible_level', 1)
+        if engine == 'parallel_copy':
+            backup_options['incompressible_tables'] = sorted(profile.incompressible_tables)
+            backup_options['incompressible_level'] = level
+        elif profile.incompressible_share >= settings.get('share_threshold', 0.5):
+            # pg_dump has one level for the whole archive
+            params['level'] = min(level, params['level'])
+            print(f"Most of the data is already compressed, pg_dump runs with --compress={params['level']}")
+        return profile
+
+    def record_run(self, run: Dict):
+        # the history only feeds the tuner, so it never fails a backup
+        try:
+            self.run_history.record(run)
+        except Exception as e:
+            self.logger.warning(f"Could not record run history: {str(e)}")
+
+    def table_stats(self, progress: ProgressTracker) -> Dict[str, Dict]:
+        limit = self.config.get('run_history', {}).get('max_tables', 200)
+        largest = sorted(progress.item_sizes, key=progress.item_sizes.get, reverse=True)[:limit]
+        tables = {}
+        for name in largest:
+            tables[name] = {'bytes': progress.item_sizes[name]}
+            if name in progress.item_seconds:
+                tables[name]['seconds'] = round(progress.item_seconds[name], 3)
+        return tables
+
+    def regression_detector(self) -> RegressionDetector:
+        settings = dict(self.config.get('regression', {}))
+        settings.setdefault('window_minutes', self.config.get('autotune', {}).get('window_minutes'))
+        settings.setdefault('retained_backups', self.config.get('retention', {}).get('keep_last', 7))
+        return RegressionDetector(settings, self.run_history)
+
+    def check_regression(self, run: Dict):
+        if not self.config.get('regression', {}).get('enabled'):
+            return
+        try:
+            findings = self.regression_detector().check(run)
+        except Exception as e:
+            self.logger.warning(f"Could not check for regressions: {str(e)}")
+            return
+        if not findings:
+            return
+        for finding in findings:
+            print(f"Regression: {finding}")
+        self.logger.log_database_action("regression", {"target": run.get('target'), "findings": findings})
+        self.notify("backup regression check", False, f"Database: {run['db_type']}\n" + "\n".join(findings))
+
+    def regression_reports(self, db_type: Optional[str] = None, tables: int = 10) -> List[str]:
+        lines = []
+        for report in self.regression_detector().reports(db_type.lower() if db_type else None):
+            lines.extend(format_regression(report, tables))
+        return lines
+
     @DatabaseLogger().log_backup_operation
     def perform_backup(self, db_type: str, compress: bool = False, store_locally: bool = True, 
                       store_in_cloud: bool = False) -> Optional[str]:
+        run = None
         try:
-            backup_func = self.backup_functions.get(db_type.lower())
-            if not backup_func:
-                raise ValueError(f"Unsupported database type: {db_type}")
-            
+            backup_func, backup_options, engine, params = self.backup_settings(db_type, compress)
+            plan = self.autotune(db_type, engine, compress, params)
+            if plan:
+                params = plan.params()
+                job_option = JOB_OPTIONS.get(engine)
+                if job_option:
+                    backup_options[job_option[0]] = plan.jobs
+            source = self.backup_source(db_type)
+            if source:
+                backup_options['host'] = source.host
+                backup_options['port'] = source.port
+            profile = self.content_aware(db_type, engine, compress, backup_options, params, source)
+            inline = compress and engine in INLINE_CODECS
+            if inline:
+                # the dump is compressed already, the artifact stage only
+                # encrypts it
+                backup_options[INLINE_CODECS[engine][0]] = params['level']
+            artifact_codec = 'none' if inline else params['codec']
             
             self.logger.log_database_action(
                 "backup_start",
-                {"db_type": db_type, "compress": compress}
+                {"db_type": db_type, "compress": compress, "params": params,
+                 "source": source.metadata() if source else None}
             )
+            run = {
+                'db_type': db_type.lower(),
+                'engine': engine,
+                'started_at': time.time(),
+                'params': params,
+                'tuned': plan is not None,
+                'success': False,
+                'stages': {},
+            }
+            if source:
+                run['source'] = source.metadata()
+            if profile:
+                run['content'] = {
+                    'incompressible_tables': len(profile.incompressible_tables),
+                    'incompressible_share': round(profile.incompressible_share, 3),
+                    'large_objects': profile.large_objects,
+                    'compress_level': backup_options.get('compress_level'),
+                }
             
-            # temp backup
-            backup_file = backup_func(self.config['local_storage_dir'], compress)
-            if not backup_file:
-                raise Exception("Backup failed")
-            
+            governor = ResourceGovernor.from_config(self.config, db_type,
+                                                    source.host if source else None,
+                                                    source.port if source else None)
+            # tracked even without callbacks, the per-table sizes and times
+            # go into the run history
+            progress = self.progress_tracker("backup") or ProgressTracker("backup")
+            with governor or nullcontext():
+                # temp backup
+                started = time.perf_counter()
+                backup_file = backup_func(
+                    self.config['local_storage_dir'],
+                    compress,
+                    governor=governor,
+                    progress=progress,
+                    **backup_options
+                )
+                if not backup_file:
+                    raise Exception("Backup failed")
+
+                backup_file = Path(backup_file)
+                dump_bytes = backup_file.stat().st_size
+                run['stages']['dump'] = {'seconds': round(time.perf_counter() - started, 3), 'bytes': dump_bytes}
+                if inline and progress.bytes_total:
+                    # what went into the engine's compression, for the tuner
+                    run['stages']['dump']['bytes_in'] = progress.bytes_total
+                match = SERIES_PATTERN.search(backup_file.name)
+                run['target'] = match.group(1) if match else f"{run['db_type']}:{engine}"
+                run['tables'] = self.table_stats(progress)
+                try:
+                    started = time.perf_counter()
+                    artifact, metadata = prepare_artifact(backup_file, artifact_codec != 'none', self.keyring,
+                                                          level=params['level'],
+                                                          codec=artifact_codec if artifact_codec != 'none' else 'gzip')
+                    artifact_bytes = artifact.stat().st_size
+                    if artifact != backup_file:
+                        run['stages']['compress'] = {'seconds': round(time.perf_counter() - started, 3),
+                                                     'bytes_in': dump_bytes, 'bytes_out': artifact_bytes}
+                    metadata.update({
+                        'uploaded_at': datetime.now().isoformat(),
+                        'original_name': backup_file.name,
+                        'size': str(artifact_bytes),
+                        'db_type': db_type.lower(),
+                    })
+                    if source:
+                        metadata.update(source.metadata())
+                    blob_name = CloudStorageManager.blob_path(artifact.name)
+
+                    # one read of the artifact feeds every destination at once
+                    sinks = self.backup_sinks(store_locally, store_in_cloud, blob_name, metadata, governor,
+                                              concurrency=params['concurrency'])
+                    if not sinks:
+                        raise Exception("No backup destinations configured")
+                    started = time.perf_counter()
+                    FanOut(sinks).run(artifact)
+                    run['stages']['transfer'] = {
+                        'seconds': round(time.perf_counter() - started, 3),
+                        'bytes': artifact_bytes,
+                        'destinations': {sink.name: {'seconds': round(sink.seconds, 3), 'ok': not sink.error}
+                                         for sink in sinks},
+                    }
+                finally:
+                    self.cleanup_temp_backup(backup_file)
+
             result_path = None
-            
-            # store
-            if store_locally:
-                local_path = self.local_storage.save_backup(backup_file)
-                self.logger.log_storage_operation("local", "save", local_path, True)
-                result_path = local_path
+            failed = []
+            for sink in sinks:
+                storage_type = "cloud" if isinstance(sink, GCSSink) else "local"
+                self.logger.log_storage_operation(storage_type, "save", sink.location or sink.name, not sink.error)
+                if sink.error:
+                    failed.append(f"{sink.name}: {sink.error}")
+                    continue
+                print(f"Backup written to {sink.name}: {sink.location} "
+                      f"({round(sink.bytes_written / (1024 * 1024), 2)}MB in {sink.seconds:.1f}s)")
+                # cloud copies take precedence as the reported location
+                if result_path is None or storage_type == "cloud":
+                    result_path = sink.location
+
+            if any(sink.error and sink.required for sink in sinks) or result_path is None:
+                raise Exception("Backup destinations failed: " + "; ".join(failed))
+
+            run['success'] = True
+            run['seconds'] = round(time.time() - run['started_at'], 3)
+            self.record_run(run)
+
+            details = f"Database: {db_type}"
+            if source:
+                details += f"\nSource: {source.describe()}"
+            if plan:
+                details += "\n" + "\n".join(format_plan(plan))
+            if failed:
+                details += "\nOptional destinations failed: " + "; ".join(failed)
+            self.notify("backup", True, details)
+            self.check_regression(run)
 
-            
-            if store_in_cloud and self.cloud_storage:
-                cloud_path = self.cloud_storage.upload_backup(backup_file, compress)
-                self.logger.log_storage_operation("cloud", "upload", cloud_path, True)
-                result_path = cloud_path
-            
-            if not store_locally and os.path.exists(backup_file):
-                os.remove(backup_file)
-                
-            self.notify(
-                "backup",
-                True,
-                f"Database: {db_type}"
-            )
-                
             return result_path
             
         except Exception as e:
+            if run:
+                run['seconds'] = round(time.time() - run['started_at'], 3)
+                run['error'] = str(e)
+                self.record_run(run)
             self.logger.log_critical_error("Backup operation failed", e)
             self.notify("backup", False, f"Database: {db_type}", str(e))
             return None
     
+    def cleanup_temp_backup(self, backup_file: Path):
+        temp_dir = backup_file.parent
+        for leftover in temp_dir.glob(backup_file.name + '*'):
+            leftover.unlink(missing_ok=True)
+        if temp_dir.exists() and not any(temp_dir.iterdir()) and '_backup_' in temp_dir.name:
+            temp_dir.rmdir()
+
     def list_backups(self, include_cloud: bool = True) -> List[Dict]:
         backups = []
         
@@ -141,16 +467,79 @@ class BackupManager:
         except Exception as e:
             self.logger.error(f"Delete failed: {str(e)}")
             return False
+
+    def verify_backup(self, backup_name: str, from_cloud: bool = False) -> Tuple[bool, str]:
+        temp_dir = tempfile.mkdtemp(prefix="verify_")
+        try:
+            if from_cloud:
+                if not self.cloud_storage:
+                    raise Exception("Cloud storage is not configured")
+                path = self.cloud_storage.download_backup(backup_name, temp_dir)
+            else:
+                path = self.local_storage.get_backup(backup_name, temp_dir)
+                if not path:
+                    raise Exception(f"Backup file not found: {backup_name}")
+                if is_artifact(path):
+                    path = unpack_artifact(path, temp_dir, self.keyring)
+            ok, details = verify_backup_file(path)
+        except Exception as e:
+            ok, details = False, f"{backup_name}: {str(e)}"
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        self.logger.log_database_action("verify", {"file": backup_name, "ok": ok, "details": details})
+        if not ok:
+            self.notify("verify", False, f"File: {backup_name}", details)
+        return ok, details
+
+    def apply_retention(self, keep_last: Optional[int] = None, keep_days: Optional[int] = None,
+                        storage_type: str = 'cloud') -> List[str]:
+        policy = self.config.get('retention', {})
+        keep_last = keep_last if keep_last is not None else policy.get('keep_last', 7)
+        keep_days = keep_days if keep_days is not None else policy.get('keep_days')
+
+        if storage_type == 'cloud':
+            backups = self.cloud_storage.list_backups() if self.cloud_storage else []
+        else:
+            backups = self.local_storage.list_backups()
+
+        series = {}
+        for backup in backups:
+            match = SERIES_PATTERN.search(backup['name'])
+            series.setdefault(match.group(1) if match else backup['name'], []).append(backup)
+
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S') if keep_days else None
+        deleted = []
+        for name, entries in series.items():
+            entries.sort(key=lambda x: x['created'], reverse=True)
+            # the newest keep_last backups of each database always stay,
+            # older ones go once they pass keep_days (or at once without it)
+            for backup in entries[keep_last:]:
+                if cutoff and backup['created'] > cutoff:
+                    continue
+                target = backup['path'] if storage_type == 'cloud' else backup['name']
+                if self.delete_backup(target, storage_type):
+                    deleted.append(backup['name'])
+
+        self.logger.log_database_action("retention", {"storage": storage_type, "deleted": deleted})
+        return deleted
                  
     def restore_backup(self, backup_file: str, db_type: str, target_db: Optional[str] = None, from_cloud: bool = False) -> bool:
         try:
-            success = restore_backup(
-                backup_file=backup_file,
-                target_db=target_db,
-                cloud_manager=self.cloud_storage if from_cloud else None,
-                is_cloud_backup=from_cloud,
-                db_type=db_type.lower()
-            )
+            governor = ResourceGovernor.from_config(self.config, db_type)
+            with governor or nullcontext():
+                success = restore_backup(
+                    backup_file=backup_file,
+                    target_db=target_db,
+                    cloud_manager=self.cloud_storage if from_cloud else None,
+                    is_cloud_backup=from_cloud,
+                    db_type=db_type.lower(),
+                    options=self.engine_options(db_type, 'restore'),
+                    governor=governor,
+                    keyring=self.keyring,
+                    progress=self.progress_tracker("restore"),
+                    cache=self.download_cache
+                )
             storage_type = "cloud" if from_cloud else "local"
             if self.notifier:
                 self.notify(
@@ -166,3 +555,77 @@ class BackupManager:
             if self.notifier:
                 self.notify("restore", False, f"Database: {db_type}", error_msg)
             return False
+
+    def restore_to_targets(self, backup_file: str, db_type: str, targets: List[str], from_cloud: bool = False,
+                           clone: Optional[bool] = None, connection_budget: Optional[int] = None) -> Dict[str, bool]:
+        settings = self.config.get('multi_restore', {})
+        governor = ResourceGovernor.from_config(self.config, db_type)
+        with governor or nullcontext():
+            results = multi_target_restore(
+                backup_file,
+                targets,
+                cloud_manager=self.cloud_storage if from_cloud else None,
+                is_cloud_backup=from_cloud,
+                db_type=db_type,
+                options=self.engine_options(db_type, 'restore'),
+                governor=governor,
+                keyring=self.keyring,
+                cache=self.download_cache,
+                connection_budget=connection_budget or settings.get('connection_budget', 16),
+                clone=settings.get('clone', False) if clone is None else clone,
+                template_db=settings.get('template_db'),
+                keep_template=settings.get('keep_template', False)
+            )
+        failed = [target for target, ok in results.items() if not ok]
+        self.notify(
+            "restore",
+            not failed,
+            f"Database: {db_type}\nFile: {backup_file}\nTargets: {', '.join(targets)}",
+            f"Failed targets: {', '.join(failed)}" if failed else None
+        )
+        return results
+
+    def export_dir(self) -> str:
+        return self.config.get('export', {}).get('dir', os.path.join(self.config['local_storage_dir'], 'exports'))
+
+    def export_backup(self, backup_file: str, from_cloud: bool = False, tables: Optional[List[str]] = None,
+                      upload: Optional[bool] = None) -> Optional[str]:
+        settings = self.config.get('export', {})
+        if upload is None:
+            upload = settings.get('upload', False)
+        if not from_cloud and not os.path.exists(backup_file):
+            backup_file = os.path.join(self.config['local_storage_dir'], backup_file)
+        try:
+            governor = ResourceGovernor.from_config(self.config, 'postgres')
+            with governor or nullcontext():
+                with prepared_backup(backup_file, self.cloud_storage if from_cloud else None, from_cloud,
+                                     governor, self.keyring, self.download_cache) as local_backup:
+                    location = export_columnar(
+                        local_backup,
+                        self.export_dir(),
+                        workers=settings.get('workers', 4),
+                        row_group_rows=settings.get('row_group_rows', 128 * 1024),
+                        compression=settings.get('compression', 'zstd'),
+                        tables=tables
+                    )
+                if upload:
+                    if not self.cloud_storage:
+                        raise Exception("Uploading exports needs use_cloud in config.json")
+                    location = self.cloud_storage.upload_export(location, governor=governor)
+            self.logger.log_database_action("export", {"file": backup_file, "location": location})
+            return location
+
+        except Exception as e:
+            self.logger.error(f"Export failed: {str(e)}")
+            return None
+
+    def query_export(self, name: str, table: str, columns: Optional[List[str]] = None,
+                     filters: Optional[List[str]] = None, limit: Optional[int] = None,
+                     from_cloud: bool = False):
+        if from_cloud:
+            if not self.cloud_storage:
+                raise Exception("Cloud storage is not enabled, set use_cloud in config.json")
+            source = ExportSource(name, bucket=self.cloud_storage.bucket, prefix=EXPORT_PREFIX)
+        else:
+            source = ExportSource(name, export_dir=self.export_dir())
+        return query_table(source, table, columns, filters, limit)
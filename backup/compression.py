@@ -0,0 +1,69 @@
+import gzip
+import lzma
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+CODEC_SUFFIXES = {
+    'gzip': '.gz',
+    'xz': '.xz',
+    'zstd': '.zst',
+}
+
+
+def codec_from_name(name: str) -> Optional[str]:
+    for codec, suffix in CODEC_SUFFIXES.items():
+        if name.endswith(suffix):
+            return codec
+    return None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise Exception("The zstd codec needs the zstandard package: pip install zstandard")
+
+
+def open_writer(fileobj: BinaryIO, codec: str, level: int):
+    # the returned writer never closes the underlying file object
+    if codec == 'gzip':
+        return gzip.GzipFile(filename='', mode='wb', fileobj=fileobj, compresslevel=level)
+    if codec == 'xz':
+        return lzma.LZMAFile(fileobj, 'wb', preset=level)
+    if codec == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(fileobj, closefd=False)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def open_reader(fileobj: BinaryIO, codec: str):
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if codec == 'xz':
+        return lzma.LZMAFile(fileobj, 'rb')
+    if codec == 'zstd':
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def write_stream(source: BinaryIO, dest_path: str, compress: bool = False,
+                 level: int = 6, chunk_size: int = CHUNK_SIZE) -> int:
+    written = 0
+    if compress:
+        out = gzip.open(dest_path, 'wb', compresslevel=level)
+    else:
+        out = open(dest_path, 'wb')
+    with out:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
@@ -0,0 +1,120 @@
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from psycopg2 import sql
+
+SAMPLE_BYTES = 64 * 1024
+# compressed/original size of a sample above which compressing harder is
+# wasted CPU; JPEGs, PDFs, zip files and encrypted payloads land near 1.0
+INCOMPRESSIBLE_RATIO = 0.9
+
+BYTEA_COLUMNS_QUERY = """
+    SELECT n.nspname, c.relname, a.attname, pg_table_size(c.oid)
+      FROM pg_attribute a
+      JOIN pg_class c ON c.oid = a.attrelid
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE c.relkind = 'r' AND a.attnum > 0 AND NOT a.attisdropped
+       AND a.atttypid = 'bytea'::regtype
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+       AND pg_table_size(c.oid) >= %s
+"""
+
+LARGE_OBJECTS_QUERY = """
+    SELECT count(*), pg_total_relation_size('pg_catalog.pg_largeobject')
+      FROM pg_catalog.pg_largeobject_metadata
+"""
+
+
+def compressed_ratio(data: bytes) -> float:
+    # the fastest zlib level is enough to tell text from already packed bytes
+    if not data:
+        return 1.0
+    return len(zlib.compress(data, 1)) / len(data)
+
+
+@dataclass
+class ContentProfile:
+    database_bytes: int = 0
+    # qualified table name -> sampled ratio of its bytea columns
+    incompressible_tables: Dict[str, float] = field(default_factory=dict)
+    incompressible_bytes: int = 0
+    large_objects: int = 0
+    large_object_bytes: int = 0
+    large_object_ratio: Optional[float] = None
+    threshold: float = INCOMPRESSIBLE_RATIO
+
+    @property
+    def incompressible_share(self) -> float:
+        packed = self.incompressible_bytes
+        if self.large_object_ratio is not None and self.large_object_ratio >= self.threshold:
+            packed += self.large_object_bytes
+        return min(1.0, packed / self.database_bytes) if self.database_bytes else 0.0
+
+    def summary(self) -> str:
+        line = (f"{len(self.incompressible_tables)} tables with incompressible bytea "
+                f"({self.incompressible_bytes / 1024 ** 3:.2f}GB)")
+        if self.large_objects:
+            ratio = f", sampled ratio {self.large_object_ratio:.2f}" if self.large_object_ratio is not None else ""
+            line += f", {self.large_objects} large objects ({self.large_object_bytes / 1024 ** 3:.2f}GB{ratio})"
+        return line + f", {self.incompressible_share * 100:.0f}% of the database is already compressed"
+
+
+def sample_column(connection, schema: str, table: str, column: str, rows: int) -> float:
+    # a prefix of each value is enough to recognise the file type, and
+    # keeps the sample cheap for values many MB long
+    query = sql.SQL("SELECT substring({column} FROM 1 FOR %s) FROM {table} "
+                    "TABLESAMPLE SYSTEM (1) WHERE {column} IS NOT NULL LIMIT %s").format(
+        column=sql.Identifier(column), table=sql.Identifier(schema, table))
+    with connection.cursor() as cursor:
+        cursor.execute(query, (SAMPLE_BYTES, rows))
+        values = [bytes(value) for value, in cursor.fetchall()]
+        if not values:
+            # tiny tables can come back empty from a block sample
+            cursor.execute(sql.SQL("SELECT substring({column} FROM 1 FOR %s) FROM {table} "
+                                   "WHERE {column} IS NOT NULL LIMIT %s").format(
+                column=sql.Identifier(column), table=sql.Identifier(schema, table)), (SAMPLE_BYTES, rows))
+            values = [bytes(value) for value, in cursor.fetchall()]
+    return compressed_ratio(b''.join(values))
+
+
+def sample_large_objects(connection, count: int) -> Optional[float]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT lo_get(oid, 0, %s) FROM pg_catalog.pg_largeobject_metadata LIMIT %s",
+                       (SAMPLE_BYTES, count))
+        values = [bytes(value) for value, in cursor.fetchall() if value is not None]
+    return compressed_ratio(b''.join(values)) if values else None
+
+
+def profile_content(connection, settings: Dict) -> ContentProfile:
+    threshold = settings.get('incompressible_ratio', INCOMPRESSIBLE_RATIO)
+    profile = ContentProfile(threshold=threshold)
+    rows = settings.get('sample_rows', 50)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_database_size(current_database())")
+        profile.database_bytes = cursor.fetchone()[0]
+        cursor.execute(BYTEA_COLUMNS_QUERY, (settings.get('min_table_mb', 16) * 1024 * 1024,))
+        columns = cursor.fetchall()
+
+    tables: Dict[str, List] = {}
+    for schema, table, column, size in columns:
+        entry = tables.setdefault(f"{schema}.{table}", [size, []])
+        entry[1].append(sample_column(connection, schema, table, column, rows))
+    for name, (size, ratios) in tables.items():
+        # the most packed bytea column usually holds most of the table's bytes
+        ratio = max(ratios)
+        if ratio >= threshold:
+            profile.incompressible_tables[name] = round(ratio, 3)
+            profile.incompressible_bytes += size
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(LARGE_OBJECTS_QUERY)
+            profile.large_objects, profile.large_object_bytes = cursor.fetchone()
+        if profile.large_objects:
+            profile.large_object_ratio = sample_large_objects(connection, rows)
+    except Exception as e:
+        # large object contents need privileges the backup role may lack
+        connection.rollback()
+        print(f"Could not sample large objects: {str(e).strip()}")
+    return profile
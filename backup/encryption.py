@@ -0,0 +1,202 @@
+import base64
+import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# File layout:
+#   MAGIC | version | key id length | key id | chunk size | salt
+#   chunk 0 | chunk 1 | ... | chunk n (final)
+# Every chunk is the AES-GCM ciphertext of chunk_size plaintext bytes (the
+# final one may be shorter) followed by its 16 byte tag. The nonce is the
+# chunk index under a per-file key derived from the master key and the salt,
+# and the associated data binds the header, the index and a final flag, so
+# every chunk is verified as it is read and chunks cannot be reordered or
+# truncated.
+MAGIC = b'DBBKENC1'
+VERSION = 1
+TAG_SIZE = 16
+SALT_SIZE = 16
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+ENCRYPTED_SUFFIX = '.enc'
+
+
+class Keyring:
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        self.key_id = config.get('key_id')
+        self.env_prefix = config.get('key_env_prefix', 'BACKUP_ENCRYPTION_KEY_')
+        self.key_files = config.get('key_files', {})
+        self.chunk_size = config.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        self.workers = config.get('workers', os.cpu_count() or 2)
+
+        if self.enabled and not self.key_id:
+            raise ValueError("encryption.key_id is required when encryption is enabled")
+
+    def get(self, key_id: str) -> bytes:
+        if key_id in self.key_files:
+            with open(self.key_files[key_id], 'rb') as f:
+                raw = f.read().strip()
+        else:
+            env_var = self.env_prefix + re.sub(r'[^A-Za-z0-9]', '_', key_id).upper()
+            raw = os.getenv(env_var)
+            if not raw:
+                raise Exception(f"Encryption key '{key_id}' not found (set {env_var})")
+            raw = raw.encode()
+
+        key = base64.b64decode(raw)
+        if len(key) != 32:
+            raise ValueError(f"Encryption key '{key_id}' must be 32 bytes, base64 encoded")
+        return key
+
+
+def derive_file_key(master_key: bytes, salt: bytes) -> AESGCM:
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt,
+               info=b'db_backup chunk key').derive(master_key)
+    return AESGCM(key)
+
+
+def build_header(key_id: str, chunk_size: int, salt: bytes) -> bytes:
+    key_id_bytes = key_id.encode()
+    return (MAGIC + struct.pack('>BB', VERSION, len(key_id_bytes)) + key_id_bytes
+            + struct.pack('>I', chunk_size) + salt)
+
+
+def read_header(fileobj: BinaryIO) -> Tuple[bytes, str, int, bytes]:
+    start = fileobj.read(len(MAGIC) + 2)
+    if len(start) < len(MAGIC) + 2 or start[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an encrypted backup file")
+    version, key_id_len = struct.unpack('>BB', start[len(MAGIC):])
+    if version != VERSION:
+        raise ValueError(f"Unsupported encryption format version: {version}")
+    key_id = fileobj.read(key_id_len).decode()
+    chunk_size_bytes = fileobj.read(4)
+    salt = fileobj.read(SALT_SIZE)
+    (chunk_size,) = struct.unpack('>I', chunk_size_bytes)
+    header = start + key_id.encode() + chunk_size_bytes + salt
+    return header, key_id, chunk_size, salt
+
+
+def chunk_nonce(index: int) -> bytes:
+    return struct.pack('>4xQ', index)
+
+
+def chunk_aad(header: bytes, index: int, final: bool) -> bytes:
+    return header + struct.pack('>QB', index, 1 if final else 0)
+
+
+class EncryptingWriter:
+    def __init__(self, fileobj: BinaryIO, keyring: Keyring, key_id: Optional[str] = None):
+        self.fileobj = fileobj
+        self.key_id = key_id or keyring.key_id
+        self.chunk_size = keyring.chunk_size
+        self.workers = max(1, keyring.workers)
+        salt = os.urandom(SALT_SIZE)
+        self.aead = derive_file_key(keyring.get(self.key_id), salt)
+        self.header = build_header(self.key_id, self.chunk_size, salt)
+        self.buffer = bytearray()
+        self.index = 0
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.fileobj.write(self.header)
+
+    def _encrypt(self, args) -> bytes:
+        index, data, final = args
+        return self.aead.encrypt(chunk_nonce(index), data, chunk_aad(self.header, index, final))
+
+    def _flush_chunks(self, chunks: List[bytes], final_last: bool):
+        jobs = []
+        for i, data in enumerate(chunks):
+            final = final_last and i == len(chunks) - 1
+            jobs.append((self.index + i, data, final))
+        for encrypted in self.executor.map(self._encrypt, jobs):
+            self.fileobj.write(encrypted)
+        self.index += len(chunks)
+
+    def write(self, data) -> int:
+        self.buffer += data
+        batch = self.chunk_size * self.workers * 2
+        # always keep at least one byte back so the final chunk is
+        # written by close() with the final flag set
+        if len(self.buffer) > batch:
+            count = (len(self.buffer) - 1) // self.chunk_size
+            size = count * self.chunk_size
+            chunks = [bytes(self.buffer[i:i + self.chunk_size]) for i in range(0, size, self.chunk_size)]
+            del self.buffer[:size]
+            self._flush_chunks(chunks, final_last=False)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        chunks = [bytes(self.buffer[i:i + self.chunk_size])
+                  for i in range(0, len(self.buffer), self.chunk_size)] or [b'']
+        self.buffer = bytearray()
+        self._flush_chunks(chunks, final_last=True)
+        self.executor.shutdown()
+        self.fileobj.flush()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DecryptingReader:
+    def __init__(self, fileobj: BinaryIO, keyring: Keyring):
+        self.fileobj = fileobj
+        self.header, self.key_id, self.chunk_size, salt = read_header(fileobj)
+        self.aead = derive_file_key(keyring.get(self.key_id), salt)
+        self.workers = max(1, keyring.workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.index = 0
+        self.pending = self.fileobj.read(self.chunk_size + TAG_SIZE)
+        if not self.pending:
+            raise ValueError("Encrypted backup is truncated")
+        self.buffer = bytearray()
+        self.done = False
+
+    def _decrypt(self, args) -> bytes:
+        index, data, final = args
+        return self.aead.decrypt(chunk_nonce(index), data, chunk_aad(self.header, index, final))
+
+    def _fill(self):
+        # one chunk of lookahead tells us which chunk is the final one
+        jobs = []
+        while len(jobs) < self.workers * 2 and self.pending:
+            following = self.fileobj.read(self.chunk_size + TAG_SIZE)
+            jobs.append((self.index, self.pending, not following))
+            self.index += 1
+            self.pending = following
+        if not jobs:
+            self.done = True
+            return
+        for plain in self.executor.map(self._decrypt, jobs):
+            self.buffer += plain
+        if not self.pending:
+            self.done = True
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self.executor.shutdown()
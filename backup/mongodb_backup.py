@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Dict, Optional
+from backup.compression import write_stream
+from backup.process_runner import ProcessRunner
+from backup.resource_governor import ResourceGovernor
+from backup.progress import ProgressTracker
+from connectors.mongodb_connector import get_connection, get_uri
+
+# mongodump --gzip compresses each collection inside the archive, so the
+# archive itself is not a gzip file; mark it in the name so restore can
+# pass --gzip back to mongorestore
+GZIP_MARKER = '_gzip'
+
+
+SYSTEM_DATABASES = ('admin', 'local', 'config')
+
+
+def collection_sizes(client, db_name: Optional[str] = None) -> Dict[str, int]:
+    names = [db_name] if db_name else [d for d in client.list_database_names() if d not in SYSTEM_DATABASES]
+    sizes = {}
+    for name in names:
+        database = client[name]
+        for collection in database.list_collection_names():
+            stats = database.command('collStats', collection)
+            sizes[f"{name}.{collection}"] = stats.get('size', 0)
+    return sizes
+
+
+def mongo_backup(output_dir: str, compress: bool = False, parallel_collections: int = 4,
+                 oplog: bool = False, governor: Optional[ResourceGovernor] = None,
+                 progress: Optional[ProgressTracker] = None, timeout: Optional[int] = None) -> str:
+    if not shutil.which("mongodump"):
+        raise Exception("mongodump not found. Install the MongoDB Database Tools")
+
+    client = get_connection()
+    if not client:
+        raise Exception("Unable to connect to the MongoDB server")
+
+    temp_dir = tempfile.mkdtemp(prefix="mongo_backup_")
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    try:
+        db_name = os.getenv("MGDB_NAME")
+        if not db_name and not oplog:
+            raise Exception("MGDB_NAME is required unless dumping the whole instance with oplog")
+
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        marker = GZIP_MARKER if compress else ""
+        backup_file = os.path.join(
+            temp_dir, f"mongodb_backup_{db_name or 'all'}_{timestamp}{marker}.archive"
+        )
+
+        command = [
+            "mongodump",
+            f"--uri={get_uri()}",
+            "--archive",
+            f"--numParallelCollections={parallel_collections}",
+        ]
+
+        # --oplog only works on a full replica set dump, it captures the
+        # writes made while dumping so restore ends at one consistent point
+        if oplog:
+            command.append("--oplog")
+        else:
+            command.append(f"--db={db_name}")
+
+        if compress:
+            command.append("--gzip")
+
+        if progress:
+            sizes = collection_sizes(client, None if oplog else db_name)
+            progress.set_totals(bytes_total=sum(sizes.values()), items_total=len(sizes), item_sizes=sizes)
+
+        result = None
+        try:
+            result = ProcessRunner(command, governor=governor, progress=progress, timeout=timeout).run(
+                lambda stdout: write_stream(stdout, backup_file))
+        finally:
+            if progress:
+                progress.finish(result is not None and result.ok)
+
+        if not result.ok:
+            raise Exception("Backup failed: " + result.summary())
+
+        size = os.path.getsize(backup_file)
+
+        print(f"MongoDB archive written: {backup_file} ({round(size / (1024 * 1024), 2)}MB)")
+        return backup_file
+
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    finally:
+        client.close()
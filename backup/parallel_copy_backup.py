@@ -0,0 +1,497 @@
+import gzip
+import io
+import json
+import math
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from psycopg2 import sql
+from connectors.postgres_connector import get_connection
+from backup.content_profile import INCOMPRESSIBLE_RATIO, SAMPLE_BYTES, compressed_ratio
+from backup.process_runner import ProcessRunner
+from backup.progress import ProgressTracker
+from backup.resource_governor import ResourceGovernor
+
+PCOPY_EXTENSION = '.pcopy'
+MANIFEST_NAME = 'manifest.json'
+SCHEMA_NAME = 'schema.dump'
+MANIFEST_VERSION = 3
+MB = 1024 * 1024
+# every data stream is cut into members of this size as it is written, so
+# the workers append to the one archive while they run and nothing is
+# spooled to disk and copied in afterwards
+BLOCK_SIZE = 16 * MB
+LARGE_OBJECTS = 'large objects'
+# large objects per data file, and how much of one is held in memory
+LARGE_OBJECT_BATCH = 1000
+LARGE_OBJECT_CHUNK_SIZE = MB
+
+TABLES_QUERY = """
+    SELECT n.nspname, c.relname, pg_table_size(c.oid),
+           (SELECT a.attname
+              FROM pg_index i
+              JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+             WHERE i.indrelid = c.oid AND i.indisprimary AND i.indnkeyatts = 1
+               AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)),
+           ARRAY(SELECT a.attname
+                   FROM pg_attribute a
+                  WHERE a.attrelid = c.oid AND a.attnum > 0
+                    AND NOT a.attisdropped AND a.attgenerated = ''
+                  ORDER BY a.attnum)
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE c.relkind = 'r'
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+       AND n.nspname NOT LIKE 'pg_toast%%'
+       AND n.nspname NOT LIKE 'pg_temp%%'
+"""
+
+SEQUENCES_QUERY = """
+    SELECT n.nspname, c.relname
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+     WHERE c.relkind = 'S'
+       AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+"""
+
+
+def begin_snapshot(connection, snapshot: Optional[str] = None) -> str:
+    connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with connection.cursor() as cursor:
+        if snapshot:
+            # must be the first statement of the transaction
+            cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            return snapshot
+        cursor.execute("SELECT pg_export_snapshot()")
+        return cursor.fetchone()[0]
+
+
+class ArchiveWriter:
+    # the .pcopy tar, shared by the workers; a member is written in one go
+    # under the lock, so members of different streams interleave
+    def __init__(self, path: str):
+        self.archive = tarfile.open(path, 'w')
+        self.lock = threading.Lock()
+
+    def add(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self.lock:
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def add_file(self, path: str, name: str):
+        with self.lock:
+            self.archive.add(path, arcname=name)
+
+    def close(self):
+        self.archive.close()
+
+
+class PartWriter:
+    # file-like end of one data stream, cut into BLOCK_SIZE members named
+    # <file>.00000, <file>.00001, ...
+    def __init__(self, archive: ArchiveWriter, name: str):
+        self.archive = archive
+        self.name = name
+        self.buffer = bytearray()
+        self.members: List[str] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._add(BLOCK_SIZE)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _add(self, size: int):
+        name = f"{self.name}.{len(self.members):05d}"
+        self.archive.add(name, bytes(self.buffer[:size]))
+        del self.buffer[:size]
+        self.members.append(name)
+        self.size += size
+
+    def close(self):
+        if self.buffer or not self.members:
+            self._add(len(self.buffer))
+
+
+class PartReader(io.RawIOBase):
+    # reads the members of one data stream back to back, straight from the
+    # archive file at the offsets tarfile recorded
+    def __init__(self, path: str, members: List[tarfile.TarInfo]):
+        self.file = open(path, 'rb')
+        self.members = list(members)
+        self.remaining = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self.remaining == 0:
+            if not self.members:
+                return 0
+            member = self.members.pop(0)
+            self.file.seek(member.offset_data)
+            self.remaining = member.size
+        count = self.file.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        if not count:
+            raise Exception(f"{self.file.name} ends inside a data member")
+        self.remaining -= count
+        return count
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def part_members(entry: Dict) -> List[str]:
+    # version 2 archives stored every stream as one member
+    return entry.get('members', [entry['file']])
+
+
+def archive_members(path: str) -> Dict[str, tarfile.TarInfo]:
+    with tarfile.open(path, 'r') as archive:
+        return {member.name: member for member in archive.getmembers()}
+
+
+@contextmanager
+def open_part(path: str, members: Dict[str, tarfile.TarInfo], entry: Dict,
+              compression: str = 'gzip') -> Iterator[BinaryIO]:
+    reader = io.BufferedReader(PartReader(path, [members[name] for name in part_members(entry)]), MB)
+    try:
+        yield gzip.GzipFile(fileobj=reader, mode='rb') if compression == 'gzip' else reader
+    finally:
+        reader.close()
+
+
+def plan_units(connection, workers: int, split_threshold: int) -> List[Dict]:
+    with connection.cursor() as cursor:
+        cursor.execute(TABLES_QUERY)
+        tables = cursor.fetchall()
+
+    units = []
+    for schema, name, size, pk, columns in tables:
+        table = {'schema': schema, 'name': name, 'columns': list(columns), 'estimated_bytes': size}
+        parts = 1
+        bounds = None
+        if pk and size > split_threshold:
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL("SELECT min({pk}), max({pk}) FROM {table}").format(
+                    pk=sql.Identifier(pk), table=sql.Identifier(schema, name)))
+                low, high = cursor.fetchone()
+            if low is not None and high > low:
+                parts = min(math.ceil(size / split_threshold), workers * 4, high - low + 1)
+                bounds = (low, high)
+
+        if parts == 1:
+            units.append({'table': table, 'pk': None, 'range': None, 'estimated_bytes': size, 'part': 0})
+            continue
+
+        step = math.ceil((bounds[1] - bounds[0] + 1) / parts)
+        for part in range(parts):
+            low = bounds[0] + part * step
+            high = min(low + step, bounds[1] + 1)
+            units.append({
+                'table': table,
+                'pk': pk,
+                # the first and last ranges are open ended so rows outside
+                # the sampled min/max can never be missed
+                'range': (None if part == 0 else low, None if part == parts - 1 else high),
+                'estimated_bytes': size // parts,
+                'part': part,
+            })
+
+    # largest first, so a huge table never ends up running alone at the end
+    units.sort(key=lambda unit: unit['estimated_bytes'], reverse=True)
+    return units
+
+
+def plan_large_objects(connection) -> List[Dict]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT oid FROM pg_catalog.pg_largeobject_metadata ORDER BY oid")
+        oids = [oid for oid, in cursor.fetchall()]
+    return [{'table': None, 'oids': oids[start:start + LARGE_OBJECT_BATCH], 'estimated_bytes': 0,
+             'part': part}
+            for part, start in enumerate(range(0, len(oids), LARGE_OBJECT_BATCH))]
+
+
+def dump_large_objects(connection, oids: List[int], raw: BinaryIO, level: Optional[int]) -> List[List[int]]:
+    # every object is its own gzip member in one stream, so each one gets
+    # the level that suits its content; gzip readers see a single stream and
+    # the manifest records where one object ends. Without a level the
+    # objects are written as they are
+    objects = []
+    for oid in oids:
+        lob = connection.lobject(oid, 'rb')
+        try:
+            chunk = lob.read(LARGE_OBJECT_CHUNK_SIZE)
+            size = 0
+            if level is None:
+                out = raw
+            else:
+                packed = compressed_ratio(chunk[:SAMPLE_BYTES]) >= INCOMPRESSIBLE_RATIO
+                out = gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=0 if packed else level)
+            while chunk:
+                out.write(chunk)
+                size += len(chunk)
+                chunk = lob.read(LARGE_OBJECT_CHUNK_SIZE)
+            if out is not raw:
+                out.close()
+        finally:
+            lob.close()
+        objects.append([oid, size])
+    return objects
+
+
+def unit_query(unit: Dict) -> sql.Composed:
+    table = unit['table']
+    ident = sql.Identifier(table['schema'], table['name'])
+    columns = sql.SQL(', ').join(sql.Identifier(c) for c in table['columns'])
+    if not unit['range']:
+        return sql.SQL("COPY {table} ({columns}) TO STDOUT").format(table=ident, columns=columns)
+
+    low, high = unit['range']
+    pk = sql.Identifier(unit['pk'])
+    conditions = []
+    if low is not None:
+        conditions.append(sql.SQL("{pk} >= {low}").format(pk=pk, low=sql.Literal(low)))
+    if high is not None:
+        conditions.append(sql.SQL("{pk} < {high}").format(pk=pk, high=sql.Literal(high)))
+    return sql.SQL("COPY (SELECT {columns} FROM {table} WHERE {where}) TO STDOUT").format(
+        columns=columns, table=ident, where=sql.SQL(' AND ').join(conditions))
+
+
+def unit_name(unit: Dict) -> str:
+    if 'oids' in unit:
+        return LARGE_OBJECTS
+    table = unit['table']
+    return f"{table['schema']}.{table['name']}"
+
+
+def sequence_values(connection) -> List[Dict]:
+    sequences = []
+    with connection.cursor() as cursor:
+        cursor.execute(SEQUENCES_QUERY)
+        for schema, name in cursor.fetchall():
+            cursor.execute(sql.SQL("SELECT last_value, is_called FROM {seq}").format(
+                seq=sql.Identifier(schema, name)))
+            last_value, is_called = cursor.fetchone()
+            sequences.append({'schema': schema, 'name': name,
+                              'last_value': last_value, 'is_called': is_called})
+    return sequences
+
+
+def dump_units(units: List[Dict], snapshot: str, archive: ArchiveWriter, workers: int, level: Optional[int],
+               progress: Optional[ProgressTracker] = None, host: Optional[str] = None,
+               port: Optional[str] = None, levels: Optional[Dict[str, int]] = None):
+    pending = queue.Queue()
+    for unit in units:
+        pending.put(unit)
+    errors = []
+    remaining = {}
+    seconds = {}
+    for unit in units:
+        remaining[unit_name(unit)] = remaining.get(unit_name(unit), 0) + 1
+    lock = threading.Lock()
+
+    def worker():
+        connection = get_connection(host=host, port=port)
+        if not connection:
+            errors.append(Exception("Worker could not connect to the database"))
+            return
+        try:
+            begin_snapshot(connection, snapshot)
+            while not errors:
+                try:
+                    unit = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                suffix = '.gz' if level is not None else ''
+                if 'oids' in unit:
+                    filename = f"large_objects.{unit['part']}{suffix}"
+                else:
+                    filename = f"{unit_name(unit)}.{unit['part']}.copy{suffix}"
+                part = PartWriter(archive, f"data/{filename}")
+                if 'oids' in unit:
+                    unit['objects'] = dump_large_objects(connection, unit['oids'], part, level)
+                elif level is None:
+                    with connection.cursor() as cursor:
+                        cursor.copy_expert(unit_query(unit), part)
+                else:
+                    table_level = (levels or {}).get(unit_name(unit), level)
+                    with gzip.GzipFile(filename='', mode='wb', fileobj=part, compresslevel=table_level) as out:
+                        with connection.cursor() as cursor:
+                            cursor.copy_expert(unit_query(unit), out)
+                part.close()
+                unit['file'] = part.name
+                unit['members'] = part.members
+                unit['bytes'] = part.size
+                unit['seconds'] = round(time.perf_counter() - started, 3)
+                if progress:
+                    with lock:
+                        remaining[unit_name(unit)] -= 1
+                        seconds[unit_name(unit)] = seconds.get(unit_name(unit), 0) + unit['seconds']
+                        done = remaining[unit_name(unit)] == 0
+                    if done:
+                        # worker time summed over the table's parts
+                        progress.complete_item(unit_name(unit), seconds[unit_name(unit)])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise Exception(f"Parallel COPY dump failed: {errors[0]}")
+
+
+def parallel_copy_backup(output_dir: str, compress: bool = False, governor: Optional[ResourceGovernor] = None,
+                         progress: Optional[ProgressTracker] = None, workers: int = 4,
+                         split_threshold_mb: int = 1024, compress_level: int = 6,
+                         timeout: Optional[int] = None, host: Optional[str] = None,
+                         port: Optional[str] = None, incompressible_tables: Optional[List[str]] = None,
+                         incompressible_level: int = 1) -> str:
+    connection = get_connection(host=host, port=port)
+    if not connection:
+        raise Exception("Unable to connect to the PostgreSQL database")
+
+    temp_dir = tempfile.mkdtemp(prefix="pg_backup_")
+    archive = None
+
+    try:
+        params = connection.get_dsn_parameters()
+        db_name = params["dbname"]
+        host = params.get("host")
+        port = params.get("port")
+        user = params.get("user")
+        pwd = os.getenv("SUPABASE_PASSWORD")
+
+        if not all([db_name, host, port, user, pwd]):
+            raise Exception("Incomplete database connection parameters")
+
+        # the exporting transaction stays open until every worker and the
+        # schema dump have attached to its snapshot and finished
+        snapshot = begin_snapshot(connection)
+        # the schema dump leaves large objects out, they are copied here;
+        # their sizes are unknown, so they start first rather than risk
+        # a long tail
+        units = plan_large_objects(connection) + plan_units(connection, workers, split_threshold_mb * MB)
+        sequences = sequence_values(connection)
+        level = compress_level if compress else None
+        # bytea that is already packed only shrinks from its hex encoding,
+        # which the fastest level gets as well as the slowest
+        levels = {name: min(incompressible_level, level) for name in incompressible_tables or []} if compress else {}
+
+        if progress:
+            sizes = {}
+            for unit in units:
+                sizes[unit_name(unit)] = sizes.get(unit_name(unit), 0) + unit['estimated_bytes']
+            progress.set_totals(bytes_total=sum(sizes.values()), items_total=len(sizes), item_sizes=sizes)
+
+        env = os.environ.copy()
+        env["PGSSLMODE"] = "require"
+        env["PGGSSENCMODE"] = "disable"
+        schema_command = [
+            "pg_dump",
+            f"postgresql://{user}:{pwd}@{host}:{port}/{db_name}",
+            "--format=custom",
+            "--schema-only",
+            f"--snapshot={snapshot}",
+            f"--file={os.path.join(temp_dir, SCHEMA_NAME)}",
+            "--no-owner",
+            "--no-privileges"
+        ]
+        schema_runner = ProcessRunner(schema_command, env, governor, timeout=timeout)
+        schema_results = []
+        schema_thread = threading.Thread(target=lambda: schema_results.append(schema_runner.run()), daemon=True)
+        schema_thread.start()
+
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        backup_file = os.path.join(temp_dir, f"supabase_backup_{db_name}_{timestamp}{PCOPY_EXTENSION}")
+        # data members are already compressed, the archive only bundles them
+        archive = ArchiveWriter(backup_file)
+        started = time.perf_counter()
+        try:
+            dump_units(units, snapshot, archive, workers, level, progress, host, port, levels)
+        except BaseException:
+            # no point finishing the schema of a dump that is thrown away
+            schema_runner.cancel()
+            raise
+        finally:
+            schema_thread.join()
+        if not schema_results or not schema_results[0].ok:
+            raise Exception("Schema dump failed: " +
+                            (schema_results[0].summary() if schema_results else "pg_dump did not start"))
+        elapsed = time.perf_counter() - started
+
+        if progress:
+            progress.finish()
+
+        manifest = {
+            'format': 'pcopy',
+            'version': MANIFEST_VERSION,
+            'database': db_name,
+            'snapshot': snapshot,
+            'source': f"{host}:{port}",
+            'created_at': datetime.now().isoformat(),
+            'schema': SCHEMA_NAME,
+            'compression': 'gzip' if compress else 'none',
+            'workers': workers,
+            'seconds': round(elapsed, 3),
+            'tables': {},
+            'sequences': sequences,
+            'large_objects': [{'file': unit['file'], 'members': unit['members'], 'objects': unit['objects']}
+                              for unit in sorted(units, key=lambda u: u['part']) if 'oids' in unit],
+            'incompressible_tables': sorted(levels),
+        }
+        for unit in sorted((u for u in units if 'oids' not in u), key=lambda u: (unit_name(u), u['part'])):
+            table = unit['table']
+            entry = manifest['tables'].setdefault(unit_name(unit), {
+                'schema': table['schema'],
+                'name': table['name'],
+                'columns': table['columns'],
+                'estimated_bytes': table['estimated_bytes'],
+                'parts': [],
+            })
+            entry['parts'].append({'file': unit['file'], 'members': unit['members'], 'bytes': unit['bytes'],
+                                   'range': unit['range'], 'seconds': unit['seconds']})
+
+        # the schema is small, the manifest goes last once every member is known
+        archive.add_file(os.path.join(temp_dir, SCHEMA_NAME), SCHEMA_NAME)
+        os.remove(os.path.join(temp_dir, SCHEMA_NAME))
+        archive.add(MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+        archive.close()
+        archive = None
+
+        objects = sum(len(batch['objects']) for batch in manifest['large_objects'])
+        print(f"Parallel COPY dump of {len(manifest['tables'])} tables"
+              + (f" and {objects} large objects" if objects else "")
+              + f" in {len(units)} parts finished in {elapsed:.1f}s with {workers} workers")
+        return backup_file
+
+    except Exception:
+        if progress:
+            progress.finish(False)
+        if archive:
+            archive.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    finally:
+        connection.close()
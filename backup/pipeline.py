@@ -0,0 +1,82 @@
+import shutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from backup.compression import CHUNK_SIZE, CODEC_SUFFIXES, codec_from_name, open_reader, open_writer
+from backup.encryption import ENCRYPTED_SUFFIX, DecryptingReader, EncryptingWriter, Keyring
+
+
+def prepare_artifact(file_path: Path, compress: bool = True, keyring: Optional[Keyring] = None,
+                     level: int = 9, codec: str = 'gzip') -> Tuple[Path, Dict]:
+    file_path = Path(file_path)
+    encrypt = keyring is not None and keyring.enabled
+    metadata = {
+        'compression': codec if compress else 'none',
+        'encryption': 'none',
+    }
+    if not compress and not encrypt:
+        return file_path, metadata
+
+    suffix = (CODEC_SUFFIXES[codec] if compress else '') + (ENCRYPTED_SUFFIX if encrypt else '')
+    artifact_path = file_path.with_name(file_path.name + suffix)
+
+    # compression feeds straight into encryption so the dump is only read once
+    with file_path.open('rb') as f_in, artifact_path.open('wb') as raw:
+        sink = raw
+        if encrypt:
+            sink = EncryptingWriter(raw, keyring)
+            metadata.update({
+                'encryption': 'aes-256-gcm-chunked',
+                'key_id': sink.key_id,
+                'chunk_size': str(sink.chunk_size),
+            })
+        if compress:
+            with open_writer(sink, codec, level) as f_out:
+                shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        else:
+            shutil.copyfileobj(f_in, sink, CHUNK_SIZE)
+        if encrypt:
+            sink.close()
+
+    return artifact_path, metadata
+
+
+def is_artifact(path) -> bool:
+    name = Path(path).name
+    return name.endswith(ENCRYPTED_SUFFIX) or codec_from_name(name) is not None
+
+
+def unpack_artifact(artifact_path: Path, dest_dir: Optional[Path] = None,
+                    keyring: Optional[Keyring] = None, remove_source: bool = True) -> Path:
+    artifact_path = Path(artifact_path)
+    dest_dir = Path(dest_dir) if dest_dir else artifact_path.parent
+    if not is_artifact(artifact_path):
+        return artifact_path
+
+    name = artifact_path.name
+    decryptor = None
+    with artifact_path.open('rb') as raw:
+        reader = raw
+        if name.endswith(ENCRYPTED_SUFFIX):
+            print(f"Decrypting {artifact_path.name}...")
+            reader = decryptor = DecryptingReader(raw, keyring or Keyring())
+            name = name[:-len(ENCRYPTED_SUFFIX)]
+        codec = codec_from_name(name)
+        if codec:
+            print(f"Decompressing {artifact_path.name}...")
+            reader = open_reader(reader, codec)
+            name = name[:-len(CODEC_SUFFIXES[codec])]
+
+        output_path = dest_dir / name
+        try:
+            with output_path.open('wb') as f_out:
+                shutil.copyfileobj(reader, f_out, CHUNK_SIZE)
+        except Exception:
+            output_path.unlink(missing_ok=True)
+            raise
+        finally:
+            if decryptor:
+                decryptor.close()
+
+    if remove_source:
+        artifact_path.unlink()
+    return output_path
@@ -1,11 +1,33 @@
 import os
-import subprocess
 import tempfile
 from datetime import datetime
+from typing import Dict, Optional
 from connectors.postgres_connector import get_connection
+from backup.resource_governor import ResourceGovernor
+from backup.process_runner import ProcessRunner
+from backup.progress import ProgressTracker
 
-def pg_backup(output_dir: str, compress: bool = False) -> str:
-    connection = get_connection()
+def table_sizes(connection) -> Dict[str, int]:
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT n.nspname || '.' || c.relname, pg_table_size(c.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r'
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%%'
+        """)
+        return {name: size for name, size in cursor.fetchall()}
+
+def database_size(connection) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_database_size(current_database())")
+        return cursor.fetchone()[0]
+
+def pg_backup(output_dir: str, compress: bool = False, governor: Optional[ResourceGovernor] = None,
+              progress: Optional[ProgressTracker] = None, timeout: Optional[int] = None,
+              compress_level: int = 9, host: Optional[str] = None, port: Optional[str] = None) -> str:
+    connection = get_connection(host=host, port=port)
     
     if not connection:
         raise Exception("Unable to connect to the PostgreSQL database")
@@ -42,7 +64,7 @@ def pg_backup(output_dir: str, compress: bool = False) -> str:
         ]
         
         if compress:
-            command.append("--compress=9")
+            command.append(f"--compress={compress_level}")
         
         env = os.environ.copy()
         env["PGSSLMODE"] = "require"
@@ -51,21 +73,30 @@ def pg_backup(output_dir: str, compress: bool = False) -> str:
         env["PGSSLKEY"] = ""
         env["PGSSLROOTCERT"] = ""
         
-        result = subprocess.run(
-            command,
-            env=env,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        
-        if result.stderr:
-            print(f"Backup warnings: {result.stderr}")
-            
+        if progress:
+            # completed tables are weighted by their on-disk size, so the
+            # estimate follows the data rather than the table count
+            sizes = table_sizes(connection)
+            progress.set_totals(
+                bytes_total=sum(sizes.values()) or database_size(connection),
+                items_total=len(sizes),
+                item_sizes=sizes
+            )
+
+        result = None
+        try:
+            result = ProcessRunner(command, env, governor, progress, timeout=timeout).run()
+        finally:
+            if progress:
+                progress.finish(result is not None and result.ok)
+
+        if not result.ok:
+            raise Exception("Backup failed: " + result.summary())
+
+        if result.warnings:
+            print("Backup warnings:\n" + result.summary())
+
         return backup_file
 
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Backup failed: {e.stderr}")
-    
     finally:
         connection.close()
@@ -0,0 +1,209 @@
+import contextlib
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Deque, Dict, List, Optional
+from backup.progress import FileReadMonitor, ProgressTracker, parse_progress_line
+from backup.resource_governor import ResourceGovernor
+
+# a single line longer than this is split, so one huge statement in an
+# error message cannot grow memory without bound
+MAX_LINE_BYTES = 64 * 1024
+
+# pg_dump: warning: could not find referenced extension 12345
+# pg_restore: error: could not execute query: ERROR:  schema "auth" already exists
+# 2024-05-01T10:00:00.000+0000    Failed: error connecting to db server
+TOOL_MESSAGE_PATTERNS = [
+    re.compile(r'^(?:pg_dump|pg_restore|pg_dumpall): (?P<level>error|warning|fatal): (?P<text>.*)$', re.I),
+    re.compile(r'^\S+\s+(?P<level>Failed|error|warning):? (?P<text>.*)$', re.I),
+]
+# follow-up lines that belong to the previous message
+CONTEXT_PREFIXES = ('Command was:', 'DETAIL:', 'HINT:', 'LINE ')
+LEVELS = {'failed': 'error', 'fatal': 'error', 'error': 'error', 'warning': 'warning'}
+
+
+@dataclass
+class ToolMessage:
+    level: str
+    text: str
+    context: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return "\n".join([f"{self.level}: {self.text}"] + [f"    {line}" for line in self.context])
+
+
+@dataclass
+class ProcessResult:
+    program: str
+    returncode: Optional[int]
+    tail: List[str]
+    messages: List[ToolMessage]
+    counts: Dict[str, int]
+    seconds: float
+    timed_out: bool = False
+    cancelled: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    @property
+    def errors(self) -> List[ToolMessage]:
+        return [m for m in self.messages if m.level == 'error']
+
+    @property
+    def warnings(self) -> List[ToolMessage]:
+        return [m for m in self.messages if m.level == 'warning']
+
+    def summary(self, limit: int = 20) -> str:
+        if self.timed_out:
+            status = f"{self.program} timed out after {self.seconds:.0f}s"
+        elif self.cancelled:
+            status = f"{self.program} was cancelled"
+        else:
+            status = f"{self.program} exited with code {self.returncode}"
+        counts = ", ".join(f"{n} {level}s" for level, n in sorted(self.counts.items()))
+        lines = [status + (f" ({counts})" if counts else "")]
+
+        shown = self.errors[:limit] or self.warnings[:limit]
+        if shown:
+            lines.extend(str(m) for m in shown)
+            hidden = len(self.errors or self.warnings) - len(shown)
+            if hidden > 0:
+                lines.append(f"... {hidden} more")
+        elif self.tail:
+            lines.append("Last output:")
+            lines.extend(self.tail[-limit:])
+        return "\n".join(lines)
+
+
+class ProcessRunner:
+    def __init__(self, command: List[str], env: Optional[Dict] = None,
+                 governor: Optional[ResourceGovernor] = None,
+                 progress: Optional[ProgressTracker] = None, monitor_file: Optional[str] = None,
+                 timeout: Optional[float] = None, max_lines: int = 200, max_messages: int = 500,
+                 kill_after: float = 10.0):
+        self.command = command
+        self.program = os.path.basename(command[0])
+        self.env = env
+        self.governor = governor
+        self.progress = progress
+        self.monitor_file = monitor_file
+        self.timeout = timeout
+        self.kill_after = kill_after
+        self.tail: Deque[str] = deque(maxlen=max_lines)
+        self.messages: List[ToolMessage] = []
+        self.max_messages = max_messages
+        self.counts = Counter()
+        self.process: Optional[subprocess.Popen] = None
+        self.timed_out = False
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def _handle_line(self, line: str):
+        self.tail.append(line)
+        if self.progress:
+            parse_progress_line(line, self.progress)
+
+        for pattern in TOOL_MESSAGE_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                level = LEVELS[match.group('level').lower()]
+                self.counts[level] += 1
+                # keep the first messages, the tail already has the latest
+                if len(self.messages) < self.max_messages:
+                    self.messages.append(ToolMessage(level, match.group('text').strip()))
+                return
+        if self.messages and line.lstrip().startswith(CONTEXT_PREFIXES) and len(self.messages[-1].context) < 5:
+            self.messages[-1].context.append(line.strip())
+
+    def _read_lines(self, stream: BinaryIO):
+        for raw in iter(lambda: stream.readline(MAX_LINE_BYTES), b''):
+            self._handle_line(raw.decode('utf-8', errors='replace').rstrip())
+
+    def _terminate(self):
+        process = self.process
+        if not process or process.poll() is not None:
+            return
+        try:
+            process.terminate()
+            # a child paused by the governor only sees SIGTERM once resumed
+            os.kill(process.pid, signal.SIGCONT)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(self.kill_after)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def _watch(self, started: float):
+        while not self._done.wait(1.0):
+            if time.monotonic() - started > self.timeout:
+                self.timed_out = True
+                print(f"{self.program} did not finish within {self.timeout}s, stopping it")
+                self._terminate()
+                return
+
+    def cancel(self):
+        self.cancelled = True
+        self._terminate()
+
+    def run(self, stdout_handler: Optional[Callable[[BinaryIO], Any]] = None) -> ProcessResult:
+        # without a handler stderr is merged into stdout and parsed line by
+        # line; with one, stdout carries data and only stderr is parsed
+        popen = self.governor.popen if self.governor else subprocess.Popen
+        started = time.monotonic()
+        self.process = popen(self.command, env=self.env, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE if stdout_handler else subprocess.STDOUT)
+        process = self.process
+
+        stderr_reader = None
+        if stdout_handler:
+            stderr_reader = threading.Thread(target=self._read_lines, args=(process.stderr,), daemon=True)
+            stderr_reader.start()
+        if self.timeout:
+            threading.Thread(target=self._watch, args=(started,), daemon=True).start()
+
+        monitor = contextlib.nullcontext()
+        if self.progress and self.monitor_file:
+            monitor = FileReadMonitor(self.progress, self.monitor_file, process.pid)
+
+        try:
+            with monitor:
+                if stdout_handler:
+                    stdout_handler(process.stdout)
+                else:
+                    self._read_lines(process.stdout)
+        except BaseException:
+            # KeyboardInterrupt or a failing handler must not leave the tool running
+            self.cancelled = True
+            self._terminate()
+            raise
+        finally:
+            # closing our end first lets a handler stop reading early
+            # without the child blocking forever on a full pipe
+            process.stdout.close()
+            returncode = process.wait()
+            self._done.set()
+            if stderr_reader:
+                stderr_reader.join()
+                process.stderr.close()
+            if self.governor:
+                self.governor.release(process)
+
+        return ProcessResult(
+            program=self.program,
+            returncode=returncode,
+            tail=list(self.tail),
+            messages=self.messages,
+            counts=dict(self.counts),
+            seconds=time.monotonic() - started,
+            timed_out=self.timed_out,
+            cancelled=self.cancelled,
+        )
+
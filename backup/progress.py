@@ -0,0 +1,245 @@
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class ProgressEvent:
+    operation: str
+    phase: str
+    bytes_done: int = 0
+    bytes_total: Optional[int] = None
+    items_done: int = 0
+    items_total: Optional[int] = None
+    current_item: Optional[str] = None
+    elapsed: float = 0.0
+    throughput: float = 0.0
+    eta_seconds: Optional[float] = None
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.bytes_total:
+            return min(100.0, self.bytes_done * 100 / self.bytes_total)
+        if self.items_total:
+            return min(100.0, self.items_done * 100 / self.items_total)
+        return None
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+class ProgressTracker:
+    def __init__(self, operation: str, callbacks: Optional[List[ProgressCallback]] = None,
+                 interval: float = 1.0):
+        self.operation = operation
+        self.callbacks = list(callbacks or [])
+        self.interval = interval
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.items_done = 0
+        self.items_total = None
+        self.item_sizes: Dict[str, int] = {}
+        self.item_started: Dict[str, float] = {}
+        self.item_seconds: Dict[str, float] = {}
+        self.completed = set()
+        self.current_item = None
+        # set while a monitor reports bytes directly, per-item sizes
+        # are only used to estimate bytes when nothing better is known
+        self.byte_source = None
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+        self.lock = threading.Lock()
+
+    def set_totals(self, bytes_total: Optional[int] = None, items_total: Optional[int] = None,
+                   item_sizes: Optional[Dict[str, int]] = None):
+        self.bytes_total = bytes_total or self.bytes_total
+        self.items_total = items_total or self.items_total
+        if item_sizes:
+            self.item_sizes = item_sizes
+        self.emit('start', force=True)
+
+    def event(self, phase: str) -> ProgressEvent:
+        elapsed = time.monotonic() - self.started
+        throughput = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.bytes_total and throughput > 0:
+            eta = max(0.0, (self.bytes_total - self.bytes_done) / throughput)
+        elif self.items_total and self.items_done:
+            eta = max(0.0, elapsed / self.items_done * (self.items_total - self.items_done))
+        return ProgressEvent(self.operation, phase, self.bytes_done, self.bytes_total,
+                             self.items_done, self.items_total, self.current_item,
+                             elapsed, throughput, eta)
+
+    def emit(self, phase: str = 'progress', force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_emit < self.interval:
+            return
+        self.last_emit = now
+        event = self.event(phase)
+        for callback in self.callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Progress callback failed: {e}")
+
+    def update_bytes(self, bytes_done: int):
+        with self.lock:
+            self.bytes_done = max(self.bytes_done, bytes_done)
+        self.emit()
+
+    def start_item(self, name: str):
+        # tools report the next table when they start it, which means
+        # the previous one has finished
+        with self.lock:
+            if self.current_item is not None:
+                self._complete(self.current_item)
+            self.current_item = name
+            self.item_started[name] = time.monotonic()
+        self.emit('item', force=True)
+
+    def _complete(self, name: str, seconds: Optional[float] = None):
+        # parallel tools can report the next item before the last one is
+        # done, so an item may be seen as finished more than once
+        if name in self.completed:
+            return
+        self.completed.add(name)
+        self.items_done += 1
+        if seconds is None and name in self.item_started:
+            seconds = time.monotonic() - self.item_started[name]
+        if seconds is not None:
+            self.item_seconds[name] = seconds
+        if self.item_sizes and not self.byte_source:
+            self.bytes_done += self.item_sizes.get(name, 0)
+
+    def complete_item(self, name: str, seconds: Optional[float] = None):
+        with self.lock:
+            if name in self.completed:
+                return
+            self._complete(name, seconds)
+            if self.current_item == name:
+                self.current_item = None
+        self.emit('item', force=True)
+
+    def finish(self, success: bool = True):
+        with self.lock:
+            if self.current_item is not None:
+                self._complete(self.current_item)
+                self.current_item = None
+            if success and self.bytes_total:
+                self.bytes_done = self.bytes_total
+        self.emit('done' if success else 'failed', force=True)
+
+
+# pg_dump: dumping contents of table "public.users"
+# pg_restore: processing data for table "public.users"
+# mongodump: writing app.users to archive on stdout
+# mongodump: done dumping app.users (42 documents)
+# mongorestore: finished restoring app.users (42 documents, 0 failures)
+ITEM_START_PATTERNS = [
+    re.compile(r'pg_dump: dumping contents of table "?([^"\s]+)"?'),
+    re.compile(r'pg_restore: processing data for table "?([^"\s]+)"?'),
+    re.compile(r'writing (\S+) to archive'),
+]
+ITEM_DONE_PATTERNS = [
+    re.compile(r'done dumping (\S+) \('),
+    re.compile(r'finished restoring (\S+) \('),
+]
+
+
+def parse_progress_line(line: str, tracker: ProgressTracker):
+    for pattern in ITEM_START_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            tracker.start_item(match.group(1))
+            return
+    for pattern in ITEM_DONE_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            tracker.complete_item(match.group(1))
+            return
+
+
+class FileReadMonitor:
+    # follows how far a child process has read into a file via /proc,
+    # which is available on Linux only; elsewhere progress falls back
+    # to per-table completion
+    def __init__(self, tracker: ProgressTracker, path: str, pid: int, interval: float = 1.0):
+        self.tracker = tracker
+        self.pid = pid
+        self.target = os.path.realpath(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _position(self) -> Optional[int]:
+        fd_dir = f"/proc/{self.pid}/fd"
+        for fd in os.listdir(fd_dir):
+            try:
+                if os.readlink(os.path.join(fd_dir, fd)) != self.target:
+                    continue
+                with open(f"/proc/{self.pid}/fdinfo/{fd}") as info:
+                    for line in info:
+                        if line.startswith('pos:'):
+                            return int(line.split()[1])
+            except OSError:
+                continue
+        return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                position = self._position()
+            except OSError:
+                return
+            if position is not None:
+                self.tracker.update_bytes(position)
+
+    def __enter__(self):
+        if os.path.isdir(f"/proc/{self.pid}/fd"):
+            self.tracker.byte_source = self.target
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def console_progress(event: ProgressEvent):
+    percent = event.percent
+    parts = [f"[{event.operation}]"]
+    parts.append(f"{percent:5.1f}%" if percent is not None else "  ...")
+    if event.bytes_total:
+        parts.append(f"{format_bytes(event.bytes_done)}/{format_bytes(event.bytes_total)}")
+    if event.items_total:
+        parts.append(f"tables {event.items_done}/{event.items_total}")
+    parts.append(f"{format_bytes(event.throughput)}/s")
+    parts.append(f"ETA {format_duration(event.eta_seconds)}")
+    if event.current_item:
+        parts.append(event.current_item)
+
+    line = " ".join(parts)
+    if sys.stdout.isatty():
+        end = "\n" if event.phase in ('done', 'failed') else ""
+        print(f"\r{line[:120]:<120}", end=end, flush=True)
+    elif event.phase in ('start', 'item', 'done', 'failed'):
+        print(line)
@@ -0,0 +1,266 @@
+import warnings
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from backup.autotuner import MB, format_bytes, format_duration
+from backup.run_history import RunHistory
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:
+    np = None
+
+DAY = 86400
+GB = 1024 ** 3
+# scales a median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 1.4826
+# deviations below this share of the median are noise even when the
+# baseline is perfectly flat
+MAD_FLOOR = 0.01
+
+
+def dump_rate(run: Dict) -> Optional[float]:
+    dump = run['stages'].get('dump', {})
+    return dump['bytes'] / dump['seconds'] if dump.get('seconds') else None
+
+
+# name, how to read it from a run record, unit, and which direction is
+# a regression: 1 higher, -1 lower, 0 either (a dump that suddenly shrinks
+# is as suspicious as one that grows)
+METRICS: List[Tuple[str, Callable[[Dict], Optional[float]], str, int]] = [
+    ('dump size', lambda run: run['stages'].get('dump', {}).get('bytes'), 'bytes', 0),
+    ('artifact size', lambda run: run['stages'].get('transfer', {}).get('bytes'), 'bytes', 0),
+    ('duration', lambda run: run.get('seconds'), 'seconds', 1),
+    ('dump time', lambda run: run['stages'].get('dump', {}).get('seconds'), 'seconds', 1),
+    ('compress time', lambda run: run['stages'].get('compress', {}).get('seconds'), 'seconds', 1),
+    ('transfer time', lambda run: run['stages'].get('transfer', {}).get('seconds'), 'seconds', 1),
+    ('dump throughput', dump_rate, 'rate', -1),
+]
+
+
+def require_numpy():
+    if np is None:
+        raise Exception("Regression detection needs the numpy package: pip install numpy")
+
+
+def run_target(run: Dict) -> str:
+    # records written before targets were tracked fall back to the engine
+    return run.get('target') or f"{run['db_type']}:{run['engine']}"
+
+
+def format_value(value: float, unit: str) -> str:
+    if unit == 'bytes':
+        return format_bytes(value)
+    if unit == 'seconds':
+        return format_duration(value)
+    return f"{value / MB:.1f}MB/s"
+
+
+def rolling_baseline(values, window: int):
+    # median and MAD of the `window` runs before each run, for every column
+    # at once; runs without enough history get NaN
+    padded = np.vstack([np.full((window, values.shape[1]), np.nan), values])
+    windows = sliding_window_view(padded, window, axis=0)[:-1]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(windows, axis=-1)
+        mad = np.nanmedian(np.abs(windows - median[..., None]), axis=-1)
+    counts = np.sum(~np.isnan(windows), axis=-1)
+    return median, mad, counts
+
+
+def robust_scores(values, window: int, min_runs: int):
+    median, mad, counts = rolling_baseline(values, window)
+    spread = np.maximum(mad * MAD_SCALE, np.abs(median) * MAD_FLOOR)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (values - median) / spread
+        change = values / median - 1
+    score[counts < min_runs] = np.nan
+    change[counts < min_runs] = np.nan
+    return score, change, median
+
+
+def linear_trends(days, values):
+    # least squares slope per day and fitted level at the latest run for
+    # every column at once, skipping missing values
+    mask = ~np.isnan(values)
+    counts = mask.sum(axis=0)
+    x_mean = np.where(mask, days[:, None], 0.0).sum(axis=0) / np.maximum(counts, 1)
+    y_mean = np.where(mask, values, 0.0).sum(axis=0) / np.maximum(counts, 1)
+    dx = np.where(mask, days[:, None] - x_mean, 0.0)
+    dy = np.where(mask, values - y_mean, 0.0)
+    variance = (dx * dx).sum(axis=0)
+    slope = np.divide((dx * dy).sum(axis=0), variance, out=np.zeros_like(variance), where=variance > 0)
+    level = y_mean - slope * x_mean
+    slope[counts < 3] = np.nan
+    return slope, level
+
+
+def days_until(level: float, slope: float, limit: float) -> Optional[float]:
+    if np.isnan(slope) or np.isnan(level):
+        return None
+    if level >= limit:
+        return 0.0
+    if slope <= 0:
+        return None
+    return (limit - level) / slope
+
+
+@dataclass
+class Report:
+    target: str
+    runs: int
+    started_at: float
+    metrics: List[Dict] = field(default_factory=list)
+    findings: List[str] = field(default_factory=list)
+    tables: List[Dict] = field(default_factory=list)
+    history: List[str] = field(default_factory=list)
+
+
+class RegressionDetector:
+    def __init__(self, settings: Dict, history: RunHistory):
+        require_numpy()
+        self.settings = settings
+        self.history = history
+        self.window = settings.get('window', 14)
+        self.min_runs = settings.get('min_runs', 5)
+        self.threshold = settings.get('threshold', 3.5)
+        self.min_change = settings.get('min_change', 0.2)
+        self.forecast_days = settings.get('forecast_days', 30)
+        self.trend_runs = settings.get('trend_runs', 30)
+        self.min_table_bytes = settings.get('min_table_mb', 64) * MB
+        window_minutes = settings.get('window_minutes')
+        self.window_seconds = window_minutes * 60 if window_minutes else None
+        storage_limit = settings.get('storage_limit_gb')
+        self.storage_limit = storage_limit * GB if storage_limit else None
+        self.retained = settings.get('retained_backups', 7)
+
+    def series(self, db_type: Optional[str] = None) -> Dict[str, List[Dict]]:
+        runs = self.history.runs(db_type, limit=self.settings.get('history_runs', 1000))
+        series = {}
+        for run in runs:
+            if run.get('stages', {}).get('dump'):
+                series.setdefault(run_target(run), []).append(run)
+        return series
+
+    def flagged(self, score, change, direction: int):
+        signed = score * direction if direction else np.abs(score)
+        return (signed > self.threshold) & (np.abs(change) > self.min_change)
+
+    def analyze(self, runs: List[Dict]) -> Report:
+        latest = runs[-1]
+        report = Report(run_target(latest), len(runs), latest['started_at'])
+        times = np.array([run['started_at'] for run in runs], dtype=float)
+        days = (times - times[-1]) / DAY
+        values = np.array([[extract(run) for _, extract, _, _ in METRICS] for run in runs], dtype=float)
+        score, change, median = robust_scores(values, self.window, self.min_runs)
+
+        for column, (name, _, unit, direction) in enumerate(METRICS):
+            if np.isnan(values[-1, column]):
+                continue
+            flagged = self.flagged(score[:, column], change[:, column], direction)
+            report.metrics.append({
+                'name': name, 'unit': unit, 'value': values[-1, column], 'median': median[-1, column],
+                'change': change[-1, column], 'score': score[-1, column], 'flagged': bool(flagged[-1]),
+            })
+            if flagged[-1]:
+                report.findings.append(
+                    f"{name} {format_value(values[-1, column], unit)} is {change[-1, column] * 100:+.0f}% "
+                    f"against the median of {format_value(median[-1, column], unit)} "
+                    f"(robust z {score[-1, column]:+.1f})")
+            for index in np.flatnonzero(flagged[:-1]):
+                report.history.append(
+                    f"{datetime.fromtimestamp(times[index]).strftime('%Y-%m-%d %H:%M')} {name} "
+                    f"{format_value(values[index, column], unit)} ({change[index, column] * 100:+.0f}%)")
+
+        self.forecast(report, days[-self.trend_runs:], values[-self.trend_runs:])
+        self.analyze_tables(report, runs, days)
+        return report
+
+    def forecast(self, report: Report, days, values):
+        slope, level = linear_trends(days, values)
+        names = [name for name, _, _, _ in METRICS]
+        if self.window_seconds:
+            column = names.index('duration')
+            left = days_until(level[column], slope[column], self.window_seconds)
+            if left is not None and left <= self.forecast_days:
+                report.findings.append(
+                    f"duration grows {format_duration(max(slope[column], 0))}/day and is projected to pass "
+                    f"the {format_duration(self.window_seconds)} window "
+                    + ("now" if left == 0 else f"in {left:.0f} days"))
+        if self.storage_limit:
+            column = names.index('artifact size')
+            # every retained copy grows along with the newest one
+            left = days_until(level[column] * self.retained, slope[column] * self.retained, self.storage_limit)
+            if left is not None and left <= self.forecast_days:
+                report.findings.append(
+                    f"{self.retained} retained backups are projected to pass the "
+                    f"{format_bytes(self.storage_limit)} storage limit "
+                    + ("now" if left == 0 else f"in {left:.0f} days")
+                    + f" (artifact grows {format_bytes(max(slope[column], 0))}/day)")
+
+    def analyze_tables(self, report: Report, runs: List[Dict], days):
+        if not runs[-1].get('tables'):
+            return
+        names = sorted(runs[-1]['tables'])
+        sizes = np.array([[run.get('tables', {}).get(name, {}).get('bytes', np.nan) for name in names]
+                          for run in runs], dtype=float)
+        seconds = np.array([[run.get('tables', {}).get(name, {}).get('seconds', np.nan) for name in names]
+                            for run in runs], dtype=float)
+        size_score, size_change, size_median = robust_scores(sizes, self.window, self.min_runs)
+        time_score, time_change, _ = robust_scores(seconds, self.window, self.min_runs)
+        slope, _ = linear_trends(days[-self.trend_runs:], sizes[-self.trend_runs:])
+        # small tables swing by large factors without mattering
+        large = sizes[-1] >= self.min_table_bytes
+        size_flagged = self.flagged(size_score[-1], size_change[-1], 0) & large
+        time_flagged = self.flagged(time_score[-1], time_change[-1], 1) & large
+
+        for index in np.argsort(-np.nan_to_num(slope, nan=-np.inf)):
+            report.tables.append({
+                'name': names[index], 'bytes': sizes[-1, index], 'growth': slope[index],
+                'change': size_change[-1, index], 'flagged': bool(size_flagged[index] or time_flagged[index]),
+            })
+        for index in np.flatnonzero(size_flagged):
+            report.findings.append(
+                f"table {names[index]} {format_bytes(sizes[-1, index])} is {size_change[-1, index] * 100:+.0f}% "
+                f"against the median of {format_bytes(size_median[-1, index])}")
+        for index in np.flatnonzero(time_flagged):
+            report.findings.append(
+                f"table {names[index]} took {format_duration(seconds[-1, index])}, "
+                f"{time_change[-1, index] * 100:+.0f}% against its median")
+
+    def reports(self, db_type: Optional[str] = None) -> List[Report]:
+        return [self.analyze(runs) for runs in self.series(db_type).values()]
+
+    def check(self, run: Dict) -> List[str]:
+        runs = self.series(run['db_type']).get(run_target(run), [])
+        if not runs or runs[-1].get('started_at') != run['started_at']:
+            return []
+        return self.analyze(runs).findings
+
+
+def format_regression(report: Report, tables: int = 10) -> List[str]:
+    started = datetime.fromtimestamp(report.started_at).strftime('%Y-%m-%d %H:%M')
+    lines = [f"{report.target}: {report.runs} runs, latest {started}"]
+    for metric in report.metrics:
+        line = f"  {metric['name']:<16} {format_value(metric['value'], metric['unit']):>10}"
+        if not np.isnan(metric['median']):
+            line += (f"  median {format_value(metric['median'], metric['unit']):>10}"
+                     f"  {metric['change'] * 100:+5.0f}%")
+            if not np.isnan(metric['score']):
+                line += f"  z {metric['score']:+5.1f}"
+        if metric['flagged']:
+            line += "  !"
+        lines.append(line)
+    if report.tables and tables:
+        lines.append("  Fastest growing tables:")
+        for table in report.tables[:tables]:
+            growth = "" if np.isnan(table['growth']) else f"{format_bytes(table['growth'])}/day"
+            lines.append(f"    {table['name']:<40} {format_bytes(table['bytes']):>10}  {growth}"
+                         + ("  !" if table['flagged'] else ""))
+    for finding in report.findings:
+        lines.append(f"  Alert: {finding}")
+    for entry in report.history:
+        lines.append(f"  Past outlier: {entry}")
+    return lines
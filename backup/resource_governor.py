@@ -0,0 +1,320 @@
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from logger import DatabaseLogger
+
+MB = 1024 * 1024
+UNLIMITED = 1e12
+
+IO_CLASSES = {
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.rate = rate
+
+    def consume(self, amount: int):
+        # large reads are split so a single call can never need more
+        # tokens than the bucket is able to hold
+        while amount > 0:
+            step = min(amount, self.burst)
+            self._consume(step)
+            amount -= step
+
+    def _consume(self, amount: float):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate if self.rate > 0 else 1
+            time.sleep(min(wait, 1))
+
+
+class ThrottledFile:
+    def __init__(self, fileobj, bucket: TokenBucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size: int = -1):
+        data = self.fileobj.read(size)
+        if data:
+            self.bucket.consume(len(data))
+        return data
+
+    def write(self, data):
+        self.bucket.consume(len(data))
+        return self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def in_window(window: Dict, now: datetime) -> bool:
+    start = datetime.strptime(window['start'], '%H:%M').time()
+    end = datetime.strptime(window['end'], '%H:%M').time()
+    days = window.get('days')
+    if days and now.strftime('%a').lower()[:3] not in [d.lower()[:3] for d in days]:
+        return False
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    # window wraps past midnight
+    return current >= start or current < end
+
+
+class ResourceGovernor:
+    def __init__(self, limits: Optional[Dict] = None, probe: Optional[Callable[[], float]] = None):
+        self.limits = limits or {}
+        self.probe = probe
+        self.adaptive = self.limits.get('adaptive', {})
+        self.factor = 1.0
+        self.latency_ms = None
+        self.processes: List[subprocess.Popen] = []
+        self.paused = False
+        self._stop = threading.Event()
+        self._monitor = None
+
+        self.upload_bucket = self._bucket('upload_mbps')
+        self.download_bucket = self._bucket('download_mbps')
+        self._apply_rates()
+
+    @classmethod
+    def from_config(cls, config: Dict, target: str, host: Optional[str] = None, port: Optional[str] = None):
+        limits = config.get('resource_limits', {}).get(target.lower())
+        if not limits:
+            return None
+
+        probe = None
+        adaptive = limits.get('adaptive')
+        if adaptive and target.lower() in LATENCY_PROBES:
+            # latency is measured on the node being backed up
+            probe = LATENCY_PROBES[target.lower()](adaptive.get('probe_query', 'SELECT 1'), host, port)
+        return cls(limits, probe)
+
+    def _bucket(self, key: str) -> Optional[TokenBucket]:
+        configured = [self.limits.get(key)] + [w.get(key) for w in self.limits.get('windows', [])]
+        configured = [mbps for mbps in configured if mbps]
+        if not configured:
+            return None
+        return TokenBucket(UNLIMITED, burst=max(max(configured) * MB / 4, MB))
+
+    def current_limits(self, now: Optional[datetime] = None) -> Dict:
+        now = now or datetime.now()
+        active = {k: v for k, v in self.limits.items() if k not in ('windows', 'adaptive')}
+        for window in self.limits.get('windows', []):
+            if in_window(window, now):
+                active.update({k: v for k, v in window.items() if k not in ('start', 'end', 'days')})
+                break
+        return active
+
+    def _apply_rates(self):
+        active = self.current_limits()
+        for bucket, key in ((self.upload_bucket, 'upload_mbps'), (self.download_bucket, 'download_mbps')):
+            if bucket:
+                bucket.set_rate(active[key] * MB * self.factor if active.get(key) else UNLIMITED)
+
+    def wrap_upload(self, fileobj):
+        return ThrottledFile(fileobj, self.upload_bucket) if self.upload_bucket else fileobj
+
+    def wrap_download(self, fileobj):
+        return ThrottledFile(fileobj, self.download_bucket) if self.download_bucket else fileobj
+
+    def wrap_command(self, command: List[str]) -> List[str]:
+        # priorities are set through wrapper commands worked out here; the
+        # forked child must not run Python while the monitor thread may hold
+        # locks it inherited
+        active = self.current_limits()
+        nice = active.get('nice')
+        if nice and shutil.which('nice'):
+            command = ['nice', '-n', str(int(nice))] + command
+        io_class = active.get('io_class')
+        if io_class and shutil.which('ionice'):
+            prefix = ['ionice', '-c', str(IO_CLASSES.get(io_class, io_class))]
+            if io_class != 'idle' and active.get('io_priority') is not None:
+                prefix += ['-n', str(active['io_priority'])]
+            command = prefix + command
+        return command
+
+    def popen(self, command: List[str], **kwargs) -> subprocess.Popen:
+        process = subprocess.Popen(self.wrap_command(command), **kwargs)
+        self.processes.append(process)
+        return process
+
+    def release(self, process: subprocess.Popen):
+        if process in self.processes:
+            self.processes.remove(process)
+
+    def run(self, command: List[str], check: bool = False, **kwargs) -> subprocess.CompletedProcess:
+        if kwargs.pop('capture_output', False):
+            kwargs['stdout'] = subprocess.PIPE
+            kwargs['stderr'] = subprocess.PIPE
+        process = self.popen(command, **kwargs)
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            self.release(process)
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    def _signal_processes(self, sig):
+        for process in list(self.processes):
+            if process.poll() is None:
+                try:
+                    os.kill(process.pid, sig)
+                except ProcessLookupError:
+                    pass
+
+    def _adjust(self):
+        try:
+            self.latency_ms = self.probe()
+        except ProbeUnavailable as e:
+            # retrying every interval would fail the same way, the limits
+            # and windows keep applying without it
+            message = f"Latency probe unavailable, adaptive throttling is off for this run: {e}"
+            print(message)
+            DatabaseLogger().warning(message)
+            self._close_probe()
+            self.probe = None
+            self.factor = 1.0
+            if self.paused:
+                self._signal_processes(signal.SIGCONT)
+                self.paused = False
+            return
+        except Exception as e:
+            print(f"Latency probe failed: {e}")
+            return
+
+        threshold = self.adaptive.get('latency_ms', 50)
+        min_factor = self.adaptive.get('min_factor', 0.1)
+        if self.latency_ms > threshold:
+            self.factor = max(min_factor, self.factor / 2)
+        else:
+            self.factor = min(1.0, self.factor * 1.25)
+
+        pause_at = self.adaptive.get('pause_latency_ms')
+        if pause_at and self.latency_ms > pause_at and not self.paused:
+            print(f"Database latency {self.latency_ms:.1f}ms, pausing child processes")
+            self._signal_processes(signal.SIGSTOP)
+            self.paused = True
+        elif self.paused and self.latency_ms <= threshold:
+            print(f"Database latency {self.latency_ms:.1f}ms, resuming child processes")
+            self._signal_processes(signal.SIGCONT)
+            self.paused = False
+
+    def _monitor_loop(self):
+        interval = self.adaptive.get('probe_interval', 5)
+        while not self._stop.wait(interval):
+            if self.adaptive and self.probe:
+                self._adjust()
+            self._apply_rates()
+
+    def start(self):
+        if self._monitor is None and (self.limits.get('windows') or (self.adaptive and self.probe)):
+            self._stop.clear()
+            self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._monitor.start()
+        return self
+
+    def _close_probe(self):
+        close = getattr(self.probe, 'close', None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                print(f"Could not close latency probe: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self.paused:
+            self._signal_processes(signal.SIGCONT)
+            self.paused = False
+        if self._monitor:
+            self._monitor.join()
+            self._monitor = None
+        # after the monitor thread is gone, so no probe is running
+        self._close_probe()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ProbeUnavailable(Exception):
+    pass
+
+
+class PostgresLatencyProbe:
+    # keeps one connection open for the whole run, closed by the governor
+    def __init__(self, query: str = "SELECT 1", host: Optional[str] = None, port: Optional[str] = None):
+        self.query = query
+        self.host = host
+        self.port = port
+        self.connection = None
+
+    def __call__(self) -> float:
+        if self.connection is None or self.connection.closed:
+            from connectors.postgres_connector import get_connection
+            self.connection = get_connection(host=self.host, port=self.port)
+            if not self.connection:
+                raise ProbeUnavailable(f"could not connect to {self.host or 'the database'}")
+            self.connection.autocommit = True
+        start = time.perf_counter()
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.query)
+            cursor.fetchall()
+        return (time.perf_counter() - start) * 1000
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
+
+
+class MongoLatencyProbe:
+    def __init__(self, query: Optional[str] = None, host: Optional[str] = None, port: Optional[str] = None):
+        self.client = None
+
+    def __call__(self) -> float:
+        if self.client is None:
+            from connectors.mongodb_connector import get_connection
+            self.client = get_connection()
+            if not self.client:
+                raise ProbeUnavailable("could not connect to MongoDB")
+        start = time.perf_counter()
+        self.client.admin.command('ping')
+        return (time.perf_counter() - start) * 1000
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+
+
+LATENCY_PROBES = {
+    'postgres': PostgresLatencyProbe,
+    'mongodb': MongoLatencyProbe,
+}
@@ -0,0 +1,61 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class RunHistory:
+    # one JSON object per line; appends are serialized with a lock so
+    # concurrent backups on the same host never interleave records
+    def __init__(self, path: str, keep: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path.with_name(f".{self.path.name}.lock")
+        self.keep = keep
+
+    @classmethod
+    def from_config(cls, config: Dict):
+        settings = config.get('run_history', {})
+        return cls(settings.get('path', os.path.join(config['local_storage_dir'], '.run_history.jsonl')),
+                   settings.get('keep', 1000))
+
+    def _read(self) -> List[Dict]:
+        runs = []
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        runs.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return runs
+
+    def record(self, run: Dict):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(run, sort_keys=True) + "\n")
+                runs = self._read()
+                if self.keep and len(runs) > 2 * self.keep:
+                    self._trim(runs[-self.keep:])
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _trim(self, runs: List[Dict]):
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, 'w') as f:
+            for run in runs:
+                f.write(json.dumps(run, sort_keys=True) + "\n")
+        os.replace(tmp, self.path)
+
+    def runs(self, db_type: Optional[str] = None, engine: Optional[str] = None, limit: int = 50,
+             successful: bool = True) -> List[Dict]:
+        runs = [run for run in self._read()
+                if (db_type is None or run.get('db_type') == db_type)
+                and (engine is None or run.get('engine') == engine)
+                and (not successful or run.get('success'))]
+        return runs[-limit:]
@@ -0,0 +1,115 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+from connectors.postgres_connector import get_connection
+
+# a replica that has replayed everything it received from a live stream is
+# current; otherwise the age of the last replayed transaction is the lag,
+# which errs on the side of skipping a replica that lost its primary
+STATUS_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                     AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8,
+                              'Infinity'::float8)
+           END,
+           (SELECT count(*) FROM pg_stat_activity
+             WHERE state <> 'idle' AND backend_type = 'client backend' AND pid <> pg_backend_pid())
+"""
+
+
+@dataclass
+class Source:
+    host: str
+    port: str
+    role: str = 'primary'
+    lag_seconds: Optional[float] = None
+    active: Optional[int] = None
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def describe(self) -> str:
+        if self.error:
+            return f"{self.address} unreachable: {self.error}"
+        if self.latency_ms is None:
+            return f"{self.address} ({self.role})"
+        lag = f"lag {self.lag_seconds:.1f}s, " if self.lag_seconds is not None else ""
+        return f"{self.address} ({self.role}, {lag}{self.active} active sessions, {self.latency_ms:.1f}ms)"
+
+    def metadata(self) -> Dict[str, str]:
+        return {
+            'source_host': self.address,
+            'source_role': self.role,
+            'source_lag_seconds': f"{self.lag_seconds or 0:.1f}",
+        }
+
+
+def parse_candidate(candidate: Union[str, Dict], default_port: str) -> Source:
+    if isinstance(candidate, dict):
+        return Source(candidate['host'], str(candidate.get('port', default_port)), 'replica')
+    host, _, port = candidate.partition(':')
+    return Source(host, port or default_port, 'replica')
+
+
+def probe_source(source: Source, timeout: int) -> Source:
+    connection = get_connection(host=source.host, port=source.port, connect_timeout=timeout)
+    if not connection:
+        source.error = "connection failed"
+        return source
+    try:
+        connection.autocommit = True
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(STATUS_QUERY)
+            in_recovery, lag, active = cursor.fetchone()
+        source.latency_ms = (time.perf_counter() - started) * 1000
+        source.role = 'replica' if in_recovery else 'primary'
+        source.lag_seconds = float(lag) if in_recovery else None
+        source.active = active
+    except Exception as e:
+        source.error = str(e)
+    finally:
+        connection.close()
+    return source
+
+
+def select_source(settings: Dict) -> Source:
+    default_port = os.getenv("SUPABASE_PORT", "5432")
+    primary = Source(os.getenv("SUPABASE_HOST"), default_port)
+    candidates = [parse_candidate(candidate, default_port) for candidate in settings.get('replicas', [])]
+    if not candidates:
+        return primary
+
+    max_lag = settings.get('max_lag_seconds', 300)
+    max_active = settings.get('max_active')
+    timeout = settings.get('connect_timeout', 5)
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        probed = list(pool.map(lambda source: probe_source(source, timeout), candidates))
+
+    eligible: List[Source] = []
+    for source in probed:
+        if source.error:
+            reason = source.error
+        elif source.role != 'replica':
+            reason = "not in recovery"
+        elif source.lag_seconds > max_lag:
+            reason = f"lag {source.lag_seconds:.1f}s over {max_lag}s"
+        elif max_active is not None and source.active > max_active:
+            reason = f"{source.active} active sessions over {max_active}"
+        else:
+            eligible.append(source)
+            continue
+        print(f"Skipping backup source {source.address}: {reason}")
+
+    if eligible:
+        # fewest running queries, then the quickest to answer
+        return min(eligible, key=lambda source: (source.active, source.latency_ms))
+    print("No replica is usable, backing up from the primary")
+    return primary
@@ -0,0 +1,184 @@
+"""Compare the CPU spent compressing a blob-heavy dump with and without the
+content-aware path, on a synthetic database generated in memory.
+
+    python benchmarks/blob_compression.py --mb 512 --blob-share 0.8
+
+The synthetic database has a table of already compressed bytea payloads
+(written the way COPY emits them, hex encoded), a table of compressible
+text rows, and large objects of both kinds. The baseline compresses every
+stream at --level like pg_dump --compress and then compresses the finished
+dump again like the artifact stage. The content-aware path samples the
+payloads, uses --incompressible-level for the packed table, stores packed
+large objects as they are, and skips the second pass.
+"""
+import argparse
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backup.content_profile import INCOMPRESSIBLE_RATIO, SAMPLE_BYTES, compressed_ratio
+from backup.parallel_copy_backup import dump_large_objects
+from backup.pipeline import prepare_artifact
+
+MB = 1024 * 1024
+WORDS = ("order shipped invoice customer pending refunded warehouse status created updated "
+         "payment card region north south east west priority normal express").split()
+
+
+def text_block(size: int, seed: int) -> bytes:
+    # built once and sliced, so generating the data costs far less than
+    # compressing it; gzip only looks back 32KB and never sees the repeats
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(size // 6 + 1)).encode()[:size]
+
+
+TEXT = text_block(MB, 0)
+
+
+class SyntheticObject:
+    def __init__(self, size: int, packed: bool, seed: int):
+        self.remaining = size
+        self.packed = packed
+        self.random = random.Random(seed)
+        self.offset = 0
+
+    def read(self, size: int) -> bytes:
+        size = min(size, self.remaining)
+        self.remaining -= size
+        if self.packed:
+            return self.random.randbytes(size)
+        chunk = b''
+        while len(chunk) < size:
+            chunk += TEXT[self.offset:self.offset + size - len(chunk)]
+            self.offset = (self.offset + len(chunk)) % len(TEXT)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class SyntheticConnection:
+    # stands in for a psycopg2 connection, handing out large objects
+    def __init__(self, objects):
+        self.objects = objects
+
+    def lobject(self, oid: int, mode: str = 'rb'):
+        size, packed = self.objects[oid]
+        return SyntheticObject(size, packed, oid)
+
+
+def blob_rows(total: int, blob_size: int, seed: int):
+    rng = random.Random(seed)
+    for row in range((total + blob_size - 1) // blob_size):
+        # COPY text format writes bytea as \\x followed by hex digits
+        yield f"{row}\tscan_{row}.jpg\t\\\\x{rng.randbytes(blob_size).hex()}\n".encode()
+
+
+def text_rows(total: int, seed: int):
+    rng = random.Random(seed)
+    messages = [" ".join(rng.choice(WORDS) for _ in range(20)) for _ in range(4096)]
+    written = 0
+    row = 0
+    while written < total:
+        line = (f"{row}\t2024-01-{row % 28 + 1:02d} 12:{row % 60:02d}:00\t"
+                f"{messages[rng.randrange(len(messages))]}\n").encode()
+        written += len(line)
+        row += 1
+        yield line
+
+
+def write_stream(path: Path, rows, level: int) -> int:
+    raw_bytes = 0
+    with gzip.open(path, 'wb', compresslevel=level) as out:
+        for row in rows:
+            out.write(row)
+            raw_bytes += len(row)
+    return raw_bytes
+
+
+def measure(label: str, func):
+    cpu, wall = time.process_time(), time.perf_counter()
+    result = func()
+    return label, time.process_time() - cpu, time.perf_counter() - wall, result
+
+
+def run(args):
+    blob_bytes = int(args.mb * MB * args.blob_share / 2)
+    text_bytes = int(args.mb * MB * (1 - args.blob_share))
+    object_size = args.object_mb * MB
+    count = max(1, blob_bytes // object_size)
+    # half of the large objects are scans and archives, half are text
+    objects = {oid: (object_size, oid % 2 == 1) for oid in range(1, count + 1)}
+    work_dir = Path(tempfile.mkdtemp(prefix="blob_benchmark_"))
+
+    def baseline():
+        dump = work_dir / "baseline.dump"
+        parts = [
+            write_stream(work_dir / "documents.gz", blob_rows(blob_bytes, args.blob_kb * 1024, 1), args.level),
+            write_stream(work_dir / "events.gz", text_rows(text_bytes, 2), args.level),
+        ]
+        connection = SyntheticConnection({oid: (size, packed) for oid, (size, packed) in objects.items()})
+        with gzip.open(work_dir / "objects.gz", 'wb', compresslevel=args.level) as out:
+            for oid in objects:
+                lob = connection.lobject(oid)
+                for chunk in iter(lambda: lob.read(MB), b''):
+                    out.write(chunk)
+        with dump.open('wb') as out:
+            for name in ("documents.gz", "events.gz", "objects.gz"):
+                with (work_dir / name).open('rb') as part:
+                    shutil.copyfileobj(part, out)
+        dumped = dump.stat().st_size
+        artifact, _ = prepare_artifact(dump, True, level=args.level, codec='gzip')
+        return sum(parts), dumped, artifact.stat().st_size
+
+    def content_aware():
+        # what profile_content does against the database: a prefix of a few values
+        sample = b''.join(random.Random(1).randbytes(SAMPLE_BYTES) for _ in range(args.sample_rows))
+        packed = compressed_ratio(sample) >= INCOMPRESSIBLE_RATIO
+        level = args.incompressible_level if packed else args.level
+        parts = [
+            write_stream(work_dir / "documents.aware.gz", blob_rows(blob_bytes, args.blob_kb * 1024, 1), level),
+            write_stream(work_dir / "events.aware.gz", text_rows(text_bytes, 2), args.level),
+        ]
+        with open(work_dir / "objects.aware.gz", 'wb') as out:
+            dump_large_objects(SyntheticConnection(objects), list(objects), out, args.level)
+        size = sum((work_dir / name).stat().st_size
+                   for name in ("documents.aware.gz", "events.aware.gz", "objects.aware.gz"))
+        return sum(parts), size, size
+
+    try:
+        results = [measure("baseline", baseline), measure("content-aware", content_aware)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    raw = results[0][3][0] + sum(size for size, _ in objects.values())
+    print(f"Synthetic database: {args.mb}MB, {args.blob_share * 100:.0f}% in bytea and large objects, "
+          f"{raw / MB:.0f}MB once bytea is hex encoded for COPY")
+    print(f"{'path':<15} {'cpu':>8} {'wall':>8} {'dump':>10} {'stored':>10}")
+    for label, cpu, wall, (_, dumped, stored) in results:
+        print(f"{label:<15} {cpu:7.1f}s {wall:7.1f}s {dumped / MB:8.1f}MB {stored / MB:8.1f}MB")
+    saved = results[0][1] - results[1][1]
+    print(f"CPU saved: {saved:.1f}s ({saved / results[0][1] * 100:.0f}%), stored size "
+          f"{(results[1][3][2] / results[0][3][2] - 1) * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=256, help='Size of the synthetic database')
+    parser.add_argument('--blob-share', type=float, default=0.8, help='Share of bytea and large object data')
+    parser.add_argument('--blob-kb', type=int, default=256, help='Size of each bytea value')
+    parser.add_argument('--object-mb', type=int, default=4, help='Size of each large object')
+    parser.add_argument('--level', type=int, default=9, help='pg_dump --compress and artifact level')
+    parser.add_argument('--incompressible-level', type=int, default=1, help='Level for packed tables')
+    parser.add_argument('--sample-rows', type=int, default=50, help='Values sampled per column')
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measure what the encryption stage adds to the artifact stage.
+
+    python benchmarks/encryption_throughput.py --mb 1024 --workers 8
+
+Runs prepare_artifact on a synthetic dump with and without encryption, for
+both an uncompressed artifact and the default gzip one, and then unpacks the
+encrypted artifact again. The dump is a mix of text rows and random bytes so
+compression has real work to do.
+"""
+import argparse
+import base64
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backup.encryption import DEFAULT_CHUNK_SIZE, Keyring
+from backup.pipeline import prepare_artifact, unpack_artifact
+
+MB = 1024 * 1024
+WORDS = ("order shipped invoice customer pending refunded warehouse status created updated "
+         "payment card region north south east west priority normal express").split()
+
+
+def write_dump(path: Path, size: int):
+    rng = random.Random(0)
+    text = " ".join(rng.choice(WORDS) for _ in range(MB // 6)).encode()[:MB]
+    with path.open('wb') as out:
+        for block in range(size // MB):
+            # one block in four is packed data, the rest compresses well
+            out.write(rng.randbytes(MB) if block % 4 == 0 else text)
+
+
+def timed(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(args):
+    os.environ["BACKUP_ENCRYPTION_KEY_BENCHMARK"] = base64.b64encode(os.urandom(32)).decode()
+    keyring = Keyring({'enabled': True, 'key_id': 'benchmark', 'chunk_size': args.chunk_size,
+                       'workers': args.workers})
+    work_dir = Path(tempfile.mkdtemp(prefix="encryption_benchmark_"))
+    try:
+        dump = work_dir / "bench.dump"
+        write_dump(dump, args.mb * MB)
+        size = dump.stat().st_size
+
+        def artifact(compress: bool, encrypted: bool):
+            def build():
+                path, _ = prepare_artifact(dump, compress, keyring if encrypted else None, level=args.level)
+                if path != dump:
+                    path.unlink()
+            return build
+
+        def unpack():
+            path, _ = prepare_artifact(dump, False, keyring)
+            unpack_dir = work_dir / "unpacked"
+            unpack_dir.mkdir(exist_ok=True)
+            started = time.perf_counter()
+            unpack_artifact(path, unpack_dir, keyring)
+            elapsed = time.perf_counter() - started
+            shutil.rmtree(unpack_dir)
+            return elapsed
+
+        def copy():
+            shutil.copyfile(dump, work_dir / "copy.dump")
+            (work_dir / "copy.dump").unlink()
+
+        print(f"Synthetic dump: {size / MB:.0f}MB, chunk size {args.chunk_size // 1024}KB, "
+              f"{args.workers} workers, best of {args.repeat}")
+        print(f"{'stage':<28} {'seconds':>8} {'MB/s':>8} {'overhead':>9}")
+        rows = [
+            ("plain copy", timed(copy, args.repeat), None),
+            ("encrypt", timed(artifact(False, True), args.repeat), 0),
+            (f"gzip -{args.level}", timed(artifact(True, False), args.repeat), None),
+            (f"gzip -{args.level} + encrypt", timed(artifact(True, True), args.repeat), 2),
+            ("decrypt (unpack)", min(unpack() for _ in range(args.repeat)), 0),
+        ]
+        for label, seconds, baseline in rows:
+            overhead = ""
+            if baseline is not None:
+                overhead = f"{(seconds / rows[baseline][1] - 1) * 100:+8.1f}%"
+            print(f"{label:<28} {seconds:8.2f} {size / MB / seconds:8.0f} {overhead:>9}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=256, help='Size of the synthetic dump')
+    parser.add_argument('--level', type=int, default=6, help='gzip level of the compressed artifact')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Encryption chunk size')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Encryption threads')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, the fastest is shown')
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
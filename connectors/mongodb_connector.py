@@ -1,23 +1,33 @@
-import mysql.connector
-from mysql.connector import Error
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from urllib.parse import quote_plus
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+load_dotenv(dotenv_path='.env.local')
+
+def get_uri(db_name: str = None) -> str:
+    host = os.getenv("MGDB_HOST", "localhost")
+    port = os.getenv("MGDB_PORT", "27017")
+    user = os.getenv("MGDB_USER")
+    pwd = os.getenv("MGDB_PASSWORD")
+
+    credentials = ""
+    if user and pwd:
+        credentials = f"{quote_plus(user)}:{quote_plus(pwd)}@"
+
+    uri = f"mongodb://{credentials}{host}:{port}/"
+    if db_name:
+        uri += db_name
+    if credentials:
+        uri += f"?authSource={os.getenv('MGDB_AUTH_SOURCE', 'admin')}"
+    return uri
 
 def get_connection():
     try:
-        connection = mysql.connector.connect(
-            database=os.getenv("MGDB_NAME"),
-            user=os.getenv("MGDB_USER"),
-            host=os.getenv("MGDB_HOST"),
-            password=os.getenv("MGDB_PASSWORD"),
-            port=os.getenv("MGDB_PORT")
-        )
+        client = MongoClient(get_uri(), serverSelectionTimeoutMS=5000)
+        client.admin.command("ping")
         print("Connection successful")
-        return connection
-    except Error as e:
+        return client
+    except PyMongoError as e:
         print(f"Error: {e}")
-        
-    
-get_connection()
\ No newline at end of file
@@ -1,18 +1,21 @@
 import psycopg2
 from psycopg2 import Error
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path='.env.local')
 
-def get_connection():
+def get_connection(database: Optional[str] = None, host: Optional[str] = None, port: Optional[str] = None,
+                   connect_timeout: Optional[int] = None):
     try:
         connection = psycopg2.connect(
-            database=os.getenv("SUPABASE_NAME"),
+            database=database or os.getenv("SUPABASE_NAME"),
             user=os.getenv("SUPABASE_USER"),
-            host=os.getenv("SUPABASE_HOST"),
+            host=host or os.getenv("SUPABASE_HOST"),
             password=os.getenv("SUPABASE_PASSWORD"),
-            port=os.getenv("SUPABASE_PORT")
+            port=port or os.getenv("SUPABASE_PORT"),
+            connect_timeout=connect_timeout
         )
         print("Connection successful")
         return connection
@@ -0,0 +1,393 @@
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from backup.parallel_copy_backup import MANIFEST_NAME, PCOPY_EXTENSION, SCHEMA_NAME, archive_members, open_part
+from backup.process_runner import ProcessRunner
+from storage.formats import BACKUP_EXTENSIONS, base_backup_name
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_MANIFEST = 'manifest.json'
+EXPORT_VERSION = 1
+
+IDENTIFIER = r'(?:"(?:[^"]|"")*"|[^\s".(]+)'
+# CREATE TABLE public.users (     CREATE UNLOGGED TABLE "Sales"."Order Lines" (
+CREATE_TABLE_PATTERN = re.compile(rf'^CREATE (?:UNLOGGED )?TABLE ({IDENTIFIER}(?:\.{IDENTIFIER})?) \($')
+# COPY public.users (id, email, created_at) FROM stdin;
+COPY_HEADER_PATTERN = re.compile(rf'^COPY ({IDENTIFIER}(?:\.{IDENTIFIER})?) \((.*)\) FROM stdin;$')
+IDENTIFIER_PATTERN = re.compile(r'"((?:[^"]|"")*)"|([^,."\s]+)')
+COLUMN_PATTERN = re.compile(r'^\s+("(?:[^"]|"")*"|\S+) (.+?),?$')
+# where the type ends and the column options start
+TYPE_END_PATTERN = re.compile(r' (?:DEFAULT|NOT NULL|NULL|COLLATE|GENERATED|CONSTRAINT|CHECK)\b')
+COPY_ESCAPE_PATTERN = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+INTEGER_TYPES = {'smallint': 'int16', 'integer': 'int32', 'bigint': 'int64'}
+FLOAT_TYPES = {'real': 'float32', 'double precision': 'float64'}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise Exception("Columnar export needs the pyarrow package: pip install pyarrow")
+
+
+def export_name(backup_file: str) -> str:
+    # 20240101_020000_supabase_backup_db_20240101020000.dump.gz.enc
+    #   -> 20240101_020000_supabase_backup_db_20240101020000
+    name = base_backup_name(backup_file)
+    for extension in BACKUP_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def split_identifiers(text: str) -> List[str]:
+    return [plain or quoted.replace('""', '"') for quoted, plain in IDENTIFIER_PATTERN.findall(text)]
+
+
+def qualified_name(text: str) -> Tuple[str, str]:
+    parts = split_identifiers(text)
+    if len(parts) == 1:
+        return 'public', parts[0]
+    return parts[0], parts[1]
+
+
+def copy_fields(line: str) -> List[Optional[str]]:
+    # COPY text format: tab separated, \N for NULL, backslash escapes
+    fields = []
+    for field in line.rstrip('\n').split('\t'):
+        if field == '\\N':
+            fields.append(None)
+        elif '\\' in field:
+            fields.append(COPY_ESCAPE_PATTERN.sub(_unescape, field))
+        else:
+            fields.append(field)
+    return fields
+
+
+def _unescape(match) -> str:
+    code = match.group(1)
+    if code[0] == 'x' and len(code) > 1:
+        return chr(int(code[1:], 16))
+    if code[0] in '01234567':
+        return chr(int(code, 8))
+    return COPY_ESCAPES.get(code, code)
+
+
+def parse_tables(schema_sql: Iterable[str]) -> Dict[str, List[Tuple[str, str]]]:
+    # column names and types from the CREATE TABLE statements printed by
+    # pg_restore --schema-only; generated columns carry no data
+    tables = {}
+    columns = None
+    for line in schema_sql:
+        line = line.rstrip('\n')
+        if columns is None:
+            match = CREATE_TABLE_PATTERN.match(line)
+            if match:
+                schema, name = qualified_name(match.group(1))
+                columns = tables.setdefault(f"{schema}.{name}", [])
+            continue
+        if line.startswith(')'):
+            columns = None
+            continue
+        match = COLUMN_PATTERN.match(line)
+        if not match or match.group(1) in ('CONSTRAINT', 'CHECK', 'LIKE'):
+            continue
+        definition = match.group(2)
+        if 'GENERATED ALWAYS AS (' in definition:
+            continue
+        column_type = TYPE_END_PATTERN.split(definition, 1)[0]
+        columns.append((split_identifiers(match.group(1))[0], column_type))
+    return tables
+
+
+def arrow_type(pg_type: str):
+    pg_type = pg_type.lower().replace('pg_catalog.', '')
+    if pg_type.endswith(']'):
+        return pa.string()
+    numeric = re.match(r'^numeric\((\d+)(?:,(\d+))?\)$', pg_type)
+    if numeric and int(numeric.group(1)) <= 38:
+        return pa.decimal128(int(numeric.group(1)), int(numeric.group(2) or 0))
+    base = re.sub(r'\(\d+\)', '', pg_type)
+    if base in INTEGER_TYPES:
+        return getattr(pa, INTEGER_TYPES[base])()
+    if base in FLOAT_TYPES:
+        return getattr(pa, FLOAT_TYPES[base])()
+    if base == 'boolean':
+        return pa.bool_()
+    if base == 'date':
+        return pa.date32()
+    if base == 'timestamp without time zone':
+        return pa.timestamp('us')
+    if base == 'timestamp with time zone':
+        return pa.timestamp('us', tz='UTC')
+    if base == 'bytea':
+        return pa.binary()
+    # numeric without a precision, uuid, json, text, intervals, enums ...
+    return pa.string()
+
+
+def _timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _decimal(value: str) -> Decimal:
+    parsed = Decimal(value)
+    if not parsed.is_finite():
+        raise ValueError(f"{value} does not fit a decimal column")
+    return parsed
+
+
+def _bytea(value: str) -> bytes:
+    if value.startswith('\\x'):
+        return bytes.fromhex(value[2:])
+    return value.encode('latin-1', errors='replace')
+
+
+def value_converter(data_type) -> Callable[[str], Any]:
+    if pa.types.is_integer(data_type):
+        return int
+    if pa.types.is_floating(data_type):
+        return float
+    if pa.types.is_boolean(data_type):
+        return lambda value: value == 't'
+    if pa.types.is_date(data_type):
+        return date.fromisoformat
+    if pa.types.is_timestamp(data_type):
+        return _timestamp if data_type.tz else datetime.fromisoformat
+    if pa.types.is_decimal(data_type):
+        return _decimal
+    if pa.types.is_binary(data_type):
+        return _bytea
+    return str
+
+
+class TableWriter:
+    def __init__(self, path: Path, columns: List[Tuple[str, str]], row_group_rows: int, compression: str):
+        self.path = path
+        self.row_group_rows = row_group_rows
+        self.schema = pa.schema([pa.field(name, arrow_type(pg_type)) for name, pg_type in columns])
+        self.pg_types = [pg_type for _, pg_type in columns]
+        self.converters = [value_converter(field.type) for field in self.schema]
+        self.buffers = [[] for _ in columns]
+        self.writer = pq.ParquetWriter(str(path), self.schema, compression=compression, write_statistics=True)
+        self.rows = 0
+        self.row_groups = 0
+        # values Arrow cannot represent, e.g. 'infinity' timestamps or BC
+        # dates, are written as NULL and counted
+        self.unconverted = 0
+
+    def add(self, fields: List[Optional[str]]):
+        for value, buffer, convert in zip(fields, self.buffers, self.converters):
+            if value is not None:
+                try:
+                    value = convert(value)
+                except (ValueError, ArithmeticError):
+                    value = None
+                    self.unconverted += 1
+            buffer.append(value)
+        self.rows += 1
+        if self.buffers and len(self.buffers[0]) >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffers or not self.buffers[0]:
+            return
+        arrays = [pa.array(buffer, type=field.type) for buffer, field in zip(self.buffers, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.row_group_rows)
+        self.row_groups += 1
+        self.buffers = [[] for _ in self.buffers]
+
+    def close(self) -> Dict:
+        self.flush()
+        self.writer.close()
+        return {
+            'file': self.path.name,
+            'rows': self.rows,
+            'row_groups': self.row_groups,
+            'bytes': self.path.stat().st_size,
+            'unconverted': self.unconverted,
+            'columns': [{'name': field.name, 'type': str(field.type), 'pg_type': pg_type}
+                        for field, pg_type in zip(self.schema, self.pg_types)],
+        }
+
+
+def read_schema(schema_file: str) -> Dict[str, List[Tuple[str, str]]]:
+    lines = []
+
+    def collect(stdout):
+        for raw in stdout:
+            lines.append(raw.decode('utf-8', errors='replace'))
+
+    result = ProcessRunner(["pg_restore", "--schema-only", "--section=pre-data", "--file=-",
+                            str(schema_file)]).run(collect)
+    if not result.ok:
+        raise Exception(f"Could not read the schema of {schema_file}: {result.summary()}")
+    return parse_tables(lines)
+
+
+def export_dump_table(backup_file: str, table: Dict, path: Path, row_group_rows: int,
+                      compression: str) -> Dict:
+    # pg_restore decompresses just this table's data and prints it as COPY text
+    state = {'writer': None}
+
+    def convert(stdout):
+        writer = None
+        for raw in stdout:
+            line = raw.decode('utf-8', errors='replace')
+            if writer is None:
+                match = COPY_HEADER_PATTERN.match(line.rstrip('\n'))
+                if match:
+                    types = dict(table['columns'])
+                    columns = [(name, types.get(name, 'text')) for name in split_identifiers(match.group(2))]
+                    writer = state['writer'] = TableWriter(path, columns, row_group_rows, compression)
+                continue
+            if line == '\\.\n':
+                break
+            writer.add(copy_fields(line))
+
+    command = ["pg_restore", "--data-only", f"--schema={table['schema']}", f"--table={table['name']}",
+               "--file=-", str(backup_file)]
+    result = ProcessRunner(command).run(convert)
+    # the handler stops at the end of the COPY block; pg_restore may die
+    # from the closed pipe after that, which is not an error
+    if not result.ok and not (state['writer'] and result.returncode == -13):
+        raise Exception(f"Reading {table['schema']}.{table['name']} failed: {result.summary()}")
+    writer = state['writer'] or TableWriter(path, table['columns'], row_group_rows, compression)
+    return writer.close()
+
+
+def export_pcopy_table(backup_file: str, table: Dict, path: Path, row_group_rows: int,
+                       compression: str) -> Dict:
+    types = dict(table['columns'])
+    columns = [(name, types.get(name, 'text')) for name in table['copy_columns']]
+    writer = TableWriter(path, columns, row_group_rows, compression)
+    members = archive_members(backup_file)
+    for part in table['parts']:
+        with open_part(backup_file, members, part, table['compression']) as raw:
+            for line in io.TextIOWrapper(raw, encoding='utf-8', newline='\n'):
+                writer.add(copy_fields(line))
+    return writer.close()
+
+
+def export_table(backup_file: str, table: Dict, output_dir: str, row_group_rows: int,
+                 compression: str) -> Dict:
+    started = time.perf_counter()
+    path = Path(output_dir) / f"{table['schema']}.{table['name']}.parquet"
+    if table.get('parts') is not None:
+        stats = export_pcopy_table(backup_file, table, path, row_group_rows, compression)
+    else:
+        stats = export_dump_table(backup_file, table, path, row_group_rows, compression)
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def plan_tables(backup_file: str, work_dir: str, selected: Optional[List[str]] = None) -> List[Dict]:
+    if backup_file.endswith(PCOPY_EXTENSION):
+        with tarfile.open(backup_file, 'r') as archive:
+            manifest = json.load(archive.extractfile(MANIFEST_NAME))
+            archive.extract(SCHEMA_NAME, work_dir)
+        schema = read_schema(os.path.join(work_dir, SCHEMA_NAME))
+        tables = [{
+            'schema': entry['schema'],
+            'name': entry['name'],
+            'columns': schema.get(qualified, []),
+            'copy_columns': entry['columns'],
+            'parts': entry['parts'],
+            'compression': manifest.get('compression', 'gzip'),
+            'estimated_bytes': entry['estimated_bytes'],
+        } for qualified, entry in manifest['tables'].items()]
+    elif backup_file.endswith('.dump'):
+        tables = []
+        for qualified, columns in read_schema(backup_file).items():
+            schema, name = qualified.split('.', 1)
+            tables.append({'schema': schema, 'name': name, 'columns': columns, 'estimated_bytes': 0})
+    else:
+        raise Exception("Columnar export is only available for PostgreSQL backups")
+
+    if selected:
+        wanted = {name if '.' in name else f"public.{name}" for name in selected}
+        tables = [table for table in tables if f"{table['schema']}.{table['name']}" in wanted]
+        missing = wanted - {f"{table['schema']}.{table['name']}" for table in tables}
+        if missing:
+            raise Exception(f"Tables not found in the backup: {', '.join(sorted(missing))}")
+    # largest first, so a huge table never ends up running alone at the end
+    tables.sort(key=lambda table: table['estimated_bytes'], reverse=True)
+    return tables
+
+
+def export_columnar(backup_file: str, export_dir: str, workers: int = 4, row_group_rows: int = 128 * 1024,
+                    compression: str = 'zstd', tables: Optional[List[str]] = None) -> str:
+    require_pyarrow()
+    name = export_name(backup_file)
+    final_dir = Path(export_dir) / name
+    partial_dir = Path(export_dir) / f".{name}.partial"
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    partial_dir.mkdir(parents=True)
+    work_dir = tempfile.mkdtemp(prefix="export_")
+
+    try:
+        started = time.perf_counter()
+        planned = plan_tables(str(backup_file), work_dir, tables)
+        print(f"Exporting {len(planned)} tables from {Path(backup_file).name} with {workers} workers")
+
+        manifest = {
+            'format': 'parquet',
+            'version': EXPORT_VERSION,
+            'backup': Path(backup_file).name,
+            'created_at': datetime.now().isoformat(),
+            'compression': compression,
+            'row_group_rows': row_group_rows,
+            'tables': {},
+        }
+        # converting COPY text is pure Python, so tables run in separate
+        # processes rather than threads
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(export_table, str(backup_file), table, str(partial_dir), row_group_rows,
+                            compression): f"{table['schema']}.{table['name']}"
+                for table in planned
+            }
+            for future in as_completed(futures):
+                qualified = futures[future]
+                stats = future.result()
+                manifest['tables'][qualified] = stats
+                line = (f"Exported {qualified}: {stats['rows']} rows in {stats['row_groups']} row groups "
+                        f"({stats['bytes'] / (1024 * 1024):.1f}MB, {stats['seconds']:.1f}s)")
+                if stats['unconverted']:
+                    line += f", {stats['unconverted']} values written as NULL"
+                print(line)
+
+        manifest['tables'] = dict(sorted(manifest['tables'].items()))
+        manifest['seconds'] = round(time.perf_counter() - started, 3)
+        with open(partial_dir / EXPORT_MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(partial_dir, final_dir)
+        rows = sum(stats['rows'] for stats in manifest['tables'].values())
+        print(f"Export of {len(manifest['tables'])} tables ({rows} rows) finished in {manifest['seconds']:.1f}s: {final_dir}")
+        return str(final_dir)
+
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,151 @@
+import json
+import operator
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from export.columnar_export import EXPORT_MANIFEST, export_name, require_pyarrow, split_identifiers, value_converter
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+# cloud reads fetch this much at a time, so only the footer and the
+# selected column chunks of the selected row groups are downloaded
+QUERY_READ_SIZE = 1024 * 1024
+
+# id>=1000    created_at<2024-06-01    "Status"=active
+FILTER_PATTERN = re.compile(r'^\s*("(?:[^"]|"")*"|[^<>=!\s]+)\s*(=|!=|<=|>=|<|>)\s*(.*?)\s*$')
+OPERATORS = {
+    '=': ('equal', operator.eq),
+    '!=': ('not_equal', operator.ne),
+    '<': ('less', operator.lt),
+    '<=': ('less_equal', operator.le),
+    '>': ('greater', operator.gt),
+    '>=': ('greater_equal', operator.ge),
+}
+
+
+class ExportSource:
+    def __init__(self, name: str, export_dir: Optional[str] = None, bucket=None, prefix: str = 'exports/'):
+        self.name = export_name(name)
+        self.export_dir = Path(export_dir) / self.name if export_dir else None
+        self.bucket = bucket
+        self.prefix = f"{prefix}{self.name}/"
+
+    def manifest(self) -> Dict:
+        if self.bucket is not None:
+            blob = self.bucket.blob(self.prefix + EXPORT_MANIFEST)
+            if not blob.exists():
+                raise Exception(f"Export not found in cloud storage: {self.prefix}")
+            return json.loads(blob.download_as_bytes())
+        path = self.export_dir / EXPORT_MANIFEST
+        if not path.exists():
+            raise Exception(f"Export not found: {self.export_dir}")
+        with open(path) as f:
+            return json.load(f)
+
+    @contextmanager
+    def open(self, filename: str):
+        if self.bucket is not None:
+            with self.bucket.blob(self.prefix + filename).open('rb', chunk_size=QUERY_READ_SIZE) as f:
+                yield f
+        else:
+            with open(self.export_dir / filename, 'rb') as f:
+                yield f
+
+
+def parse_filter(text: str, schema) -> Tuple[str, str, Any]:
+    match = FILTER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Invalid filter: {text} (expected column<op>value, op one of = != < <= > >=)")
+    column, op, raw = split_identifiers(match.group(1))[0], match.group(2), match.group(3)
+    if column not in schema.names:
+        raise ValueError(f"Unknown column in filter: {column}")
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in "'\"":
+        raw = raw[1:-1]
+    try:
+        value = value_converter(schema.field(column).type)(raw)
+    except (ValueError, ArithmeticError):
+        raise ValueError(f"Invalid value for {column}: {raw}")
+    return column, op, value
+
+
+def row_group_may_match(row_group, filters: List[Tuple[str, str, Any]], column_index: Dict[str, int]) -> bool:
+    # a row group is skipped when its min/max statistics rule out any
+    # filter; without statistics it has to be read
+    for column, op, value in filters:
+        statistics = row_group.column(column_index[column]).statistics
+        if statistics is None:
+            continue
+        if statistics.null_count == row_group.num_rows:
+            return False
+        if not statistics.has_min_max:
+            continue
+        low, high = statistics.min, statistics.max
+        if op == '=' and not low <= value <= high:
+            return False
+        if op == '!=' and low == high == value:
+            return False
+        if op in ('<', '<=') and not OPERATORS[op][1](low, value):
+            return False
+        if op in ('>', '>=') and not OPERATORS[op][1](high, value):
+            return False
+    return True
+
+
+def query_table(source: ExportSource, table: str, columns: Optional[List[str]] = None,
+                filters: Optional[List[str]] = None, limit: Optional[int] = None):
+    require_pyarrow()
+    if '.' not in table:
+        table = f"public.{table}"
+    entry = source.manifest()['tables'].get(table)
+    if not entry:
+        raise Exception(f"Table {table} is not part of export {source.name}")
+
+    with source.open(entry['file']) as f:
+        parquet = pq.ParquetFile(f)
+        schema = parquet.schema_arrow
+        parsed = [parse_filter(text, schema) for text in filters or []]
+        unknown = [column for column in columns or [] if column not in schema.names]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        # filter columns are read as well, and dropped after filtering
+        wanted = columns or schema.names
+        read_columns = list(dict.fromkeys(list(wanted) + [column for column, _, _ in parsed]))
+        column_index = {name: schema.get_field_index(name) for name in read_columns}
+
+        metadata = parquet.metadata
+        stats = {'row_groups': metadata.num_row_groups, 'row_groups_read': 0, 'bytes': 0, 'bytes_read': 0}
+        batches = []
+        rows = 0
+        for index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(index)
+            chunk_bytes = sum(row_group.column(column_index[name]).total_compressed_size for name in read_columns)
+            stats['bytes'] += chunk_bytes
+            if limit is not None and rows >= limit:
+                continue
+            if not row_group_may_match(row_group, parsed, column_index):
+                continue
+            batch = parquet.read_row_group(index, columns=read_columns)
+            stats['row_groups_read'] += 1
+            stats['bytes_read'] += chunk_bytes
+            if parsed:
+                mask = None
+                for column, op, value in parsed:
+                    condition = getattr(pc, OPERATORS[op][0])(batch[column], pa.scalar(value, type=schema.field(column).type))
+                    mask = condition if mask is None else pc.and_(mask, condition)
+                batch = batch.filter(mask)
+            batches.append(batch)
+            rows += batch.num_rows
+
+    result = pa.concat_tables(batches) if batches else schema.empty_table().select(read_columns)
+    result = result.select(list(wanted))
+    if limit is not None:
+        result = result.slice(0, limit)
+    return result, stats
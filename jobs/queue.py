@@ -0,0 +1,237 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+JOB_KINDS = ('backup', 'verify', 'retention', 'replicate')
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS backup_jobs (
+        id {id_type},
+        kind TEXT NOT NULL,
+        target TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        priority INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after DOUBLE PRECISION NOT NULL,
+        lease_owner TEXT,
+        lease_token TEXT,
+        lease_expires DOUBLE PRECISION,
+        created_at DOUBLE PRECISION NOT NULL,
+        started_at DOUBLE PRECISION,
+        finished_at DOUBLE PRECISION,
+        result TEXT,
+        error TEXT
+    )
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS backup_jobs_status ON backup_jobs (status, run_after)"
+
+COLUMNS = ('id', 'kind', 'target', 'payload', 'status', 'priority', 'attempts', 'max_attempts',
+           'run_after', 'lease_owner', 'lease_token', 'lease_expires', 'created_at',
+           'started_at', 'finished_at', 'result', 'error')
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    target: str
+    payload: Dict = field(default_factory=dict)
+    status: str = 'queued'
+    priority: int = 0
+    attempts: int = 0
+    max_attempts: int = 3
+    run_after: float = 0.0
+    lease_owner: Optional[str] = None
+    lease_token: Optional[str] = None
+    lease_expires: Optional[float] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> 'Job':
+        values = dict(zip(COLUMNS, row))
+        values['payload'] = json.loads(values['payload'])
+        return cls(**values)
+
+
+def default_target(kind: str, payload: Dict) -> str:
+    # jobs with the same target never run at the same time; verify,
+    # retention and replication share one so a backup is never deleted
+    # while it is checked or copied
+    if kind == 'backup':
+        return payload['db_type']
+    return 'storage'
+
+
+class JobQueue:
+    def __init__(self, config: Optional[Dict] = None):
+        config = config or {}
+        self.backend = config.get('backend', 'sqlite')
+        if self.backend not in ('sqlite', 'postgres'):
+            raise ValueError(f"Unsupported job queue backend: {self.backend}")
+        self.path = config.get('path', 'jobs.db')
+        self.dsn = os.getenv(config.get('dsn_env', 'JOB_QUEUE_DSN'))
+        self.lease_seconds = config.get('lease_seconds', 60)
+        self.max_attempts = config.get('max_attempts', 3)
+        self.retry_delay = config.get('retry_delay', 60)
+        if self.backend == 'postgres' and not self.dsn:
+            raise Exception(f"Set {config.get('dsn_env', 'JOB_QUEUE_DSN')} to use the postgres job queue")
+        self.create()
+
+    def connect(self):
+        if self.backend == 'postgres':
+            import psycopg2
+            return psycopg2.connect(self.dsn)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _sql(self, query: str) -> str:
+        return query.replace('?', '%s') if self.backend == 'postgres' else query
+
+    @contextmanager
+    def transaction(self):
+        # claims take a write lock up front, so two workers can never pick
+        # the same job or two jobs for the same target
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            if self.backend == 'postgres':
+                cursor.execute("LOCK TABLE backup_jobs IN SHARE ROW EXCLUSIVE MODE")
+            else:
+                cursor.execute("BEGIN IMMEDIATE")
+
+            def execute(query: str, params: tuple = ()):
+                cursor.execute(self._sql(query), params)
+                return cursor
+
+            try:
+                yield execute
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+        finally:
+            connection.close()
+
+    def create(self):
+        connection = self.connect()
+        try:
+            id_type = 'BIGSERIAL PRIMARY KEY' if self.backend == 'postgres' else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+            cursor = connection.cursor()
+            cursor.execute(SCHEMA.format(id_type=id_type))
+            cursor.execute(INDEX)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def enqueue(self, kind: str, payload: Dict, target: Optional[str] = None, priority: int = 0,
+                delay: float = 0, max_attempts: Optional[int] = None) -> int:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}. Use one of {', '.join(JOB_KINDS)}")
+        target = target or default_target(kind, payload)
+        encoded = json.dumps(payload, sort_keys=True)
+        now = time.time()
+        with self.transaction() as execute:
+            # a cron run that fires while the previous one is still waiting
+            # does not pile up a second identical job
+            existing = execute(
+                "SELECT id FROM backup_jobs WHERE kind = ? AND target = ? AND payload = ? AND status = 'queued'",
+                (kind, target, encoded)).fetchone()
+            if existing:
+                return existing[0]
+            return execute(
+                "INSERT INTO backup_jobs (kind, target, payload, priority, max_attempts, run_after, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                (kind, target, encoded, priority, max_attempts or self.max_attempts, now + delay, now)
+            ).fetchone()[0]
+
+    def _expire_leases(self, execute, now: float) -> List[int]:
+        expired = execute(
+            "SELECT id, attempts, max_attempts, lease_owner FROM backup_jobs "
+            "WHERE status = 'running' AND lease_expires < ?", (now,)).fetchall()
+        for job_id, attempts, max_attempts, owner in expired:
+            error = f"lease of {owner} expired"
+            if attempts >= max_attempts:
+                execute("UPDATE backup_jobs SET status = 'failed', finished_at = ?, error = ?, "
+                        "lease_owner = NULL, lease_token = NULL WHERE id = ?", (now, error, job_id))
+            else:
+                # another worker takes the job over on its next claim
+                execute("UPDATE backup_jobs SET status = 'queued', error = ?, "
+                        "lease_owner = NULL, lease_token = NULL WHERE id = ?", (error, job_id))
+        return [row[0] for row in expired]
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Job]:
+        now = time.time()
+        with self.transaction() as execute:
+            self._expire_leases(execute, now)
+            query = ("SELECT id FROM backup_jobs WHERE status = 'queued' AND run_after <= ? "
+                     "AND target NOT IN (SELECT target FROM backup_jobs WHERE status = 'running')")
+            params = [now]
+            if kinds:
+                query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+                params.extend(kinds)
+            row = execute(query + " ORDER BY priority DESC, run_after, id LIMIT 1", tuple(params)).fetchone()
+            if not row:
+                return None
+
+            token = uuid.uuid4().hex
+            execute("UPDATE backup_jobs SET status = 'running', lease_owner = ?, lease_token = ?, "
+                    "lease_expires = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker_id, token, now + self.lease_seconds, now, row[0]))
+            return Job.from_row(execute(
+                f"SELECT {', '.join(COLUMNS)} FROM backup_jobs WHERE id = ?", (row[0],)).fetchone())
+
+    def _update_leased(self, job: Job, assignments: str, params: tuple) -> bool:
+        # every write is fenced by the lease token: a worker whose lease
+        # expired and was taken over can no longer touch the job
+        with self.transaction() as execute:
+            cursor = execute(f"UPDATE backup_jobs SET {assignments} "
+                             "WHERE id = ? AND lease_token = ? AND status = 'running'",
+                             params + (job.id, job.lease_token))
+            return cursor.rowcount == 1
+
+    def heartbeat(self, job: Job) -> bool:
+        job.lease_expires = time.time() + self.lease_seconds
+        return self._update_leased(job, "lease_expires = ?", (job.lease_expires,))
+
+    def complete(self, job: Job, result: Optional[str] = None) -> bool:
+        return self._update_leased(
+            job, "status = 'done', finished_at = ?, result = ?, error = NULL, lease_token = NULL",
+            (time.time(), result))
+
+    def fail(self, job: Job, error: str) -> bool:
+        now = time.time()
+        if job.attempts < job.max_attempts:
+            # back off a little more after every attempt
+            return self._update_leased(
+                job, "status = 'queued', run_after = ?, error = ?, lease_owner = NULL, lease_token = NULL",
+                (now + self.retry_delay * job.attempts, error))
+        return self._update_leased(
+            job, "status = 'failed', finished_at = ?, error = ?, lease_token = NULL", (now, error))
+
+    def release(self, job: Job) -> bool:
+        # the worker is shutting down; the attempt does not count
+        return self._update_leased(
+            job, "status = 'queued', attempts = attempts - 1, lease_owner = NULL, lease_token = NULL", ())
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[Job]:
+        with self.transaction() as execute:
+            query = f"SELECT {', '.join(COLUMNS)} FROM backup_jobs"
+            params = ()
+            if status:
+                query += " WHERE status = ?"
+                params = (status,)
+            rows = execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [Job.from_row(row) for row in rows]
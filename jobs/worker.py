@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from jobs.queue import Job, JobQueue
+from logger import DatabaseLogger
+
+
+def run_backup_job(manager, payload: Dict) -> str:
+    result = manager.perform_backup(
+        db_type=payload['db_type'],
+        compress=payload.get('compress', True),
+        store_locally=payload.get('store_locally', False),
+        store_in_cloud=payload.get('store_in_cloud', True)
+    )
+    if not result:
+        raise Exception("Backup failed, see the worker log")
+    return result
+
+
+def run_verify_job(manager, payload: Dict) -> str:
+    ok, details = manager.verify_backup(payload['file'], from_cloud=payload.get('cloud', False))
+    if not ok:
+        raise Exception(details)
+    return details
+
+
+def run_retention_job(manager, payload: Dict) -> str:
+    deleted = manager.apply_retention(
+        keep_last=payload.get('keep_last'),
+        keep_days=payload.get('keep_days'),
+        storage_type=payload.get('storage', 'cloud')
+    )
+    return f"Deleted {len(deleted)} backups"
+
+
+def run_replication_job(manager, payload: Dict) -> str:
+    from storage.replication import Replicator
+    if not manager.cloud_storage:
+        raise Exception("Replication needs cloud storage, set use_cloud in config.json")
+    report = Replicator(manager.config, manager.cloud_storage).run(payload.get('targets'))
+    if report['failed']:
+        raise Exception(f"{report['failed']} copies failed: " + "; ".join(report['errors'][:5]))
+    return f"Copied {report['copied']} objects ({report['bytes_copied'] / 1024 ** 3:.2f}GB)"
+
+
+JOB_HANDLERS: Dict[str, Callable] = {
+    'backup': run_backup_job,
+    'verify': run_verify_job,
+    'retention': run_retention_job,
+    'replicate': run_replication_job,
+}
+
+
+def _stop_job(signum, frame):
+    # turns SIGTERM into an exception, so running tools are stopped and
+    # temp files cleaned up on the way out
+    raise SystemExit(f"Job stopped by signal {signum}")
+
+
+def execute_job(config: Dict, kind: str, payload: Dict, results):
+    signal.signal(signal.SIGTERM, _stop_job)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        from backup.backup_manager import BackupManager
+        manager = BackupManager(config)
+        results.send((True, JOB_HANDLERS[kind](manager, payload)))
+    except BaseException as e:
+        results.send((False, str(e) or type(e).__name__))
+        raise
+
+
+class Worker:
+    def __init__(self, config: Dict, queue: Optional[JobQueue] = None, worker_id: Optional[str] = None,
+                 kinds: Optional[List[str]] = None):
+        settings = config.get('job_queue', {})
+        self.config = config
+        self.queue = queue or JobQueue(settings)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.kinds = kinds
+        self.slots = settings.get('slots', 1)
+        self.poll_seconds = settings.get('poll_seconds', 5)
+        self.heartbeat_seconds = settings.get('heartbeat_seconds', max(1, self.queue.lease_seconds // 4))
+        self.job_timeout = settings.get('job_timeout')
+        self.logger = DatabaseLogger()
+        self.stopping = threading.Event()
+        self.completed = 0
+
+    def stop(self, *_):
+        if not self.stopping.is_set():
+            self.logger.info(f"Worker {self.worker_id} stopping, running jobs are handed back to the queue")
+        self.stopping.set()
+
+    def heartbeat(self, job: Job) -> bool:
+        try:
+            return self.queue.heartbeat(job)
+        except Exception as e:
+            # keep going; if the queue stays away past the lease, the next
+            # successful heartbeat reports the takeover
+            self.logger.warning(f"Heartbeat for job {job.id} failed: {str(e)}")
+            return True
+
+    def execute(self, job: Job):
+        self.logger.info(f"Worker {self.worker_id} running job {job.id} ({job.kind} {job.target}, "
+                         f"attempt {job.attempts}/{job.max_attempts})")
+        # each job runs in its own process so a lost lease, a timeout or a
+        # shutdown can stop it without taking the worker down
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=execute_job, args=(self.config, job.kind, job.payload, sender),
+                                          daemon=False)
+        process.start()
+        sender.close()
+
+        started = time.monotonic()
+        outcome = None
+        while process.is_alive():
+            process.join(self.heartbeat_seconds)
+            if not process.is_alive():
+                break
+            if self.stopping.is_set():
+                outcome = 'released'
+            elif not self.heartbeat(job):
+                outcome = 'lost'
+            elif self.job_timeout and time.monotonic() - started > self.job_timeout:
+                outcome = 'timeout'
+            if outcome:
+                process.terminate()
+                process.join(30)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+                break
+
+        result = receiver.recv() if receiver.poll() else None
+        receiver.close()
+        # Ctrl-C and service managers signal the whole process group, so
+        # the job may have died from the shutdown before we stopped it
+        if self.stopping.is_set() and not (result and result[0]) and outcome is None:
+            outcome = 'released'
+
+        if outcome == 'released':
+            self.queue.release(job)
+            self.logger.info(f"Job {job.id} handed back to the queue")
+        elif outcome == 'lost':
+            # another worker already owns the job, so nothing is written back
+            self.logger.warning(f"Worker {self.worker_id} lost the lease on job {job.id}, stopped it")
+        elif outcome == 'timeout':
+            self.queue.fail(job, f"Job did not finish within {self.job_timeout}s")
+            self.logger.error(f"Job {job.id} timed out after {self.job_timeout}s")
+        elif result and result[0]:
+            if self.queue.complete(job, str(result[1])):
+                self.logger.info(f"Job {job.id} finished: {result[1]}")
+            else:
+                self.logger.warning(f"Job {job.id} finished after its lease was taken over")
+        else:
+            error = result[1] if result else f"Job process exited with code {process.exitcode}"
+            self.queue.fail(job, error)
+            self.logger.error(f"Job {job.id} failed: {error}")
+        self.completed += 1
+
+    def _slot(self, exit_when_idle: bool):
+        while not self.stopping.is_set():
+            try:
+                job = self.queue.claim(self.worker_id, self.kinds)
+            except Exception as e:
+                self.logger.error(f"Worker {self.worker_id} could not reach the job queue: {str(e)}")
+                job = None
+            if job:
+                self.execute(job)
+                continue
+            if exit_when_idle:
+                return
+            self.stopping.wait(self.poll_seconds)
+
+    def run(self, exit_when_idle: bool = False):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.logger.info(f"Worker {self.worker_id} started with {self.slots} slots")
+
+        threads = [threading.Thread(target=self._slot, args=(exit_when_idle,), daemon=True)
+                   for _ in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+        self.logger.info(f"Worker {self.worker_id} exited after {self.completed} jobs")
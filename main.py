@@ -2,6 +2,13 @@ import os
 import argparse
 from pathlib import Path
 from backup.backup_manager import BackupManager
+from backup.progress import console_progress
+from storage.recompaction import Recompactor, format_report
+from storage.replication import Replicator, format_replication
+from backup.autotuner import format_run
+from jobs.queue import JOB_KINDS, STATUSES, JobQueue
+from jobs.worker import Worker
+from datetime import datetime
 import json
 
 def get_db_type_from_filename(filename: str) -> str:
@@ -16,13 +23,84 @@ def get_db_type_from_filename(filename: str) -> str:
     else:
         raise ValueError(f"Could not determine database type from filename: {filename}")
 
+def run_job_command(args, config: dict):
+    queue_config = config.get('job_queue', {})
+    queue = JobQueue(queue_config)
+    
+    if args.command == 'worker':
+        if args.slots:
+            config['job_queue'] = dict(queue_config, slots=args.slots)
+        Worker(config, queue, kinds=args.kinds).run(exit_when_idle=args.exit_when_idle)
+    
+    elif args.command == 'enqueue':
+        if args.kind == 'backup':
+            if not args.db:
+                print("Backup jobs need --db")
+                return
+            payload = {'db_type': args.db, 'compress': args.compress,
+                       'store_locally': args.local, 'store_in_cloud': True}
+        elif args.kind == 'verify':
+            if not args.file:
+                print("Verify jobs need --file")
+                return
+            payload = {'file': args.file, 'cloud': args.cloud}
+        elif args.kind == 'replicate':
+            payload = {'targets': args.to} if args.to else {}
+        else:
+            payload = {'storage': 'cloud' if args.cloud else 'local'}
+            if args.keep_last is not None:
+                payload['keep_last'] = args.keep_last
+            if args.keep_days is not None:
+                payload['keep_days'] = args.keep_days
+        job_id = queue.enqueue(args.kind, payload, priority=args.priority)
+        print(f"Queued {args.kind} job {job_id}")
+    
+    elif args.command == 'jobs':
+        jobs = queue.list_jobs(args.status, args.limit)
+        if not jobs:
+            print("No jobs found")
+            return
+        for job in jobs:
+            created = datetime.fromtimestamp(job.created_at).strftime('%Y-%m-%d %H:%M:%S')
+            line = f"{job.id:>5} {job.status:<8} {job.kind:<9} {job.target:<10} attempts {job.attempts}/{job.max_attempts} {created}"
+            if job.status == 'running':
+                line += f" on {job.lease_owner}"
+            if job.error and job.status != 'done':
+                line += f" - {job.error.splitlines()[0][:120]}"
+            elif job.result:
+                line += f" - {job.result[:120]}"
+            print(line)
+
+def write_query_output(rows, path: str):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(rows, path)
+    else:
+        import pyarrow.csv as csv
+        csv.write_csv(rows, path)
+
+def run_restore(backup_manager: BackupManager, args, backup_file: str, db_type: str, from_cloud: bool) -> bool:
+    targets = args.target_db or []
+    if len(targets) > 1:
+        results = backup_manager.restore_to_targets(
+            backup_file, db_type, targets, from_cloud=from_cloud,
+            clone=args.clone or None, connection_budget=args.budget
+        )
+        return all(results.values())
+    return backup_manager.restore_backup(
+        backup_file,
+        db_type,
+        targets[0] if targets else None,
+        from_cloud=from_cloud
+    )
+
 def main():
     parser = argparse.ArgumentParser(description="Database Backup CLI")
     
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
     
     backup_parser = subparsers.add_parser('backup', help='Perform a database backup')
-    backup_parser.add_argument('--db', type=str, required=True, choices=['postgres'], help='Database type (postgres)')
+    backup_parser.add_argument('--db', type=str, required=True, choices=['postgres', 'mongodb'], help='Database type (postgres, mongodb)')
     backup_parser.add_argument('--compress', action='store_true', help='Compress backup')
     backup_parser.add_argument('--cloud', action='store_true', help='Store in cloud')
     backup_parser.add_argument('--no-local', action='store_true', help='Skip local storage')
@@ -31,26 +109,97 @@ def main():
     restore_group = restore_parser.add_mutually_exclusive_group(required=True)
     restore_group.add_argument('--list', action='store_true', help='List available backups')
     restore_group.add_argument('--file', type=str, help='Specific backup file to restore')
-    restore_parser.add_argument('--db', type=str, choices=['postgres'], 
+    restore_parser.add_argument('--db', type=str, choices=['postgres', 'mongodb'], 
                               help='Optional: Override database type detection')
-    restore_parser.add_argument('--target-db', type=str, help='Target database name (optional)')
+    restore_parser.add_argument('--target-db', type=str, nargs='+',
+                              help='Target database name (optional); several names restore into each of them')
+    restore_parser.add_argument('--clone', action='store_true',
+                              help='With several targets, restore once and clone the rest (PostgreSQL)')
+    restore_parser.add_argument('--budget', type=int, help='Connections several target restores may use together')
     restore_parser.add_argument('--cloud', action='store_true', help='List/restore from cloud storage')
     
     delete_parser = subparsers.add_parser('delete', help='Delete a backup')
     delete_parser.add_argument('--file', type=str, required=True, help='Backup file to delete')
     delete_parser.add_argument('--cloud', action='store_true', help='Delete from cloud storage')
     
+    recompact_parser = subparsers.add_parser('recompact', help='Recompress old backups and move them to colder storage')
+    recompact_parser.add_argument('--dry-run', action='store_true', help='Only show what would change')
+    recompact_parser.add_argument('--force', action='store_true', help='Run even if the host is busy')
+    recompact_parser.add_argument('--no-local', action='store_true', help='Skip local backups')
+    
+    replicate_parser = subparsers.add_parser('replicate', help='Copy new backups to the other buckets server-side')
+    replicate_parser.add_argument('--to', nargs='+', help='Configured bucket names (default: replication targets)')
+    replicate_parser.add_argument('--dry-run', action='store_true', help='Only show what would be copied')
+
+    cache_parser = subparsers.add_parser('cache', help='Show or clear the download cache')
+    cache_group = cache_parser.add_mutually_exclusive_group(required=True)
+    cache_group.add_argument('--stats', action='store_true', help='Show cache hit/miss statistics')
+    cache_group.add_argument('--clear', action='store_true', help='Remove all cached backups not in use')
+    
+    tune_parser = subparsers.add_parser('tune', help='Show recent runs and the settings the autotuner would pick')
+    tune_parser.add_argument('--db', type=str, required=True, choices=['postgres', 'mongodb'], help='Database type')
+    tune_parser.add_argument('--compress', action='store_true', help='Plan for a compressed backup')
+    tune_parser.add_argument('--runs', type=int, default=10, help='Number of recent runs to show')
+    
+    report_parser = subparsers.add_parser('report', help='Show size and duration trends and flag regressions')
+    report_parser.add_argument('--db', type=str, choices=['postgres', 'mongodb'], help='Database type (default: all)')
+    report_parser.add_argument('--tables', type=int, default=10, help='Number of fastest growing tables to show')
+
+    export_parser = subparsers.add_parser('export', help='Export the tables of a PostgreSQL backup to Parquet')
+    export_parser.add_argument('--file', type=str, required=True, help='Backup file to export')
+    export_parser.add_argument('--cloud', action='store_true', help='Export a backup from cloud storage')
+    export_parser.add_argument('--tables', nargs='+', help='Only export these tables (schema.table)')
+    export_parser.add_argument('--upload', action='store_true', help='Upload the export to cloud storage')
+    
+    query_parser = subparsers.add_parser('query', help='Read rows of one table from an export')
+    query_parser.add_argument('--export', type=str, required=True, help='Export name or the backup it was made from')
+    query_parser.add_argument('--table', type=str, required=True, help='Table to read (schema.table)')
+    query_parser.add_argument('--columns', nargs='+', help='Columns to return')
+    query_parser.add_argument('--where', action='append', default=[],
+                              help='Filter such as id>=100 or "created_at<2024-06-01"; may be repeated')
+    query_parser.add_argument('--limit', type=int, default=100, help='Maximum rows to return')
+    query_parser.add_argument('--cloud', action='store_true', help='Read the export from cloud storage')
+    query_parser.add_argument('--output', type=str, help='Write the rows to a .csv or .parquet file')
+    
+    worker_parser = subparsers.add_parser('worker', help='Run jobs from the shared job queue')
+    worker_parser.add_argument('--kinds', nargs='+', choices=JOB_KINDS, help='Only run these job kinds')
+    worker_parser.add_argument('--slots', type=int, help='Jobs to run at the same time on this node')
+    worker_parser.add_argument('--exit-when-idle', action='store_true', help='Exit once the queue is empty')
+    
+    enqueue_parser = subparsers.add_parser('enqueue', help='Add a job to the shared job queue')
+    enqueue_parser.add_argument('kind', choices=JOB_KINDS, help='Job kind')
+    enqueue_parser.add_argument('--db', type=str, choices=['postgres', 'mongodb'], help='Database type (backup jobs)')
+    enqueue_parser.add_argument('--compress', action='store_true', help='Compress backup')
+    enqueue_parser.add_argument('--local', action='store_true', help='Also keep the backup in local storage on the worker')
+    enqueue_parser.add_argument('--file', type=str, help='Backup file to verify')
+    enqueue_parser.add_argument('--cloud', action='store_true', help='Verify or apply retention in cloud storage')
+    enqueue_parser.add_argument('--keep-last', type=int, help='Backups to keep per database (retention jobs)')
+    enqueue_parser.add_argument('--keep-days', type=int, help='Keep backups younger than this (retention jobs)')
+    enqueue_parser.add_argument('--to', nargs='+', help='Buckets to copy to (replicate jobs, default: all targets)')
+    enqueue_parser.add_argument('--priority', type=int, default=0, help='Higher runs first')
+    
+    jobs_parser = subparsers.add_parser('jobs', help='Show jobs in the shared job queue')
+    jobs_parser.add_argument('--status', choices=STATUSES, help='Only show jobs with this status')
+    jobs_parser.add_argument('--limit', type=int, default=50, help='Number of jobs to show')
+    
     args = parser.parse_args()
     
     config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
     with open(config_path, 'r') as config_file:
         config = json.load(config_file)
     
-    backup_manager = BackupManager(config)
+    if args.command in ('worker', 'enqueue', 'jobs'):
+        run_job_command(args, config)
+        return
+    
+    backup_manager = BackupManager(config, progress_callbacks=[console_progress])
     
     if args.command == 'backup':
-        store_locally = not args.cloud
+        store_locally = not args.no_local
         store_in_cloud = args.cloud
+        if not store_locally and not store_in_cloud:
+            print("Nothing to do: --no-local needs --cloud")
+            return
         
         result = backup_manager.perform_backup(
             db_type=args.db,
@@ -59,10 +208,7 @@ def main():
             store_in_cloud=store_in_cloud
         )
         if result:
-            if store_in_cloud:
-                print(f"Backup uploaded to cloud storage: {result}")
-            else:
-                print(f"Backup saved locally: {result}")
+            print(f"Backup completed: {result}")
         else:
             print("Backup failed")
     
@@ -92,10 +238,11 @@ def main():
                             try:
                                 db_type = args.db or get_db_type_from_filename(backup_name)
                                 
-                                success = backup_manager.restore_backup(
+                                success = run_restore(
+                                    backup_manager,
+                                    args,
                                     selected_backup['path'] if 'path' in selected_backup else backup_name,
                                     db_type,
-                                    args.target_db,
                                     from_cloud=(selected_backup['storage'] == 'cloud')
                                 )
                                 if success:
@@ -120,12 +267,7 @@ def main():
                         print(f"Backup file not found: {args.file}")
                         return
                     
-                success = backup_manager.restore_backup(
-                    args.file,
-                    db_type,
-                    args.target_db,
-                    from_cloud=args.cloud
-                )
+                success = run_restore(backup_manager, args, args.file, db_type, from_cloud=args.cloud)
                 if success:
                     print("Restore completed successfully")
                 else:
@@ -147,6 +289,89 @@ def main():
         else:
             print("Delete failed")
     
+    elif args.command == 'cache':
+        cache = backup_manager.download_cache
+        if not cache:
+            print("The download cache is not enabled, add download_cache to config.json")
+            return
+        if args.clear:
+            print(f"Removed {cache.clear()} cached backups")
+            return
+        stats = cache.stats()
+        print(f"Entries:          {stats['entries']}")
+        print(f"Size:             {stats['size'] / (1024 ** 3):.2f}GB of {stats['max_size'] / (1024 ** 3):.2f}GB")
+        print(f"Hits / misses:    {stats['hits']} / {stats['misses']} ({stats['hit_rate'] * 100:.0f}% hit rate)")
+        print(f"Evictions:        {stats['evictions']}")
+        print(f"Served locally:   {stats['bytes_from_cache'] / (1024 ** 3):.2f}GB")
+        print(f"Downloaded:       {stats['bytes_downloaded'] / (1024 ** 3):.2f}GB")
+    
+    elif args.command == 'tune':
+        runs = backup_manager.run_history.runs(args.db, limit=args.runs, successful=False)
+        if not runs:
+            print("No runs recorded yet")
+        for run in runs:
+            print(format_run(run))
+        _, _, engine, params = backup_manager.backup_settings(args.db, args.compress)
+        backup_manager.autotune(args.db, engine, args.compress, params, force=True)
+    
+    elif args.command == 'report':
+        try:
+            lines = backup_manager.regression_reports(args.db, args.tables)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return
+        if not lines:
+            print("No runs recorded yet")
+        for line in lines:
+            print(line)
+    
+    elif args.command == 'export':
+        location = backup_manager.export_backup(args.file, from_cloud=args.cloud, tables=args.tables,
+                                                upload=args.upload or None)
+        if location:
+            print(f"Export completed: {location}")
+        else:
+            print("Export failed")
+    
+    elif args.command == 'query':
+        try:
+            rows, stats = backup_manager.query_export(args.export, args.table, args.columns, args.where,
+                                                      args.limit, from_cloud=args.cloud)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return
+        print(f"Read {stats['row_groups_read']} of {stats['row_groups']} row groups "
+              f"({stats['bytes_read'] / (1024 * 1024):.1f}MB of {stats['bytes'] / (1024 * 1024):.1f}MB)")
+        if args.output:
+            write_query_output(rows, args.output)
+            print(f"Wrote {rows.num_rows} rows to {args.output}")
+        else:
+            print("\t".join(rows.column_names))
+            for row in rows.to_pylist():
+                print("\t".join("" if value is None else str(value) for value in row.values()))
+            print(f"({rows.num_rows} rows)")
+    
+    elif args.command == 'replicate':
+        if not backup_manager.cloud_storage:
+            print("Replication needs cloud storage, set use_cloud in config.json")
+            return
+        try:
+            report = Replicator(config, backup_manager.cloud_storage).run(args.to, dry_run=args.dry_run)
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            return
+        print("\nReplication summary" + (" (dry run)" if args.dry_run else "") + ":")
+        for line in format_replication(report):
+            print(f"  {line}")
+    
+    elif args.command == 'recompact':
+        recompactor = Recompactor(config, backup_manager.cloud_storage,
+                                  backup_manager.local_storage, backup_manager.keyring)
+        report = recompactor.run(dry_run=args.dry_run, force=args.force, include_local=not args.no_local)
+        print("\nRecompaction summary" + (" (dry run)" if args.dry_run else "") + ":")
+        for line in format_report(report):
+            print(f"  {line}")
+    
     else:
         parser.print_help()
 
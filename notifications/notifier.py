@@ -76,6 +76,25 @@ class SlackNotifier:
             self.logger.error(f"Error sending Slack notification: {str(e)}")
             return False
                
+    def progress_callback(self, step: int = 25):
+        # posts one message per `step` percent instead of every update
+        state = {'next': step}
+
+        def callback(event):
+            percent = event.percent
+            if event.phase in ('start', 'done', 'failed') or percent is None:
+                return
+            if percent >= state['next']:
+                state['next'] = (int(percent) // step + 1) * step
+                details = f"{percent:.0f}% complete"
+                if event.current_item:
+                    details += f", working on {event.current_item}"
+                if event.eta_seconds is not None:
+                    details += f", about {int(event.eta_seconds // 60)} min remaining"
+                self.send_notification(f"{event.operation} progress", True, details)
+
+        return callback
+
     def test_connection(self) -> bool:
         try:
             self.logger.info("Testing Slack webhook connection")
@@ -0,0 +1,64 @@
+import os
+import shutil
+from typing import Optional
+from backup.mongodb_backup import GZIP_MARKER
+from backup.resource_governor import ResourceGovernor
+from backup.process_runner import ProcessRunner
+from backup.progress import ProgressTracker
+from connectors.mongodb_connector import get_uri
+
+
+def mongodb_restore(backup_file: str, target_db: Optional[str] = None, insertion_workers: int = 4,
+                    parallel_collections: int = 4, oplog_replay: bool = False, drop: bool = True,
+                    governor: Optional[ResourceGovernor] = None,
+                    progress: Optional[ProgressTracker] = None, timeout: Optional[int] = None) -> bool:
+    try:
+        if not shutil.which("mongorestore"):
+            raise Exception("mongorestore not found. Install the MongoDB Database Tools")
+
+        command = [
+            "mongorestore",
+            f"--uri={get_uri()}",
+            f"--archive={backup_file}",
+            f"--numParallelCollections={parallel_collections}",
+            f"--numInsertionWorkersPerCollection={insertion_workers}",
+        ]
+
+        if GZIP_MARKER + ".archive" in os.path.basename(backup_file):
+            command.append("--gzip")
+        if drop:
+            command.append("--drop")
+        if oplog_replay:
+            command.append("--oplogReplay")
+
+        source_db = os.getenv("MGDB_NAME")
+        if target_db and source_db and target_db != source_db:
+            command.extend([f"--nsFrom={source_db}.*", f"--nsTo={target_db}.*"])
+
+        print(f"\nRestoring archive into: {target_db or source_db or 'all databases'}")
+        if progress:
+            progress.set_totals(bytes_total=os.path.getsize(backup_file))
+        else:
+            print("This may take a while...")
+
+        result = None
+        try:
+            result = ProcessRunner(command, governor=governor, progress=progress,
+                                   monitor_file=backup_file, timeout=timeout).run()
+        finally:
+            if progress:
+                progress.finish(result is not None and result.ok)
+
+        if not result.ok:
+            print("Restore failed:")
+            print(result.summary())
+            return False
+        if result.warnings:
+            print(result.summary())
+
+        print("\nRestore completed!")
+        return True
+
+    except Exception as e:
+        print(f"Error during restore: {str(e)}")
+        return False
@@ -0,0 +1,230 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from psycopg2 import sql
+from backup.encryption import Keyring
+from backup.parallel_copy_backup import PCOPY_EXTENSION
+from backup.resource_governor import ResourceGovernor
+from connectors.postgres_connector import get_connection
+from logger import DatabaseLogger
+from restore.restore import RESTORE_FUNCTIONS, prepared_backup
+from storage.download_cache import DownloadCache
+
+# option keys that set how many connections one restore opens
+JOB_OPTIONS = {
+    'postgres': ('data_jobs', 'index_jobs', 'copy_workers'),
+    'mongodb': ('parallel_collections', 'insertion_workers'),
+}
+
+
+class ConnectionBudget:
+    def __init__(self, total: int):
+        self.total = total
+        self.available = total
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, count: int):
+        count = min(count, self.total)
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= count)
+            self.available -= count
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.available += count
+                self.condition.notify_all()
+
+
+def connections_needed(db_type: str, backup_file: str, options: Dict) -> int:
+    if db_type == 'mongodb':
+        # every collection being restored has its own insertion workers
+        return options.get('parallel_collections', 4) * options.get('insertion_workers', 4)
+    # the admin connection postgres_restore opens, one for the target and
+    # whatever the busiest stage runs in parallel
+    if backup_file.endswith(PCOPY_EXTENSION):
+        return 2 + max(options.get('copy_workers', 4), options.get('index_jobs', 4))
+    if options.get('mode') == 'staged':
+        return 2 + max(options.get('data_jobs', 4), options.get('index_jobs', 4))
+    return 2
+
+
+def fit_to_budget(db_type: str, backup_file: str, options: Dict, budget: int) -> Dict:
+    options = dict(options)
+    cost = connections_needed(db_type, backup_file, options)
+    if cost > budget and db_type == 'mongodb':
+        collections = options.get('parallel_collections', 4)
+        workers = options.get('insertion_workers', 4)
+        # the split that uses most of the budget, the more even one on a tie
+        splits = [(count, max(1, min(workers, budget // count)))
+                  for count in range(1, max(1, min(collections, budget)) + 1)]
+        collections, workers = max(splits, key=lambda pair: (pair[0] * pair[1], min(pair)))
+        options['parallel_collections'], options['insertion_workers'] = collections, workers
+        print(f"A single restore needs {cost} connections, more than the budget of {budget}; "
+              f"limiting it to {collections} collections with {workers} insertion workers each")
+    elif cost > budget:
+        per_stage = max(1, budget - 2)
+        for key in JOB_OPTIONS[db_type]:
+            options[key] = min(options.get(key, 4), per_stage)
+        print(f"A single restore needs {cost} connections, more than the budget of {budget}; "
+              f"limiting its parallel jobs to {per_stage}")
+    return options
+
+
+def admin_connection():
+    connection = get_connection()
+    if not connection:
+        raise Exception("Unable to connect to the database")
+    # CREATE and DROP DATABASE cannot run inside a transaction
+    connection.autocommit = True
+    return connection
+
+
+def database_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+    return cursor.fetchone() is not None
+
+
+def drop_database(cursor, name: str):
+    cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                   "WHERE datname = %s AND pid <> pg_backend_pid()", (name,))
+    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+
+
+def create_database(cursor, name: str, template: Optional[str] = None, strategy: Optional[str] = None):
+    query = sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name))
+    if template:
+        query += sql.SQL(" TEMPLATE {}").format(sql.Identifier(template))
+    if strategy:
+        query += sql.SQL(" STRATEGY {}").format(sql.SQL(strategy))
+    cursor.execute(query)
+
+
+def restore_targets(backup_file: str, targets: List[str], db_type: str, restore_func: Callable,
+                    options: Dict, governor: Optional[ResourceGovernor], budget: ConnectionBudget,
+                    timings: Dict[str, float]) -> Dict[str, bool]:
+    options = fit_to_budget(db_type, backup_file, options, budget.total)
+    cost = connections_needed(db_type, backup_file, options)
+    concurrency = max(1, min(len(targets), budget.total // cost))
+
+    if db_type == 'postgres':
+        admin = admin_connection()
+        try:
+            with admin.cursor() as cursor:
+                for target in targets:
+                    if not database_exists(cursor, target):
+                        print(f"Creating database {target}")
+                        create_database(cursor, target)
+        finally:
+            admin.close()
+
+    print(f"Restoring into {len(targets)} databases, {concurrency} at a time "
+          f"({cost} connections each, budget {budget.total})")
+
+    def restore_one(target: str) -> bool:
+        with budget.reserve(cost):
+            started = time.perf_counter()
+            try:
+                return restore_func(backup_file, target, governor=governor, **options)
+            finally:
+                timings[target] = time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {target: pool.submit(restore_one, target) for target in targets}
+    results = {}
+    for target, future in futures.items():
+        try:
+            results[target] = future.result()
+        except Exception as e:
+            print(f"Restore into {target} failed: {str(e)}")
+            results[target] = False
+    return results
+
+
+def clone_targets(backup_file: str, targets: List[str], restore_func: Callable, options: Dict,
+                  governor: Optional[ResourceGovernor], template_db: str, keep_template: bool,
+                  timings: Dict[str, float]) -> Dict[str, bool]:
+    # the archive is restored once into a template database; each target
+    # is then a file level copy made by CREATE DATABASE ... TEMPLATE
+    admin = admin_connection()
+    try:
+        with admin.cursor() as cursor:
+            drop_database(cursor, template_db)
+            create_database(cursor, template_db)
+
+        started = time.perf_counter()
+        restored = restore_func(backup_file, template_db, governor=governor, **options)
+        timings[template_db] = time.perf_counter() - started
+        if not restored:
+            print(f"Restore into template database {template_db} failed, no targets were cloned")
+            return {target: False for target in targets}
+
+        # FILE_COPY skips writing every page of the new database to WAL,
+        # which is much faster for large templates (PostgreSQL 15+)
+        strategy = 'FILE_COPY' if admin.server_version >= 150000 else None
+        results = {}
+        with admin.cursor() as cursor:
+            for target in targets:
+                started = time.perf_counter()
+                try:
+                    # a template may not have other sessions while it is copied
+                    cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                                   "WHERE datname = %s AND pid <> pg_backend_pid()", (template_db,))
+                    drop_database(cursor, target)
+                    create_database(cursor, target, template_db, strategy)
+                    results[target] = True
+                    print(f"Cloned {template_db} into {target}")
+                except Exception as e:
+                    print(f"Cloning into {target} failed: {str(e).strip()}")
+                    results[target] = False
+                timings[target] = time.perf_counter() - started
+
+            if not keep_template:
+                drop_database(cursor, template_db)
+        return results
+    finally:
+        admin.close()
+
+
+def multi_target_restore(backup_file: str, targets: List[str], cloud_manager=None,
+                         is_cloud_backup: bool = False, db_type: str = 'postgres',
+                         options: Optional[Dict] = None, governor: Optional[ResourceGovernor] = None,
+                         keyring: Optional[Keyring] = None, cache: Optional[DownloadCache] = None,
+                         connection_budget: int = 16, clone: bool = False,
+                         template_db: Optional[str] = None, keep_template: bool = False) -> Dict[str, bool]:
+    logger = DatabaseLogger()
+    db_type = db_type.lower()
+    restore_func = RESTORE_FUNCTIONS.get(db_type)
+    if not restore_func:
+        raise ValueError(f"Unsupported database type: {db_type}")
+    if clone and db_type != 'postgres':
+        raise ValueError("Template cloning is only available for PostgreSQL")
+
+    logger.log_database_action("multi_restore_start", {
+        "file": backup_file, "targets": targets, "db_type": db_type, "clone": clone
+    })
+    timings = {}
+    try:
+        with prepared_backup(backup_file, cloud_manager, is_cloud_backup, governor, keyring, cache) as local_backup:
+            if clone:
+                template_db = template_db or f"{targets[0]}_template"
+                results = clone_targets(local_backup, targets, restore_func, options or {}, governor,
+                                        template_db, keep_template, timings)
+            else:
+                results = restore_targets(local_backup, targets, db_type, restore_func, options or {},
+                                          governor, ConnectionBudget(connection_budget), timings)
+    except Exception as e:
+        logger.log_critical_error("Multi-target restore failed", e)
+        return {target: False for target in targets}
+
+    print("\nRestore summary:")
+    for name, seconds in timings.items():
+        status = "template" if name not in results else ("ok" if results[name] else "FAILED")
+        print(f"  {name:<30} {status:<8} {seconds:8.1f}s")
+    logger.log_database_action("multi_restore_complete", {
+        "results": results, "seconds": {k: round(v, 2) for k, v in timings.items()}
+    })
+    return results
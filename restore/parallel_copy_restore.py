@@ -0,0 +1,208 @@
+import json
+import os
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+from psycopg2 import Error, sql
+from backup.parallel_copy_backup import (LARGE_OBJECT_CHUNK_SIZE, MANIFEST_NAME, archive_members, open_part,
+                                         part_members)
+from backup.progress import ProgressTracker
+from backup.resource_governor import ResourceGovernor
+from connectors.postgres_connector import get_connection
+from logger import DatabaseLogger
+from restore.staged_restore import clean_statements, report_restore, run_pg_restore, session_options
+
+
+def load_parts(manifest: Dict, backup_file: str, members: Dict[str, tarfile.TarInfo], db_name: str,
+               workers: int, schemas: List[str], load_settings: Dict,
+               progress: Optional[ProgressTracker] = None):
+    compression = manifest.get('compression', 'gzip')
+    parts = []
+    remaining = {}
+    for name, table in manifest['tables'].items():
+        if table['schema'] not in schemas:
+            continue
+        remaining[name] = len(table['parts'])
+        for part in table['parts']:
+            size = sum(members[member].size for member in part_members(part))
+            parts.append((size, name, table, part))
+    parts.sort(key=lambda item: item[0], reverse=True)
+
+    pending = queue.Queue()
+    for item in parts:
+        pending.put(item)
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        connection = get_connection(db_name)
+        if not connection:
+            errors.append(Exception(f"Worker could not connect to {db_name}"))
+            return
+        try:
+            for setting, value in load_settings.items():
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql.SQL("SET {} = {}").format(sql.Identifier(setting), sql.Literal(str(value))))
+                    connection.commit()
+                except Error as e:
+                    # session_replication_role needs superuser, which managed
+                    # databases usually do not grant
+                    connection.rollback()
+                    print(f"Could not apply {setting}={value}: {str(e).strip()}")
+            while not errors:
+                try:
+                    _, name, table, part = pending.get_nowait()
+                except queue.Empty:
+                    return
+                query = sql.SQL("COPY {table} ({columns}) FROM STDIN").format(
+                    table=sql.Identifier(table['schema'], table['name']),
+                    columns=sql.SQL(', ').join(sql.Identifier(c) for c in table['columns']))
+                with open_part(backup_file, members, part, compression) as data:
+                    with connection.cursor() as cursor:
+                        cursor.copy_expert(query, data)
+                connection.commit()
+                if progress:
+                    with lock:
+                        remaining[name] -= 1
+                        done = remaining[name] == 0
+                    if done:
+                        progress.complete_item(name)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise Exception(f"Parallel COPY restore failed: {errors[0]}")
+
+
+def restore_large_objects(connection, batches: List[Dict], backup_file: str, members: Dict[str, tarfile.TarInfo],
+                          compression: str = 'gzip') -> int:
+    restored = 0
+    for batch in batches:
+        with open_part(backup_file, members, batch, compression) as data:
+            for oid, size in batch['objects']:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT lo_unlink(oid) FROM pg_catalog.pg_largeobject_metadata WHERE oid = %s",
+                                   (oid,))
+                    cursor.execute("SELECT lo_create(%s)", (oid,))
+                lob = connection.lobject(oid, 'wb')
+                remaining = size
+                while remaining:
+                    chunk = data.read(min(remaining, LARGE_OBJECT_CHUNK_SIZE))
+                    if not chunk:
+                        raise Exception(f"{batch['file']} ends inside large object {oid}")
+                    lob.write(chunk)
+                    remaining -= len(chunk)
+                lob.close()
+                restored += 1
+        connection.commit()
+    return restored
+
+
+def restore_sequences(connection, sequences: List[Dict], schemas: List[str]):
+    with connection.cursor() as cursor:
+        for sequence in sequences:
+            if sequence['schema'] not in schemas:
+                continue
+            cursor.execute("SELECT setval(%s::regclass, %s, %s)", (
+                sql.Identifier(sequence['schema'], sequence['name']).as_string(connection),
+                sequence['last_value'],
+                sequence['is_called'],
+            ))
+    connection.commit()
+
+
+def parallel_copy_restore(backup_file: str, db_name: str, dbname_arg: str, filters: List[str], env: Dict,
+                          workers: int = 4, index_jobs: int = 4, maintenance_work_mem: str = '1GB',
+                          load_settings: Optional[Dict] = None, schemas: Optional[List[str]] = None,
+                          governor: Optional[ResourceGovernor] = None,
+                          progress: Optional[ProgressTracker] = None,
+                          timeout: Optional[int] = None,
+                          max_ignored_errors: Optional[int] = None) -> Dict[str, float]:
+    logger = DatabaseLogger()
+    schemas = schemas or ['public']
+    timings = {}
+    work_dir = tempfile.mkdtemp(prefix="pcopy_restore_")
+    connection = get_connection(db_name)
+    if not connection:
+        raise Exception(f"Unable to connect to target database {db_name}")
+
+    try:
+        # only the schema is extracted for pg_restore, the workers read the
+        # data members in place
+        started = time.perf_counter()
+        members = archive_members(backup_file)
+        with tarfile.open(backup_file, 'r') as archive:
+            manifest = json.load(archive.extractfile(members[MANIFEST_NAME]))
+            archive.extract(members[manifest['schema']], work_dir, filter='data')
+        schema_file = os.path.join(work_dir, manifest['schema'])
+        timings['extract'] = time.perf_counter() - started
+
+        if progress:
+            sizes = {name: table['estimated_bytes'] for name, table in manifest['tables'].items()
+                     if table['schema'] in schemas}
+            progress.set_totals(bytes_total=sum(sizes.values()), items_total=len(sizes), item_sizes=sizes)
+
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            for statement in clean_statements(schema_file, filters, env):
+                cursor.execute(statement)
+        connection.commit()
+        timings['clean'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = run_pg_restore(
+            ["pg_restore", "--section=pre-data"] + filters + [dbname_arg, schema_file],
+            env, schema_file, governor, timeout=timeout)
+        report_restore(result, 'pre-data', max_ignored_errors)
+        timings['pre-data'] = time.perf_counter() - started
+
+        settings = {
+            'synchronous_commit': 'off',
+            'maintenance_work_mem': maintenance_work_mem,
+            # skips triggers and foreign key checks like --disable-triggers
+            'session_replication_role': 'replica',
+        }
+        settings.update(load_settings or {})
+        started = time.perf_counter()
+        load_parts(manifest, backup_file, members, db_name, workers, schemas, settings, progress)
+        restore_sequences(connection, manifest.get('sequences', []), schemas)
+        if manifest.get('large_objects'):
+            restored = restore_large_objects(connection, manifest['large_objects'], backup_file, members,
+                                             manifest.get('compression', 'gzip'))
+            print(f"Restored {restored} large objects")
+        timings['data'] = time.perf_counter() - started
+
+        index_env = env.copy()
+        index_env["PGOPTIONS"] = (env.get("PGOPTIONS", "") + " " + session_options({
+            'maintenance_work_mem': maintenance_work_mem,
+            'max_parallel_maintenance_workers': max(1, index_jobs // 2),
+        })).strip()
+        started = time.perf_counter()
+        result = run_pg_restore(
+            ["pg_restore", "--section=post-data", f"--jobs={index_jobs}"] + filters + [dbname_arg, schema_file],
+            index_env, schema_file, governor, timeout=timeout)
+        report_restore(result, 'post-data', max_ignored_errors)
+        timings['post-data'] = time.perf_counter() - started
+
+        logger.log_database_action("parallel_copy_restore_timings", {k: round(v, 2) for k, v in timings.items()})
+        print("\nStage timings:")
+        for stage, seconds in timings.items():
+            print(f"  {stage:<10} {seconds:8.1f}s")
+        print(f"  {'total':<10} {sum(timings.values()):8.1f}s")
+        return timings
+
+    finally:
+        connection.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,10 +1,20 @@
 import os
-import subprocess
 import shutil
-from typing import Optional, Tuple
-from tempfile import TemporaryDirectory
+from typing import Optional, Tuple, Dict, List
 from connectors.postgres_connector import get_connection
 from logger import DatabaseLogger
+from restore.mongodb_restore import mongodb_restore
+from backup.resource_governor import ResourceGovernor
+from backup.encryption import Keyring
+from backup.pipeline import is_artifact, unpack_artifact
+from backup.process_runner import ProcessRunner
+from backup.progress import ProgressTracker
+from restore.staged_restore import report_restore, run_pg_restore, staged_restore
+from restore.parallel_copy_restore import parallel_copy_restore
+from backup.parallel_copy_backup import PCOPY_EXTENSION
+from storage.download_cache import DownloadCache
+from contextlib import ExitStack, contextmanager
+from tempfile import mkdtemp
 
 
 def check_postgres_tools() -> Tuple[bool, str]:
@@ -34,7 +44,28 @@ For Windows:
     
     return True, ""
 
-def postgres_restore(backup_file: str, target_db: Optional[str] = None) -> bool:
+def archive_tables(backup_file: str, schema: str = 'public') -> List[str]:
+    # a TOC line looks like: 3421; 0 16390 TABLE DATA public users postgres
+    tables = []
+
+    def collect(stdout):
+        for raw in stdout:
+            line = raw.decode('utf-8', errors='replace')
+            if line.startswith(';') or ' TABLE DATA ' not in line:
+                continue
+            fields = line.split(' TABLE DATA ', 1)[1].split()
+            if len(fields) >= 2 and fields[0] == schema:
+                tables.append(f"{fields[0]}.{fields[1]}")
+
+    ProcessRunner(["pg_restore", "--list", str(backup_file)]).run(collect)
+    return tables
+
+def postgres_restore(backup_file: str, target_db: Optional[str] = None,
+                     governor: Optional[ResourceGovernor] = None,
+                     progress: Optional[ProgressTracker] = None, mode: str = 'single',
+                     data_jobs: int = 4, index_jobs: int = 4, maintenance_work_mem: str = '1GB',
+                     load_settings: Optional[Dict] = None, copy_workers: int = 4,
+                     timeout: Optional[int] = None, max_ignored_errors: Optional[int] = None) -> bool:
     try:
         tools_available, error_message = check_postgres_tools()
         if not tools_available:
@@ -55,10 +86,7 @@ def postgres_restore(backup_file: str, target_db: Optional[str] = None) -> bool:
             if not all([db_name, host, port, user, pwd]):
                 raise Exception("Incomplete database connection parameters")
 
-            command = [
-                "pg_restore",
-                "--clean",
-                "--if-exists",
+            filters = [
                 "--no-owner",
                 "--no-privileges",
                 "--no-comments",
@@ -70,28 +98,78 @@ def postgres_restore(backup_file: str, target_db: Optional[str] = None) -> bool:
                 "--exclude-schema=realtime",
                 "--exclude-schema=vault",
                 "--exclude-schema=extensions",
+            ]
+            dbname_arg = f"--dbname=postgresql://{user}:{pwd}@{host}:{port}/{db_name}"
+            command = ["pg_restore", "--clean", "--if-exists"] + filters + [
                 "--disable-triggers",
-                f"--dbname=postgresql://{user}:{pwd}@{host}:{port}/{db_name}",
+                dbname_arg,
                 str(backup_file)
             ]
-            
+
             print(f"\nRestoring backup to database: {db_name}")
-            print("This may take a while...")
-            
             env = os.environ.copy()
             env["PGSSLMODE"] = "require"
             env["PGGSSENCMODE"] = "disable"
-            
-            result = subprocess.run(command, env=env, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                print("Warnings during restore (these are usually okay for Supabase):")
-                print(result.stderr)
-                
+
+            if str(backup_file).endswith(PCOPY_EXTENSION):
+                succeeded = False
+                try:
+                    parallel_copy_restore(
+                        str(backup_file), db_name, dbname_arg, filters, env,
+                        workers=copy_workers, index_jobs=index_jobs,
+                        maintenance_work_mem=maintenance_work_mem,
+                        load_settings=load_settings, governor=governor, progress=progress,
+                        timeout=timeout, max_ignored_errors=max_ignored_errors
+                    )
+                    succeeded = True
+                finally:
+                    if progress:
+                        progress.finish(succeeded)
+                print("\nRestore completed!")
+                return True
+
+            if progress:
+                progress.set_totals(
+                    bytes_total=os.path.getsize(backup_file),
+                    items_total=len(archive_tables(backup_file))
+                )
+            else:
+                print("This may take a while...")
+
+            if mode == 'staged':
+                target = connection
+                if db_name != params["dbname"]:
+                    target = get_connection(db_name)
+                    if not target:
+                        raise Exception(f"Unable to connect to target database {db_name}")
+                succeeded = False
+                try:
+                    staged_restore(
+                        str(backup_file), target, dbname_arg, filters, env,
+                        data_jobs=data_jobs, index_jobs=index_jobs,
+                        maintenance_work_mem=maintenance_work_mem,
+                        load_settings=load_settings, governor=governor, progress=progress,
+                        timeout=timeout, max_ignored_errors=max_ignored_errors
+                    )
+                    succeeded = True
+                finally:
+                    if target is not connection:
+                        target.close()
+                    if progress:
+                        progress.finish(succeeded)
+                print("\nRestore completed!")
+                return True
+
+            result = None
+            try:
+                result = run_pg_restore(command, env, str(backup_file), governor, progress, timeout)
+            finally:
+                if progress:
+                    progress.finish(result is not None and result.ok)
+
+            report_restore(result, max_ignored_errors=max_ignored_errors)
             print("\nRestore completed!")
-            if result.stdout:
-                print("Details:", result.stdout)
-                
+
             return True
             
         finally:
@@ -102,14 +180,51 @@ def postgres_restore(backup_file: str, target_db: Optional[str] = None) -> bool:
         return False
 
 RESTORE_FUNCTIONS = {
-    'postgres': postgres_restore
+    'postgres': postgres_restore,
+    'mongodb': mongodb_restore
 }
     
+@contextmanager
+def prepared_backup(backup_file: str, cloud_manager=None, is_cloud_backup: bool = False,
+                    governor: Optional[ResourceGovernor] = None, keyring: Optional[Keyring] = None,
+                    cache: Optional[DownloadCache] = None):
+    # downloads and unpacks the backup once; the yielded file stays valid
+    # (and a cache entry stays locked) until the block exits
+    logger = DatabaseLogger()
+    temp_dir = None
+    with ExitStack() as cached:
+        try:
+            local_backup = backup_file
+            if is_cloud_backup and cloud_manager and cache:
+                local_backup = cached.enter_context(cache.open(backup_file, cloud_manager, governor))
+            elif is_cloud_backup and cloud_manager:
+                temp_dir = mkdtemp()
+                logger.info(f"Created temporary directory: {temp_dir}")
+                local_backup = cloud_manager.download_backup(backup_file, temp_dir, governor=governor)
+                logger.log_storage_operation("cloud", "download", local_backup, True)
+
+            if not os.path.exists(local_backup):
+                raise Exception(f"Backup file not found: {local_backup}")
+
+            # local copies are stored exactly as produced by the pipeline
+            if is_artifact(local_backup):
+                temp_dir = temp_dir or mkdtemp()
+                local_backup = str(unpack_artifact(local_backup, temp_dir, keyring, remove_source=False))
+
+            yield local_backup
+
+        finally:
+            if temp_dir and os.path.exists(temp_dir):
+                logger.info(f"Cleaning up temporary directory: {temp_dir}")
+                shutil.rmtree(temp_dir)
+
 def restore_backup(backup_file: str, target_db: Optional[str] = None, 
                   cloud_manager=None, is_cloud_backup: bool = False, 
-                  db_type: str = 'postgres') -> bool:
+                  db_type: str = 'postgres', options: Optional[Dict] = None,
+                  governor: Optional[ResourceGovernor] = None, keyring: Optional[Keyring] = None,
+                  progress: Optional[ProgressTracker] = None,
+                  cache: Optional[DownloadCache] = None) -> bool:
     logger = DatabaseLogger()    
-    temp_dir = None
     try:
         logger.log_database_action(
             "restore_start",
@@ -125,18 +240,8 @@ def restore_backup(backup_file: str, target_db: Optional[str] = None,
         if not restore_func:
             raise ValueError(f"Unsupported database type: {db_type}")
 
-        local_backup = backup_file
-        if is_cloud_backup and cloud_manager:
-            from tempfile import mkdtemp
-            temp_dir = mkdtemp()
-            logger.info(f"Created temporary directory: {temp_dir}")
-            local_backup = cloud_manager.download_backup(backup_file, temp_dir)
-            logger.log_storage_operation("cloud", "download", local_backup, True)
-
-        if not os.path.exists(local_backup):
-            raise Exception(f"Backup file not found: {local_backup}")
-            
-        success = restore_func(local_backup, target_db)
+        with prepared_backup(backup_file, cloud_manager, is_cloud_backup, governor, keyring, cache) as local_backup:
+            success = restore_func(local_backup, target_db, governor=governor, progress=progress, **(options or {}))
         logger.log_database_action(
             "restore_complete",
             {"success": success}
@@ -146,10 +251,3 @@ def restore_backup(backup_file: str, target_db: Optional[str] = None,
     except Exception as e:
         logger.log_critical_error("Restore operation failed", e)
         return False
-        
-    finally:
-        if temp_dir and os.path.exists(temp_dir):
-            import shutil
-            logger.info(f"Cleaning up temporary directory: {temp_dir}")
-            shutil.rmtree(temp_dir)
-
@@ -0,0 +1,157 @@
+import re
+import time
+from typing import Dict, List, Optional
+from backup.process_runner import ProcessResult, ProcessRunner
+from backup.progress import ProgressTracker
+from backup.resource_governor import ResourceGovernor
+from logger import DatabaseLogger
+
+
+IGNORED_ERRORS = re.compile(r'errors ignored on restore: (\d+)')
+# pg_restore: error: COPY failed for table "users": ERROR:  ...
+DATA_ERRORS = re.compile(r'COPY failed for table|large object', re.I)
+# --disable-triggers needs superuser for system triggers; the rows still load
+TRIGGER_NOISE = re.compile(r'^Command was: ALTER TABLE .* (?:DISABLE|ENABLE) TRIGGER ALL', re.I)
+
+
+def run_pg_restore(command: List[str], env: Dict, backup_file: str,
+                   governor: Optional[ResourceGovernor] = None,
+                   progress: Optional[ProgressTracker] = None,
+                   timeout: Optional[int] = None) -> ProcessResult:
+    return ProcessRunner(command, env, governor, progress, monitor_file=backup_file, timeout=timeout).run()
+
+
+def ignored_errors(result: ProcessResult) -> Optional[int]:
+    for line in reversed(result.tail):
+        match = IGNORED_ERRORS.search(line)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def trigger_noise(result: ProcessResult) -> int:
+    return sum(1 for message in result.errors
+               if any(TRIGGER_NOISE.match(line.strip()) for line in message.context))
+
+
+def restore_failed(result: ProcessResult, section: Optional[str] = None,
+                   max_ignored_errors: Optional[int] = None) -> bool:
+    # pg_restore exits with 1 when it skipped statements it could not run
+    # and sums them up as "errors ignored on restore"; any other non-zero
+    # exit means it stopped before the end of the archive
+    if result.ok:
+        return False
+    if result.timed_out or result.cancelled or result.returncode < 0:
+        return True
+    ignored = ignored_errors(result)
+    if ignored is None:
+        return True
+    # skipped schema objects are expected on Supabase, skipped rows are lost
+    # data; in the data section only the trigger toggles may fail
+    if any(DATA_ERRORS.search(message.text) for message in result.errors):
+        return True
+    if section == 'data' and ignored > trigger_noise(result):
+        return True
+    return max_ignored_errors is not None and ignored > max_ignored_errors
+
+
+def report_restore(result: ProcessResult, section: Optional[str] = None,
+                   max_ignored_errors: Optional[int] = None):
+    stage = f"{section} stage" if section else "restore"
+    if restore_failed(result, section, max_ignored_errors):
+        raise Exception(f"pg_restore failed during {stage}: {result.summary()}")
+    if not result.ok or result.warnings:
+        print(f"Warnings during {stage} (these are usually okay for Supabase):")
+        print(result.summary())
+
+
+def session_options(settings: Dict) -> str:
+    return " ".join(f"-c {name}={value}" for name, value in settings.items())
+
+
+def clean_statements(backup_file: str, filters: List[str], env: Dict) -> List[str]:
+    # pg_restore --clean prints the DROP statements for every object in the
+    # archive ahead of the CREATE statements; running them up front lets the
+    # stages below recreate everything without tripping over old indexes
+    # and foreign keys
+    command = ["pg_restore", "--clean", "--if-exists", "--schema-only", "--file=-"] + filters + [backup_file]
+    statements = []
+    found_create = []
+
+    def collect(stdout):
+        for raw in stdout:
+            line = raw.decode('utf-8', errors='replace').rstrip('\n')
+            if line.startswith(("DROP SCHEMA ", "DROP EXTENSION ")):
+                continue
+            if line.startswith("DROP ") or (line.startswith("ALTER TABLE ") and " DROP CONSTRAINT " in line):
+                statements.append(line)
+            elif statements and line.startswith("CREATE "):
+                # the rest of the schema is not needed
+                found_create.append(line)
+                return
+
+    result = ProcessRunner(command, env).run(collect)
+    # stopping early closes the pipe under pg_restore, so its exit status
+    # only matters when it ran to the end
+    if not found_create and not result.ok:
+        raise Exception(f"Could not read the schema from {backup_file}: {result.summary()}")
+    return statements
+
+
+def staged_restore(backup_file: str, connection, dbname_arg: str, filters: List[str], env: Dict,
+                   data_jobs: int = 4, index_jobs: int = 4, maintenance_work_mem: str = '1GB',
+                   load_settings: Optional[Dict] = None,
+                   governor: Optional[ResourceGovernor] = None,
+                   progress: Optional[ProgressTracker] = None,
+                   timeout: Optional[int] = None,
+                   max_ignored_errors: Optional[int] = None) -> Dict[str, float]:
+    logger = DatabaseLogger()
+    timings = {}
+
+    started = time.perf_counter()
+    statements = clean_statements(backup_file, filters, env)
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    connection.commit()
+    timings['clean'] = time.perf_counter() - started
+
+    data_settings = {
+        'synchronous_commit': 'off',
+        'maintenance_work_mem': maintenance_work_mem,
+    }
+    data_settings.update(load_settings or {})
+    index_settings = {
+        'maintenance_work_mem': maintenance_work_mem,
+        'max_parallel_maintenance_workers': max(1, index_jobs // 2),
+    }
+
+    stages = [
+        ('pre-data', [], {}),
+        ('data', [f"--jobs={data_jobs}", "--disable-triggers"], data_settings),
+        ('post-data', [f"--jobs={index_jobs}"], index_settings),
+    ]
+
+    for section, extra_args, settings in stages:
+        stage_env = env.copy()
+        if settings:
+            stage_env["PGOPTIONS"] = (env.get("PGOPTIONS", "") + " " + session_options(settings)).strip()
+
+        command = ["pg_restore", f"--section={section}"] + extra_args + filters + [dbname_arg, backup_file]
+        print(f"\nRestore stage {section}...")
+        started = time.perf_counter()
+        result = run_pg_restore(
+            command, stage_env, backup_file, governor,
+            progress if section == 'data' else None, timeout
+        )
+        timings[section] = time.perf_counter() - started
+        report_restore(result, section, max_ignored_errors)
+
+        print(f"Stage {section} finished in {timings[section]:.1f}s")
+
+    logger.log_database_action("staged_restore_timings", {k: round(v, 2) for k, v in timings.items()})
+    print("\nStage timings:")
+    for stage, seconds in timings.items():
+        print(f"  {stage:<10} {seconds:8.1f}s")
+    print(f"  {'total':<10} {sum(timings.values()):8.1f}s")
+    return timings
@@ -0,0 +1,47 @@
+import json
+import tarfile
+from pathlib import Path
+from typing import Tuple
+from backup.parallel_copy_backup import MANIFEST_NAME, PCOPY_EXTENSION, SCHEMA_NAME, part_members
+from backup.process_runner import ProcessRunner
+
+
+def verify_dump(path: Path) -> Tuple[bool, str]:
+    entries = []
+
+    def collect(stdout):
+        for raw in stdout:
+            if not raw.startswith(b';'):
+                entries.append(raw)
+
+    result = ProcessRunner(["pg_restore", "--list", str(path)]).run(collect)
+    if not result.ok:
+        return False, result.summary()
+    if not entries:
+        return False, f"{path.name} has an empty table of contents"
+    return True, f"{path.name}: {len(entries)} archive entries readable"
+
+
+def verify_pcopy(path: Path) -> Tuple[bool, str]:
+    with tarfile.open(path, 'r') as archive:
+        members = {member.name: member for member in archive.getmembers()}
+        if MANIFEST_NAME not in members or SCHEMA_NAME not in members:
+            return False, f"{path.name} is missing its manifest or schema"
+        manifest = json.load(archive.extractfile(MANIFEST_NAME))
+        parts = [part for table in manifest['tables'].values() for part in table['parts']]
+        parts += manifest.get('large_objects', [])
+        missing = [member for part in parts for member in part_members(part) if member not in members]
+        if missing:
+            return False, f"{path.name} is missing {len(missing)} data files, first: {missing[0]}"
+    return True, f"{path.name}: {len(manifest['tables'])} tables in {len(parts)} parts present"
+
+
+def verify_backup_file(path) -> Tuple[bool, str]:
+    # the file has already been decrypted and decompressed, which checks
+    # every GCM tag and the gzip/xz/zstd checksums on the way
+    path = Path(path)
+    if path.name.endswith(PCOPY_EXTENSION):
+        return verify_pcopy(path)
+    if path.suffix == '.dump':
+        return verify_dump(path)
+    return True, f"{path.name}: {path.stat().st_size} bytes readable"
@@ -8,6 +8,9 @@ from dotenv import load_dotenv
 from backup.backup_manager import BackupManager
 from logger import DatabaseLogger
 from notifications.notifier import SlackNotifier
+from storage.recompaction import Recompactor
+from storage.replication import Replicator
+from jobs.queue import JobQueue
 
 class BackupScheduler:
     def __init__(self, config_path: Optional[str] = None):
@@ -15,7 +18,7 @@ class BackupScheduler:
         
         self.logger = DatabaseLogger()
         self.config = self.load_config(config_path)
-        self.backup_manager = BackupManager(self.config)
+        self.backup_manager = BackupManager(self.config, progress_callbacks=[self.log_progress])
         
         self.notifier = None
         if self.config.get('notification_enabled'):
@@ -25,9 +28,24 @@ class BackupScheduler:
                     logger=self.logger
                 )
                 self.logger.info("Slack notifier initialized successfully")
+                if self.config.get('progress_notification_step'):
+                    self.backup_manager.add_progress_callback(
+                        self.notifier.progress_callback(self.config['progress_notification_step'])
+                    )
             except Exception as e:
                 self.logger.error(f"Failed to initialize Slack notifier: {str(e)}")
 
+    def log_progress(self, event):
+        if event.phase == 'progress':
+            return
+        percent = f"{event.percent:.1f}%" if event.percent is not None else "n/a"
+        self.logger.info(
+            f"{event.operation} {event.phase}: {percent}, "
+            f"{event.items_done}/{event.items_total or '?'} tables, "
+            f"{event.throughput / (1024 * 1024):.1f}MB/s"
+            + (f", current: {event.current_item}" if event.current_item else "")
+        )
+
     def load_config(self, config_path: Optional[str] = None) -> dict:
         if config_path is None:
             config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
@@ -121,11 +139,79 @@ class BackupScheduler:
                 )
             return False
 
+    def enqueue_jobs(self) -> bool:
+        # with a shared queue the scheduler only hands out work; any
+        # worker node picks it up
+        try:
+            queue = JobQueue(self.config['job_queue'])
+            job_id = queue.enqueue('backup', {
+                'db_type': self.config['db_type'],
+                'compress': self.config['compress'],
+                'store_locally': False,
+                'store_in_cloud': True,
+            })
+            self.logger.info(f"Queued backup job {job_id}")
+            if self.config['cloud_storage'].get('replication', {}).get('targets'):
+                job_id = queue.enqueue('replicate', {}, delay=30)
+                self.logger.info(f"Queued replication job {job_id}")
+            if self.config.get('retention'):
+                job_id = queue.enqueue('retention', {'storage': 'cloud'}, delay=60)
+                self.logger.info(f"Queued retention job {job_id}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Could not queue scheduled jobs: {str(e)}")
+            return False
+
+    def run_replication(self) -> bool:
+        if not self.config['cloud_storage'].get('replication', {}).get('targets'):
+            return True
+        try:
+            report = Replicator(self.config, self.backup_manager.cloud_storage).run()
+            self.logger.info(
+                f"Replication finished: {report['copied']} copied "
+                f"({report['bytes_copied'] / (1024 ** 3):.2f}GB), {report['up_to_date']} up to date, "
+                f"{report['failed']} failed"
+            )
+            if report['failed']:
+                if self.notifier:
+                    self.notifier.send_notification(
+                        operation="replication",
+                        status=False,
+                        error="; ".join(report['errors'][:5])
+                    )
+                return False
+            return True
+        except Exception as e:
+            self.logger.error(f"Replication failed: {str(e)}")
+            return False
+
+    def run_recompaction(self) -> bool:
+        # runs after the backup so it only competes with an idle host
+        if not self.config.get('recompaction', {}).get('enabled'):
+            return True
+        try:
+            recompactor = Recompactor(self.config, self.backup_manager.cloud_storage,
+                                      self.backup_manager.local_storage, self.backup_manager.keyring)
+            report = recompactor.run()
+            self.logger.info(
+                f"Recompaction finished: {report['recompacted']} recompacted, {report['tiered']} tiered, "
+                f"{report['bytes_saved'] / (1024 ** 3):.2f}GB saved, "
+                f"${report['monthly_savings']:.2f}/month saved"
+            )
+            return True
+        except Exception as e:
+            self.logger.error(f"Recompaction failed: {str(e)}")
+            return False
+
 def main():
     """Main entry point for the scheduler"""
     config_path = sys.argv[1] if len(sys.argv) > 1 else None
     scheduler = BackupScheduler(config_path)
-    scheduler.run_backup()
+    if scheduler.config.get('job_queue', {}).get('enabled'):
+        scheduler.enqueue_jobs()
+    elif scheduler.run_backup():
+        scheduler.run_replication()
+        scheduler.run_recompaction()
 
 if __name__ == "__main__":
     main()
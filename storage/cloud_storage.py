@@ -1,58 +1,61 @@
+import os
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
 from datetime import datetime
-import gzip
-import shutil
 from pathlib import Path
+from typing import Dict, Optional
+from backup.encryption import Keyring
+from backup.pipeline import unpack_artifact
+from storage.formats import is_backup_file
+from export.columnar_export import EXPORT_MANIFEST
 
+# resumable transfers move data in chunks of this size, which keeps
+# throttled uploads and downloads smooth instead of one long burst
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+EXPORT_PREFIX = 'exports/'
+DEFAULT_BUCKET = 'dbbucket1234'
 
 class CloudStorageManager:
-    def __init__(self):
-        self.storage_client = storage.Client()
-        self.bucket = self.storage_client.get_bucket('dbbucket1234')
+    def __init__(self, keyring: Optional[Keyring] = None, settings: Optional[Dict] = None):
+        settings = settings or {}
+        if os.getenv('STORAGE_EMULATOR_HOST'):
+            # the client sends everything to the emulator, which needs no credentials
+            self.storage_client = storage.Client(project=settings.get('project_id', 'emulator'),
+                                                 credentials=AnonymousCredentials())
+        else:
+            self.storage_client = storage.Client(project=settings.get('project_id'))
+        self.bucket = self.storage_client.get_bucket(settings.get('bucket', DEFAULT_BUCKET))
+        # other buckets by name, e.g. {"offsite": "backups-eu"}
+        self.bucket_names = settings.get('buckets', {})
+        self.keyring = keyring or Keyring()
 
-    def compress_file(self, file_path: Path) -> Path:
-        compressed_file = file_path.with_suffix(file_path.suffix + '.gz')
-        with file_path.open('rb') as f_in:
-            with gzip.open(str(compressed_file), 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        return compressed_file
+    def named_bucket(self, name: str):
+        # a configured name or a plain bucket name
+        if name in ('primary', self.bucket.name):
+            return self.bucket
+        return self.storage_client.bucket(self.bucket_names.get(name, name))
 
-    def upload_backup(self, file_path: str, compress: bool = True) -> str:
-        try:
-            file_path = Path(file_path)
-            filename = file_path.name
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            cloud_path = f"backups/{timestamp}_{filename}"
-            
-            if compress:
-                upload_path = self.compress_file(file_path)
-                cloud_path += '.gz'
-            else:
-                upload_path = file_path
-
-            blob = self.bucket.blob(cloud_path)
-            blob.upload_from_filename(str(upload_path))
-
-            metadata = {
-                'uploaded_at': datetime.now().isoformat(),
-                'original_name': filename,
-                'size': str(upload_path.stat().st_size)
-            }
-            blob.metadata = metadata
-            blob.patch()
-
-            print(f"Backup uploaded to cloud storage: {cloud_path}")
-            
-            if compress and upload_path != file_path:
-                upload_path.unlink()
+    @staticmethod
+    def blob_path(filename: str) -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f"backups/{timestamp}_{filename}"
 
-            return cloud_path
-
-        except Exception as e:
-            print(f"Error uploading to cloud storage: {str(e)}")
-            return None
+    def upload_export(self, export_dir: str, governor=None) -> str:
+        # the manifest goes last, so a half uploaded export is never queried
+        export_dir = Path(export_dir)
+        prefix = f"{EXPORT_PREFIX}{export_dir.name}/"
+        files = sorted(export_dir.iterdir(), key=lambda path: path.name == EXPORT_MANIFEST)
+        for path in files:
+            blob = self.bucket.blob(prefix + path.name, chunk_size=TRANSFER_CHUNK_SIZE)
+            if governor:
+                with path.open('rb') as f:
+                    blob.upload_from_file(governor.wrap_upload(f), size=path.stat().st_size)
+            else:
+                blob.upload_from_filename(str(path))
+        print(f"Export uploaded to cloud storage: {prefix} ({len(files)} files)")
+        return prefix
 
-    def download_backup(self, cloud_path: str, local_dir: str) -> str:
+    def download_backup(self, cloud_path: str, local_dir: str, governor=None, unpack: bool = True) -> str:
         try:
             if not cloud_path.startswith('backups/'):
                 cloud_path = f'backups/{cloud_path}'
@@ -63,22 +66,19 @@ class CloudStorageManager:
             
             print(f"Downloading {cloud_path} to {local_path}...")
             
-            blob = self.bucket.blob(cloud_path)
+            blob = self.bucket.blob(cloud_path, chunk_size=TRANSFER_CHUNK_SIZE)
             if not blob.exists():
                 raise Exception(f"Backup file not found in cloud storage: {cloud_path}")
-                
-            blob.download_to_filename(str(local_path))
-            
-            if cloud_path.endswith('.gz'):
-                decompressed_path = local_path.with_suffix('')
-                print(f"Decompressing to {decompressed_path}...")
-                with gzip.open(local_path, 'rb') as f_in:
-                    with decompressed_path.open('wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                local_path.unlink()
-                return str(decompressed_path)
+
+            if governor:
+                with local_path.open('wb') as f:
+                    blob.download_to_file(governor.wrap_download(f))
+            else:
+                blob.download_to_filename(str(local_path))
             
-            return str(local_path)
+            if not unpack:
+                return str(local_path)
+            return str(unpack_artifact(local_path, keyring=self.keyring))
 
         except Exception as e:
             print(f"Error downloading from cloud storage: {str(e)}")
@@ -105,7 +105,7 @@ class CloudStorageManager:
                 
             backups = []
             for blob in blobs:
-                if blob.name.endswith('.dump') or blob.name.endswith('.dump.gz'):
+                if is_backup_file(blob.name):
                     size_mb = blob.size / (1024 * 1024)
                     backup_info = {
                         'name': Path(blob.name).name,
@@ -0,0 +1,303 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from backup.encryption import ENCRYPTED_SUFFIX
+from backup.pipeline import unpack_artifact
+
+GB = 1024 ** 3
+STATS_KEYS = ('hits', 'misses', 'evictions', 'bytes_from_cache', 'bytes_downloaded')
+
+
+def cache_key(blob_name: str, generation, checksum: Optional[str]) -> str:
+    return hashlib.sha256(f"{blob_name}\0{generation}\0{checksum}".encode()).hexdigest()[:32]
+
+
+def is_encrypted(name: str) -> bool:
+    return name.endswith(ENCRYPTED_SUFFIX)
+
+
+class DownloadCache:
+    # Layout:
+    #   .lock           guards index.json, stats.json and eviction
+    #   index.json      blob name -> entry key
+    #   entries/<key>/  the backup, meta.json and a per-entry .lock
+    # Backups are stored decompressed, except encrypted ones, which stay
+    # encrypted as downloaded and are unpacked into a temporary directory
+    # for each use, so no plaintext copy outlives the restore.
+    # Readers hold a shared lock on the entry for as long as they use the
+    # file, so eviction skips entries that are being restored from.
+    def __init__(self, cache_dir: str, max_bytes: int, revalidate: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.entries_dir = self.cache_dir / "entries"
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+
+    @classmethod
+    def from_config(cls, config: Dict):
+        settings = config.get('download_cache')
+        if not settings or not settings.get('enabled', True):
+            return None
+        return cls(settings.get('dir', os.path.join(config['local_storage_dir'], '.download_cache')),
+                   int(settings.get('max_gb', 50) * GB),
+                   settings.get('revalidate', False))
+
+    @contextmanager
+    def _global_lock(self):
+        with open(self.cache_dir / ".lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_json(self, name: str) -> Dict:
+        try:
+            with open(self.cache_dir / name) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, name: str, data: Dict):
+        tmp = self.cache_dir / f".{name}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.cache_dir / name)
+
+    def _count(self, **increments):
+        stats = self._read_json("stats.json")
+        for key, value in increments.items():
+            stats[key] = stats.get(key, 0) + value
+        self._write_json("stats.json", stats)
+
+    def _entry_meta(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self.entries_dir / key / "meta.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _entries(self) -> Iterator[Dict]:
+        for entry in self.entries_dir.iterdir():
+            meta = self._entry_meta(entry.name)
+            if meta:
+                try:
+                    meta['last_used'] = (entry / ".lock").stat().st_mtime
+                except OSError:
+                    meta['last_used'] = 0
+                yield meta
+
+    def _open_entry_lock(self, key: str):
+        entry = self.entries_dir / key
+        entry.mkdir(exist_ok=True)
+        return open(entry / ".lock", 'a')
+
+    def _evict(self, needed: int, index: Dict) -> int:
+        # least recently used first; entries in use by a reader are skipped
+        entries = sorted(self._entries(), key=lambda meta: meta['last_used'])
+        total = sum(meta['size'] for meta in entries)
+        evicted = 0
+        for meta in entries:
+            if total + needed <= self.max_bytes:
+                break
+            if self._drop(meta, index):
+                total -= meta['size']
+                evicted += 1
+        return evicted
+
+    def _drop(self, meta: Dict, index: Dict) -> bool:
+        lock = self._open_entry_lock(meta['key'])
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        try:
+            shutil.rmtree(self.entries_dir / meta['key'], ignore_errors=True)
+        finally:
+            lock.close()
+        if index.get(meta['blob']) == meta['key']:
+            del index[meta['blob']]
+        print(f"Evicted {meta['file']} from the download cache")
+        return True
+
+    def _remove_stale(self):
+        # entries left half written by a crashed download, and decrypted
+        # copies of encrypted backups cached by earlier versions
+        for entry in self.entries_dir.iterdir():
+            meta = self._entry_meta(entry.name)
+            if meta and not (is_encrypted(meta['blob']) and not is_encrypted(meta['file'])):
+                continue
+            lock = self._open_entry_lock(entry.name)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(entry, ignore_errors=True)
+            except BlockingIOError:
+                pass
+            finally:
+                lock.close()
+
+    def _lookup(self, blob_name: str, cloud_manager):
+        # without revalidation a hit never touches the network; backup blob
+        # names carry a timestamp and are never overwritten
+        with self._global_lock():
+            key = self._read_json("index.json").get(blob_name)
+            if key and not self.revalidate:
+                lock = self._try_shared(key)
+                if lock:
+                    return key, lock, None
+
+        blob = cloud_manager.bucket.get_blob(blob_name)
+        if blob is None:
+            raise Exception(f"Backup file not found in cloud storage: {blob_name}")
+        key = cache_key(blob_name, blob.generation, blob.crc32c or blob.md5_hash)
+        with self._global_lock():
+            lock = self._try_shared(key)
+            if lock:
+                return key, lock, blob
+        return key, None, blob
+
+    def _try_shared(self, key: str):
+        if not self._entry_meta(key):
+            return None
+        lock = self._open_entry_lock(key)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        os.utime(self.entries_dir / key / ".lock")
+        return lock
+
+    def _lock_exclusive(self, key: str):
+        # only one process downloads a given blob; the others wait here
+        # and then find the finished entry. If the entry was evicted while
+        # we waited, the lock we got belongs to a deleted file, so retry.
+        while True:
+            lock = self._open_entry_lock(key)
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.entries_dir / key / ".lock").st_ino == os.fstat(lock.fileno()).st_ino:
+                    return lock
+            except FileNotFoundError:
+                pass
+            lock.close()
+
+    def _populate(self, key: str, blob, cloud_manager, governor):
+        entry = self.entries_dir / key
+        lock = self._lock_exclusive(key)
+        meta = self._entry_meta(key)
+        if meta:
+            # another restore downloaded it while we waited; downgrading
+            # under the global lock keeps eviction from slipping in between
+            with self._global_lock():
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                self._count(hits=1, bytes_from_cache=meta['size'])
+            return lock
+
+        try:
+            with self._global_lock():
+                index = self._read_json("index.json")
+                evicted = self._evict(blob.size, index)
+                self._write_json("index.json", index)
+                if evicted:
+                    self._count(evictions=evicted)
+
+            work_dir = entry / "download"
+            shutil.rmtree(work_dir, ignore_errors=True)
+            path = Path(cloud_manager.download_backup(blob.name, str(work_dir), governor=governor,
+                                                      unpack=not is_encrypted(blob.name)))
+            final = entry / path.name
+            os.replace(path, final)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+            meta = {
+                'key': key,
+                'blob': blob.name,
+                'generation': blob.generation,
+                'checksum': blob.crc32c or blob.md5_hash,
+                'file': final.name,
+                'size': final.stat().st_size,
+                'cached_at': time.time(),
+            }
+            with open(entry / ".meta.json.tmp", 'w') as f:
+                json.dump(meta, f)
+            os.replace(entry / ".meta.json.tmp", entry / "meta.json")
+
+            with self._global_lock():
+                index = self._read_json("index.json")
+                index[blob.name] = key
+                # the new entry is still locked exclusively, so it is never picked
+                evicted = self._evict(0, index)
+                self._write_json("index.json", index)
+                self._count(misses=1, bytes_downloaded=blob.size, evictions=evicted)
+                fcntl.flock(lock, fcntl.LOCK_SH)
+        except BaseException:
+            shutil.rmtree(entry, ignore_errors=True)
+            lock.close()
+            raise
+        return lock
+
+    @contextmanager
+    def open(self, blob_name: str, cloud_manager, governor=None) -> Iterator[str]:
+        if not blob_name.startswith('backups/'):
+            blob_name = f'backups/{blob_name}'
+        self._remove_stale()
+
+        key, lock, blob = self._lookup(blob_name, cloud_manager)
+        if lock:
+            meta = self._entry_meta(key)
+            with self._global_lock():
+                self._count(hits=1, bytes_from_cache=meta['size'])
+            print(f"Using cached copy of {blob_name}")
+        else:
+            lock = self._populate(key, blob, cloud_manager, governor)
+            meta = self._entry_meta(key)
+
+        unpacked = None
+        try:
+            path = self.entries_dir / key / meta['file']
+            if is_encrypted(meta['file']):
+                unpacked = tempfile.mkdtemp(prefix="cache_unpack_")
+                path = unpack_artifact(path, Path(unpacked), cloud_manager.keyring, remove_source=False)
+            yield str(path)
+        finally:
+            if unpacked:
+                shutil.rmtree(unpacked, ignore_errors=True)
+            lock.close()
+            # a single backup larger than the whole cache is not kept
+            if meta['size'] > self.max_bytes:
+                with self._global_lock():
+                    index = self._read_json("index.json")
+                    self._drop(meta, index)
+                    self._write_json("index.json", index)
+
+    def stats(self) -> Dict:
+        with self._global_lock():
+            stats = self._read_json("stats.json")
+            entries = list(self._entries())
+        report = {key: stats.get(key, 0) for key in STATS_KEYS}
+        lookups = report['hits'] + report['misses']
+        report['hit_rate'] = report['hits'] / lookups if lookups else 0.0
+        report['entries'] = len(entries)
+        report['size'] = sum(meta['size'] for meta in entries)
+        report['max_size'] = self.max_bytes
+        return report
+
+    def clear(self) -> int:
+        with self._global_lock():
+            index = self._read_json("index.json")
+            max_bytes, self.max_bytes = self.max_bytes, 0
+            try:
+                evicted = self._evict(0, index)
+            finally:
+                self.max_bytes = max_bytes
+            self._write_json("index.json", index)
+        return evicted
@@ -0,0 +1,202 @@
+import hashlib
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from backup.compression import CHUNK_SIZE
+from storage.file_ops import clone_file, partial_path, same_filesystem
+
+try:
+    from google.cloud.storage import transfer_manager
+except ImportError:
+    transfer_manager = None
+
+# parts of a parallel upload; the XML multipart API needs at least 5MB
+PARALLEL_PART_SIZE = 32 * 1024 * 1024
+
+
+class Sink:
+    def __init__(self, name: str, required: bool = True):
+        self.name = name
+        self.required = required
+        self.error: Optional[Exception] = None
+        self.location: Optional[str] = None
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    def start(self, source: Path):
+        pass
+
+    def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    def finish(self) -> str:
+        raise NotImplementedError
+
+    def abort(self):
+        pass
+
+
+class LocalSink(Sink):
+    def __init__(self, name: str, storage, required: bool = True):
+        super().__init__(name, required)
+        # a LocalStorageManager, which owns publishing and dedupe
+        self.storage = storage
+        self.source = None
+        self.link = False
+        self.tmp = None
+        self.digest = None
+        self.method = None
+
+    def start(self, source: Path):
+        self.source = source
+        self.dest = self.storage.storage_dir / source.name
+        self.tmp = partial_path(self.dest)
+        # on the same filesystem the finished artifact is simply linked in;
+        # on another one it is cloned or copied by the kernel once the stream
+        # is through, so no bytes are written from here either way
+        self.link = same_filesystem(source, self.storage.storage_dir)
+        if not self.link and self.storage.dedupe:
+            # hashed on the way through, so dedupe does not read the copy back
+            self.digest = hashlib.sha256()
+
+    def write(self, chunk: bytes):
+        if self.digest:
+            self.digest.update(chunk)
+
+    def finish(self) -> str:
+        if self.link:
+            self.method = 'hardlink'
+            return self.storage.publish_backup(self.source, self.dest, link=True)
+        self.method = clone_file(self.source, self.tmp)
+        return self.storage.publish_backup(self.tmp, self.dest,
+                                           self.digest.hexdigest() if self.digest else None)
+
+    def abort(self):
+        if self.tmp:
+            self.tmp.unlink(missing_ok=True)
+
+
+class GCSSink(Sink):
+    def __init__(self, name: str, bucket, blob_name: str, metadata: Optional[Dict] = None,
+                 governor=None, chunk_size: int = 8 * 1024 * 1024, required: bool = True,
+                 concurrency: int = 1):
+        super().__init__(name, required)
+        self.bucket = bucket
+        self.blob_name = blob_name
+        self.metadata = metadata or {}
+        self.governor = governor
+        self.chunk_size = chunk_size
+        self.writer = None
+        # several streams only help while uploads are not rate limited
+        self.concurrency = concurrency
+        if transfer_manager is None or (governor and governor.upload_bucket):
+            self.concurrency = 1
+        self.source = None
+
+    def start(self, source: Path):
+        blob = self.bucket.blob(self.blob_name, chunk_size=self.chunk_size)
+        blob.metadata = self.metadata
+        if self.concurrency > 1:
+            # parts are uploaded straight from the finished artifact
+            self.blob = blob
+            self.source = source
+            return
+        self.writer = blob.open('wb', ignore_flush=True)
+        self.stream = self.governor.wrap_upload(self.writer) if self.governor else self.writer
+
+    def write(self, chunk: bytes):
+        if self.writer:
+            self.stream.write(chunk)
+
+    def finish(self) -> str:
+        if self.source:
+            transfer_manager.upload_chunks_concurrently(
+                str(self.source), self.blob, chunk_size=PARALLEL_PART_SIZE,
+                max_workers=self.concurrency, worker_type=transfer_manager.THREAD
+            )
+            self.blob.metadata = self.metadata
+            self.blob.patch()
+        else:
+            self.writer.close()
+        return f"gs://{self.bucket.name}/{self.blob_name}"
+
+    def abort(self):
+        # an unfinished resumable or multipart upload is never committed
+        # as an object
+        self.writer = None
+        self.source = None
+
+
+class FanOut:
+    def __init__(self, sinks: List[Sink], queue_depth: int = 8, chunk_size: int = CHUNK_SIZE):
+        self.sinks = sinks
+        self.queue_depth = queue_depth
+        self.chunk_size = chunk_size
+
+    def _drain(self, sink: Sink, chunks: queue.Queue):
+        started = time.perf_counter()
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if sink.error:
+                continue
+            try:
+                sink.write(chunk)
+                sink.bytes_written += len(chunk)
+            except Exception as e:
+                sink.error = e
+                print(f"Destination {sink.name} failed: {e}")
+        if not sink.error:
+            try:
+                sink.location = sink.finish()
+            except Exception as e:
+                sink.error = e
+                print(f"Destination {sink.name} failed: {e}")
+        if sink.error:
+            sink.abort()
+        sink.seconds = time.perf_counter() - started
+
+    def run(self, source: Path) -> List[Sink]:
+        source = Path(source)
+        active = []
+        for sink in self.sinks:
+            try:
+                sink.start(source)
+                active.append(sink)
+            except Exception as e:
+                sink.error = e
+                print(f"Destination {sink.name} failed to start: {e}")
+                sink.abort()
+
+        # every destination gets its own bounded queue and thread, so a slow
+        # one only holds back the reader once its queue is full; paired by
+        # position, names are labels and need not be unique
+        queues = [queue.Queue(maxsize=self.queue_depth) for _ in active]
+        threads = [
+            threading.Thread(target=self._drain, args=(sink, chunks), daemon=True)
+            for sink, chunks in zip(active, queues)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            with source.open('rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    for sink, chunks in zip(active, queues):
+                        if not sink.error:
+                            chunks.put(chunk)
+        except Exception as e:
+            # never publish a destination that did not receive the whole stream
+            for sink in active:
+                sink.error = sink.error or e
+            raise
+        finally:
+            for chunks in queues:
+                chunks.put(None)
+            for thread in threads:
+                thread.join()
+
+        return self.sinks
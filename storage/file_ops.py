@@ -0,0 +1,148 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+# none: leave flushing to the OS
+# file: fsync the data before it is published
+# full: also fsync the directory so the rename itself survives a crash
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+FICLONE = 0x40049409
+PARTIAL_SUFFIX = '.partial'
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def partial_path(dest: Path) -> Path:
+    return dest.parent / f".{dest.name}{PARTIAL_SUFFIX}"
+
+
+def fsync_dir(directory: Path):
+    fd = os.open(str(directory), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_file(path: Path, policy: str):
+    if policy == 'none':
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish(tmp: Path, dest: Path, policy: str):
+    sync_file(tmp, policy)
+    os.replace(tmp, dest)
+    if policy == 'full':
+        fsync_dir(dest.parent)
+
+
+def preallocate(fd: int, size: int):
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        # not every filesystem supports it, the copy still works without
+        pass
+
+
+def reflink(src: Path, dest: Path) -> bool:
+    with open(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        try:
+            fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            return True
+        except OSError:
+            return False
+
+
+def copy_range(src: Path, dest: Path):
+    size = src.stat().st_size
+    with open(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        preallocate(f_out.fileno(), size)
+        copied = 0
+        try:
+            while copied < size:
+                if hasattr(os, 'copy_file_range'):
+                    n = os.copy_file_range(f_in.fileno(), f_out.fileno(), size - copied)
+                else:
+                    n = os.sendfile(f_out.fileno(), f_in.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            f_in.seek(copied)
+            f_out.seek(copied)
+            shutil.copyfileobj(f_in, f_out, HASH_CHUNK_SIZE)
+        f_out.truncate()
+
+
+def same_filesystem(a: Path, b: Path) -> bool:
+    return os.stat(a).st_dev == os.stat(b).st_dev
+
+
+def clone_file(src: Path, dest: Path) -> str:
+    # shares the blocks where the filesystem allows it, otherwise the kernel
+    # copies them without passing the data through this process
+    if reflink(src, dest):
+        return 'reflink'
+    copy_range(src, dest)
+    return 'copy'
+
+
+def atomic_copy(src: Path, dest: Path, policy: str = 'file') -> str:
+    src, dest = Path(src), Path(dest)
+    tmp = partial_path(dest)
+    try:
+        method = clone_file(src, tmp)
+        shutil.copystat(src, tmp)
+        publish(tmp, dest, policy)
+        return method
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def atomic_link(src: Path, dest: Path, policy: str = 'file'):
+    src, dest = Path(src), Path(dest)
+    tmp = partial_path(dest)
+    tmp.unlink(missing_ok=True)
+    os.link(src, tmp)
+    try:
+        publish(tmp, dest, policy)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_identical(path: Path, candidates, digest: Optional[str] = None) -> Optional[Path]:
+    # digest can be passed in when it was computed while the file was written
+    path = Path(path)
+    size = path.stat().st_size
+    for candidate in candidates:
+        candidate = Path(candidate)
+        if candidate == path or candidate.stat().st_size != size:
+            continue
+        if digest is None:
+            digest = file_digest(path)
+        if file_digest(candidate) == digest:
+            return candidate
+    return None
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+# raw outputs of the backup engines
+BACKUP_EXTENSIONS = ('.dump', '.archive', '.pcopy')
+
+# layers added on top of a raw backup by the storage pipeline
+ARTIFACT_SUFFIXES = ('.gz', '.xz', '.zst', '.enc')
+
+
+def base_backup_name(name: str) -> str:
+    name = Path(name).name
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in ARTIFACT_SUFFIXES:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                stripped = True
+    return name
+
+
+def is_backup_file(name: str) -> bool:
+    return base_backup_name(name).endswith(BACKUP_EXTENSIONS)
@@ -1,34 +1,61 @@
-import os
-import shutil
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
+from storage.formats import is_backup_file
+from storage.file_ops import (FSYNC_POLICIES, PARTIAL_SUFFIX, atomic_copy, atomic_link,
+                              find_identical, publish)
+
+# partial files younger than this may still belong to a running backup
+STALE_PARTIAL_SECONDS = 6 * 60 * 60
 
 class LocalStorageManager():
-    def __init__(self, storage_dir):
+    def __init__(self, storage_dir, fsync_policy: str = 'file', dedupe: bool = True):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}. Use one of {', '.join(FSYNC_POLICIES)}")
+
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.fsync_policy = fsync_policy
+        self.dedupe = dedupe
+        self.cleanup_partials()
 
-    def save_backup(self, backup_file):
-        try:
-            backup_path = self.storage_dir / os.path.basename(backup_file)
-            if os.path.abspath(backup_file) != os.path.abspath(backup_path):
-                shutil.copy2(backup_file, backup_path)
-                os.remove(backup_file)
+    def cleanup_partials(self):
+        now = time.time()
+        for partial in self.storage_dir.glob(f".*{PARTIAL_SUFFIX}"):
+            try:
+                if now - partial.stat().st_mtime > STALE_PARTIAL_SECONDS:
+                    partial.unlink()
+                    print(f"Removed incomplete backup left by an interrupted run: {partial.name}")
+            except OSError:
+                continue
 
-                temp_dir = os.path.dirname(backup_file)
-                if not os.listdir(temp_dir) and 'pg_backup_' in temp_dir:
-                    os.rmdir(temp_dir)
-                    
-            print(f"Backup saved locally: {backup_path}")
-            return str(backup_path)
-        except Exception as e:
-            print(f"Error saving backup locally: {str(e)}")
-            return None
+    def _backup_files(self):
+        for file in self.storage_dir.glob("*_backup_*"):
+            if file.is_file() and is_backup_file(file.name):
+                yield file
+
+    def publish_backup(self, written: Path, dest: Path, digest: Optional[str] = None,
+                       link: bool = False) -> str:
+        # written is either a finished partial file in this directory or,
+        # with link, a file on the same filesystem to hardlink in
+        written, dest = Path(written), Path(dest)
+        identical = find_identical(written, self._backup_files(), digest) if self.dedupe else None
+        if identical:
+            if not link:
+                written.unlink()
+            atomic_link(identical, dest, self.fsync_policy)
+            print(f"Backup is identical to {identical.name}, stored as a hardlink")
+        elif link:
+            atomic_link(written, dest, self.fsync_policy)
+        else:
+            publish(written, dest, self.fsync_policy)
+        return str(dest)
 
     def list_backups(self):
         try:
             backups = []
-            for file in self.storage_dir.glob("supabase_backup_*.dump"):
+            for file in self._backup_files():
                 stats = file.stat()
                 backups.append({
                     'name': file.name,
@@ -47,9 +74,13 @@ class LocalStorageManager():
             if not source.exists():
                 print(f"Backup file not found: {backup_name}")
                 return None
-            
+
             dest = Path(local_path) / backup_name
-            shutil.copy2(source, dest)
+            try:
+                # restores only read the archive, so sharing the inode is safe
+                atomic_link(source, dest, 'none')
+            except OSError:
+                atomic_copy(source, dest, 'none')
             return str(dest)
         except Exception as e:
             print(f"Error retrieving backup: {str(e)}")
@@ -66,4 +97,3 @@ class LocalStorageManager():
         except Exception as e:
             print(f"Error deleting backup: {str(e)}")
             return False
-
@@ -0,0 +1,292 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+from backup.compression import CODEC_SUFFIXES, codec_from_name, zstandard
+from backup.encryption import ENCRYPTED_SUFFIX, Keyring
+from backup.pipeline import is_artifact, prepare_artifact, unpack_artifact
+from logger import DatabaseLogger
+from storage.file_ops import fsync_dir
+from storage.formats import base_backup_name, is_backup_file
+
+GB = 1024 ** 3
+
+# USD per GB-month, override with recompaction.prices in config.json
+DEFAULT_PRICES = {
+    'STANDARD': 0.020,
+    'NEARLINE': 0.010,
+    'COLDLINE': 0.004,
+    'ARCHIVE': 0.0012,
+}
+
+DEFAULT_TIERS = [
+    {'age_days': 30, 'storage_class': 'NEARLINE'},
+    {'age_days': 90, 'storage_class': 'COLDLINE'},
+    {'age_days': 365, 'storage_class': 'ARCHIVE'},
+]
+
+
+class Recompactor:
+    def __init__(self, config: Dict, cloud_storage=None, local_storage=None, keyring: Optional[Keyring] = None):
+        policy = config.get('recompaction', {})
+        # zstd decompresses much faster on restore, xz needs no extra package
+        self.codec = policy.get('codec', 'zstd' if zstandard is not None else 'xz')
+        self.level = policy.get('level', 19 if self.codec == 'zstd' else 9)
+        self.min_age_days = policy.get('min_age_days', 7)
+        self.local_hot_days = policy.get('local_hot_days', 7)
+        self.idle_load = policy.get('idle_load', 0.5)
+        self.tiers = sorted(policy.get('tiers', DEFAULT_TIERS), key=lambda t: t['age_days'])
+        self.prices = {**DEFAULT_PRICES, **policy.get('prices', {})}
+        self.cloud_storage = cloud_storage
+        self.local_storage = local_storage
+        self.keyring = keyring or Keyring()
+        self.logger = DatabaseLogger()
+        self.report = {
+            'recompacted': 0,
+            'kept': 0,
+            'tiered': 0,
+            'skipped_busy': 0,
+            'cpu_seconds': 0.0,
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'bytes_saved': 0,
+            'monthly_cost_before': 0.0,
+            'monthly_cost_after': 0.0,
+        }
+
+    def is_idle(self) -> bool:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        return load < self.idle_load
+
+    def storage_class_for(self, age_days: float) -> str:
+        storage_class = 'STANDARD'
+        for tier in self.tiers:
+            if age_days >= tier['age_days']:
+                storage_class = tier['storage_class']
+        return storage_class
+
+    def monthly_cost(self, size: int, storage_class: str) -> float:
+        return size / GB * self.prices.get(storage_class, self.prices['STANDARD'])
+
+    def recoded_name(self, name: str) -> str:
+        encrypted = name.endswith(ENCRYPTED_SUFFIX)
+        base = base_backup_name(name)
+        return base + CODEC_SUFFIXES[self.codec] + (ENCRYPTED_SUFFIX if encrypted else '')
+
+    def needs_recompaction(self, name: str, age_days: float, metadata: Optional[Dict] = None) -> bool:
+        # plain dumps were stored uncompressed on purpose and are left alone
+        if age_days < self.min_age_days or not is_artifact(name):
+            return False
+        # blobs the codec could not shrink before are not downloaded again
+        if (metadata or {}).get('compression_checked') == self.codec:
+            return False
+        plain = name[:-len(ENCRYPTED_SUFFIX)] if name.endswith(ENCRYPTED_SUFFIX) else name
+        return codec_from_name(plain) != self.codec
+
+    def recode(self, source: Path, work_dir: Path) -> Path:
+        # decrypt and decompress, then encode again with the stronger codec;
+        # encrypted backups stay encrypted under the current key
+        encrypted = source.name.endswith(ENCRYPTED_SUFFIX)
+        raw = unpack_artifact(source, work_dir, self.keyring, remove_source=False)
+        keyring = self.keyring if encrypted else None
+        if encrypted and not self.keyring.enabled:
+            raise Exception(f"{source.name} is encrypted but encryption is not configured")
+        artifact, _ = prepare_artifact(raw, True, keyring, level=self.level, codec=self.codec)
+        raw.unlink()
+        return artifact
+
+    def _measure(self, func, *args):
+        cpu_start = time.process_time()
+        try:
+            return func(*args)
+        finally:
+            self.report['cpu_seconds'] += time.process_time() - cpu_start
+
+    def recompact_cloud(self, dry_run: bool = False, force: bool = False):
+        bucket = self.cloud_storage.bucket
+        now = datetime.now(timezone.utc)
+        for blob in list(bucket.list_blobs(prefix='backups/')):
+            if not is_backup_file(blob.name):
+                continue
+            age_days = (now - blob.time_created).total_seconds() / 86400
+            storage_class = blob.storage_class or 'STANDARD'
+            target_class = self.storage_class_for(age_days)
+            # blobs only ever move to colder classes
+            if not self._colder(target_class, storage_class):
+                target_class = storage_class
+            self.report['monthly_cost_before'] += self.monthly_cost(blob.size, storage_class)
+
+            if self.needs_recompaction(blob.name, age_days, blob.metadata):
+                if not force and not self.is_idle():
+                    self.report['skipped_busy'] += 1
+                    self.report['monthly_cost_after'] += self.monthly_cost(blob.size, storage_class)
+                    continue
+                new_size = self._recompact_blob(blob, target_class, dry_run)
+                if new_size is not None:
+                    self.report['monthly_cost_after'] += self.monthly_cost(new_size, target_class)
+                    continue
+                # kept as it is, but still tiered below
+
+            if target_class != storage_class:
+                print(f"Moving {blob.name} from {storage_class} to {target_class}")
+                if not dry_run:
+                    blob.update_storage_class(target_class)
+                    blob.metadata = {**(blob.metadata or {}),
+                                     'storage_class': target_class,
+                                     'tiered_at': datetime.now().isoformat()}
+                    blob.patch()
+                self.report['tiered'] += 1
+                storage_class = target_class
+            self.report['monthly_cost_after'] += self.monthly_cost(blob.size, storage_class)
+
+    def _colder(self, a: str, b: str) -> bool:
+        order = list(DEFAULT_PRICES)
+        return order.index(a) > order.index(b) if a in order and b in order else False
+
+    def _recompact_blob(self, blob, target_class: str, dry_run: bool) -> Optional[int]:
+        # the size of the replacement, or None when the blob is kept
+        new_name = str(Path(blob.name).parent / self.recoded_name(Path(blob.name).name))
+        print(f"Recompacting {blob.name} -> {new_name} ({target_class})")
+        if dry_run:
+            return blob.size
+
+        work_dir = Path(tempfile.mkdtemp(prefix="recompact_"))
+        try:
+            source = work_dir / Path(blob.name).name
+            blob.download_to_filename(str(source))
+            self.report['bytes_read'] += blob.size
+            artifact = self._measure(self.recode, source, work_dir)
+            new_size = artifact.stat().st_size
+
+            if new_size >= blob.size:
+                print(f"Keeping {blob.name}, {self.codec} did not make it smaller")
+                blob.metadata = {**(blob.metadata or {}), 'compression_checked': self.codec}
+                blob.patch()
+                self.report['kept'] += 1
+                return None
+
+            new_blob = blob.bucket.blob(new_name)
+            new_blob.storage_class = target_class
+            new_blob.metadata = {
+                **(blob.metadata or {}),
+                'compression': self.codec,
+                'size': str(new_size),
+                'previous_name': blob.name,
+                'previous_size': str(blob.size),
+                'recompacted_at': datetime.now().isoformat(),
+                'storage_class': target_class,
+            }
+            new_blob.upload_from_filename(str(artifact))
+            blob.delete()
+
+            self.report['bytes_written'] += new_size
+            self.report['bytes_saved'] += blob.size - new_size
+            self.report['recompacted'] += 1
+            self.logger.log_storage_operation("cloud", "recompact", new_name, True)
+            return new_size
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _checked_path(self) -> Path:
+        return self.local_storage.storage_dir / '.recompaction_state.json'
+
+    def _load_checked(self) -> Dict:
+        try:
+            with open(self._checked_path()) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_checked(self, checked: Dict):
+        path = self._checked_path()
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(checked, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def recompact_local(self, dry_run: bool = False, force: bool = False):
+        now = time.time()
+        # local files the codec could not shrink, the counterpart of the
+        # compression_checked metadata on blobs; an entry only counts while
+        # the file still has the size and mtime it was checked with
+        checked = self._load_checked()
+        still_checked = {}
+        for backup in self.local_storage.list_backups():
+            path = Path(backup['path'])
+            stat = path.stat()
+            entry = checked.get(path.name)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                still_checked[path.name] = entry
+            else:
+                entry = None
+            age_days = (now - stat.st_mtime) / 86400
+            # recent local copies stay as they are for fast restores
+            if age_days < max(self.local_hot_days, self.min_age_days):
+                continue
+            if not self.needs_recompaction(path.name, age_days, entry):
+                continue
+            if not force and not self.is_idle():
+                self.report['skipped_busy'] += 1
+                continue
+
+            new_path = path.with_name(self.recoded_name(path.name))
+            print(f"Recompacting local {path.name} -> {new_path.name}")
+            if dry_run:
+                continue
+
+            old_size = path.stat().st_size
+            work_dir = Path(tempfile.mkdtemp(prefix="recompact_", dir=str(path.parent)))
+            try:
+                self.report['bytes_read'] += old_size
+                artifact = self._measure(self.recode, path, work_dir)
+                new_size = artifact.stat().st_size
+                if new_size >= old_size:
+                    print(f"Keeping local {path.name}, {self.codec} did not make it smaller")
+                    still_checked[path.name] = {'compression_checked': self.codec,
+                                                'size': stat.st_size, 'mtime': stat.st_mtime}
+                    self.report['kept'] += 1
+                    continue
+                # keep the original mtime so age based retention still applies
+                shutil.copystat(path, artifact)
+                os.replace(artifact, new_path)
+                fsync_dir(new_path.parent)
+                path.unlink()
+                self.report['bytes_written'] += new_size
+                self.report['bytes_saved'] += old_size - new_size
+                self.report['recompacted'] += 1
+                self.logger.log_storage_operation("local", "recompact", str(new_path), True)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        # entries of deleted or replaced backups are dropped
+        if not dry_run and still_checked != checked:
+            self._save_checked(still_checked)
+
+    def run(self, dry_run: bool = False, force: bool = False, include_local: bool = True) -> Dict:
+        if self.cloud_storage:
+            self.recompact_cloud(dry_run, force)
+        if include_local and self.local_storage:
+            self.recompact_local(dry_run, force)
+
+        self.report['monthly_savings'] = self.report['monthly_cost_before'] - self.report['monthly_cost_after']
+        self.logger.log_database_action("recompaction", {
+            k: round(v, 4) if isinstance(v, float) else v for k, v in self.report.items()
+        })
+        return self.report
+
+
+def format_report(report: Dict) -> List[str]:
+    return [
+        f"Recompacted backups:   {report['recompacted']}",
+        f"Kept (no gain):        {report['kept']}",
+        f"Moved to colder tier:  {report['tiered']}",
+        f"Skipped (host busy):   {report['skipped_busy']}",
+        f"CPU time:              {report['cpu_seconds']:.1f}s",
+        f"Read / written:        {report['bytes_read'] / GB:.2f}GB / {report['bytes_written'] / GB:.2f}GB",
+        f"Space saved:           {report['bytes_saved'] / GB:.2f}GB",
+        f"Cloud cost per month:  ${report['monthly_cost_before']:.2f} -> ${report['monthly_cost_after']:.2f} "
+        f"(saves ${report.get('monthly_savings', 0):.2f})",
+    ]
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from google.api_core.exceptions import BadRequest
+from logger import DatabaseLogger
+from storage.cloud_storage import EXPORT_PREFIX
+
+GB = 1024 ** 3
+
+
+class Replicator:
+    # copies objects between buckets with the rewrite API, so the bytes move
+    # inside Cloud Storage and never through this host
+    def __init__(self, config: Dict, cloud_storage):
+        settings = config.get('cloud_storage', {}).get('replication', {})
+        self.cloud_storage = cloud_storage
+        self.targets = settings.get('targets', [])
+        self.prefixes = settings.get('prefixes', ['backups/', EXPORT_PREFIX])
+        self.concurrency = settings.get('concurrency', 4)
+        self.storage_class = settings.get('storage_class')
+        self.prune = settings.get('prune', False)
+        self.state_path = Path(settings.get(
+            'state_path', os.path.join(config['local_storage_dir'], '.replication_state.json')))
+        self.logger = DatabaseLogger()
+        self.lock = threading.Lock()
+        self.state = self._load()
+        self.report = {
+            'copied': 0,
+            'resumed': 0,
+            'up_to_date': 0,
+            'failed': 0,
+            'pruned': 0,
+            'bytes_copied': 0,
+            'errors': [],
+        }
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self):
+        # caller holds the lock
+        tmp = self.state_path.with_name(f".{self.state_path.name}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.state_path)
+
+    def _remember(self, key: str, entry: Optional[Dict]):
+        with self.lock:
+            if entry is None:
+                if self.state.pop(key, None) is None:
+                    return
+            else:
+                self.state[key] = entry
+            self._save()
+
+    def plan(self, target: str):
+        source = self.cloud_storage.bucket
+        destination = self.cloud_storage.named_bucket(target)
+        existing = {}
+        for prefix in self.prefixes:
+            existing.update({blob.name: blob for blob in destination.list_blobs(prefix=prefix)})
+
+        pending, names = [], set()
+        for prefix in self.prefixes:
+            for blob in source.list_blobs(prefix=prefix):
+                names.add(blob.name)
+                copy = existing.get(blob.name)
+                if copy and copy.size == blob.size and copy.crc32c == blob.crc32c:
+                    self.report['up_to_date'] += 1
+                    continue
+                pending.append(blob)
+        stale = [blob for name, blob in existing.items() if name not in names]
+        return destination, pending, stale
+
+    def copy(self, blob, destination_bucket, target: str) -> int:
+        key = f"{target}/{blob.name}"
+        destination = destination_bucket.blob(blob.name)
+        destination.metadata = {
+            **(blob.metadata or {}),
+            'replicated_from': f"gs://{blob.bucket.name}/{blob.name}",
+            'replicated_at': datetime.now().isoformat(),
+        }
+        if blob.content_type:
+            destination.content_type = blob.content_type
+        if self.storage_class:
+            destination.storage_class = self.storage_class
+
+        # large or cross-region copies take several calls; the token of the
+        # last one is kept so an interrupted run continues where it stopped
+        saved = self.state.get(key)
+        token = saved['token'] if saved and saved.get('generation') == blob.generation else None
+        if token:
+            print(f"Resuming copy of {blob.name} to {target} at {saved['bytes'] / GB:.2f}GB")
+            with self.lock:
+                self.report['resumed'] += 1
+        while True:
+            try:
+                token, rewritten, size = destination.rewrite(blob, token=token,
+                                                             if_source_generation_match=blob.generation)
+            except BadRequest:
+                if token is None:
+                    raise
+                # rewrite tokens expire, the object is copied again from the start
+                print(f"Copy of {blob.name} to {target} could not be resumed, starting over")
+                token = None
+                continue
+            if token is None:
+                break
+            self._remember(key, {'token': token, 'generation': blob.generation, 'bytes': rewritten,
+                                 'size': size})
+        self._remember(key, None)
+
+        if destination.size != blob.size or destination.crc32c != blob.crc32c or \
+                (blob.md5_hash and destination.md5_hash and destination.md5_hash != blob.md5_hash):
+            destination.delete()
+            raise Exception(f"Checksum mismatch after copying {blob.name} to {target}")
+        return blob.size
+
+    def replicate(self, target: str, dry_run: bool = False):
+        destination, pending, stale = self.plan(target)
+        print(f"Replicating to {target} ({destination.name}): {len(pending)} objects to copy, "
+              f"{sum(blob.size for blob in pending) / GB:.2f}GB")
+        if dry_run:
+            for blob in pending:
+                print(f"  would copy {blob.name}")
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {pool.submit(self.copy, blob, destination, target): blob for blob in pending}
+                for future in as_completed(futures):
+                    blob = futures[future]
+                    try:
+                        self.report['bytes_copied'] += future.result()
+                        self.report['copied'] += 1
+                        self.logger.log_storage_operation("cloud", f"replicate to {target}", blob.name, True)
+                    except Exception as e:
+                        self.report['failed'] += 1
+                        self.report['errors'].append(f"{target}/{blob.name}: {e}")
+                        self.logger.log_storage_operation("cloud", f"replicate to {target}", blob.name, False)
+                        print(f"Copy of {blob.name} to {target} failed: {e}")
+
+        if self.prune:
+            # objects removed from the primary bucket, e.g. by retention
+            for blob in stale:
+                print(f"{'Would remove' if dry_run else 'Removing'} {blob.name} from {target}")
+                if not dry_run:
+                    blob.delete()
+                self.report['pruned'] += 1
+
+    def run(self, targets: Optional[List[str]] = None, dry_run: bool = False) -> Dict:
+        targets = targets or self.targets
+        if not targets:
+            raise Exception("No replication targets, add cloud_storage.replication.targets to config.json")
+        for target in targets:
+            self.replicate(target, dry_run)
+        return self.report
+
+
+def format_replication(report: Dict) -> List[str]:
+    lines = [
+        f"Copied:      {report['copied']} ({report['bytes_copied'] / GB:.2f}GB, {report['resumed']} resumed)",
+        f"Up to date:  {report['up_to_date']}",
+        f"Pruned:      {report['pruned']}",
+        f"Failed:      {report['failed']}",
+    ]
+    lines.extend(f"  {error}" for error in report['errors'])
+    return lines
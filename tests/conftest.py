@@ -0,0 +1,86 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    # DatabaseLogger writes to logs/backup.log relative to the working
+    # directory, keep test runs out of the real log
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+# bytes a FakeBlob.rewrite call copies, like one step of a large
+# cross-region rewrite
+REWRITE_CHUNK = 100
+
+
+class FakeBlob:
+    # the parts of google.cloud.storage.Blob the storage code uses; a blob
+    # added with a path has that file as its content
+    def __init__(self, bucket, name: str, size: int = 0, crc32c: str = None, generation: int = 1, path=None):
+        self.bucket = bucket
+        self.name = name
+        self.path = path
+        self.size = path.stat().st_size if path else size
+        self.crc32c = crc32c
+        self.md5_hash = None
+        self.generation = generation
+        self.metadata = None
+        self.content_type = None
+        self.storage_class = None
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+        self.bucket.deleted.append(self.name)
+
+    def rewrite(self, source, token=None, if_source_generation_match=None):
+        bucket = self.bucket
+        bucket.calls.append(token)
+        if bucket.interrupt_after is not None and len(bucket.calls) > bucket.interrupt_after:
+            raise ConnectionError("connection reset")
+        if token is None:
+            offset = 0
+        elif token in bucket.tokens:
+            offset = bucket.tokens[token]
+        else:
+            # imported here so only the tests that rewrite need google-cloud-storage
+            from google.api_core.exceptions import BadRequest
+            raise BadRequest("Invalid rewrite token")
+        offset = min(offset + REWRITE_CHUNK, source.size)
+        if offset < source.size:
+            token = f"token-{len(bucket.calls)}"
+            bucket.tokens[token] = offset
+            return token, offset, source.size
+        self.size = source.size
+        self.crc32c = "corrupt" if source.name in bucket.corrupt else source.crc32c
+        bucket.objects[self.name] = self
+        return None, offset, source.size
+
+
+class FakeBucket:
+    def __init__(self, name: str):
+        self.name = name
+        self.objects = {}
+        self.calls = []
+        self.tokens = {}
+        self.deleted = []
+        self.corrupt = set()
+        self.interrupt_after = None
+
+    def add(self, name: str, size: int = 0, crc32c: str = None, generation: int = 1, path=None) -> FakeBlob:
+        self.objects[name] = FakeBlob(self, name, size, crc32c, generation, path)
+        return self.objects[name]
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str):
+        return self.objects.get(name)
+
+    def list_blobs(self, prefix: str = ''):
+        return [blob for name, blob in sorted(self.objects.items()) if name.startswith(prefix)]
+
+
+@pytest.fixture
+def make_bucket():
+    return FakeBucket
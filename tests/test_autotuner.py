@@ -0,0 +1,47 @@
+import time
+from backup.autotuner import Autotuner, MB
+
+CURRENT = {'jobs': 1, 'codec': 'gzip', 'level': 9, 'concurrency': 1}
+
+
+class FakeHistory:
+    def __init__(self, runs):
+        self._runs = runs
+
+    def runs(self, db_type, engine, limit=20):
+        return self._runs[-limit:]
+
+
+def pg_dump_runs(bytes_in=True):
+    now = time.time()
+    runs = []
+    for day in range(5):
+        dump = {'seconds': 4000, 'bytes': 3000 * MB}
+        if bytes_in:
+            dump['bytes_in'] = 10000 * MB
+        runs.append({'started_at': now - 86400 * (5 - day), 'params': dict(CURRENT),
+                     'stages': {'dump': dump, 'transfer': {'seconds': 100, 'bytes': 3000 * MB}}})
+    return runs
+
+
+def test_pg_dump_tunes_its_own_level():
+    tuner = Autotuner({'window_minutes': 240}, FakeHistory(pg_dump_runs()))
+    plan = tuner.plan('postgres', 'pg_dump', True, CURRENT)
+    assert plan.inline and plan.codec == 'gzip' and plan.level == 9
+    # compression happens inside the dump, there is no second pass
+    assert plan.stage_seconds['compress'] == 0
+    assert abs(plan.stage_seconds['dump'] - 4000) < 100
+
+
+def test_pg_dump_drops_level_to_fit_window():
+    tuner = Autotuner({'window_minutes': 60}, FakeHistory(pg_dump_runs()))
+    plan = tuner.plan('postgres', 'pg_dump', True, CURRENT)
+    assert plan.codec == 'gzip' and plan.level < 9
+    assert plan.fits
+    # reading from the server takes the same time at every level
+    assert plan.stage_seconds['dump'] > 400
+
+
+def test_pg_dump_ignores_runs_without_table_data_size():
+    tuner = Autotuner({}, FakeHistory(pg_dump_runs(bytes_in=False)))
+    assert tuner.plan('postgres', 'pg_dump', True, CURRENT) is None
@@ -0,0 +1,43 @@
+from export.columnar_export import copy_fields, parse_tables
+
+SCHEMA = '''\
+CREATE TABLE public.users (
+    id bigint NOT NULL,
+    email text COLLATE pg_catalog."default",
+    "Display Name" character varying(80) DEFAULT 'anonymous'::character varying,
+    balance numeric(12,2),
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    search tsvector GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, email)) STORED,
+    CONSTRAINT users_balance_check CHECK ((balance >= (0)::numeric))
+);
+
+CREATE UNLOGGED TABLE "Sales"."Order ""Lines""" (
+    order_id integer,
+    tags text[]
+);
+
+CREATE VIEW public.active AS
+ SELECT users.id
+   FROM public.users;
+'''
+
+
+def test_parse_tables_reads_columns_and_types():
+    tables = parse_tables(SCHEMA.splitlines(keepends=True))
+    assert tables == {
+        'public.users': [
+            ('id', 'bigint'),
+            ('email', 'text'),
+            ('Display Name', 'character varying(80)'),
+            ('balance', 'numeric(12,2)'),
+            ('created_at', 'timestamp with time zone'),
+        ],
+        'Sales.Order "Lines"': [('order_id', 'integer'), ('tags', 'text[]')],
+    }
+
+
+def test_copy_fields_handles_nulls_and_escapes():
+    assert copy_fields("1\t\\N\tplain\n") == ['1', None, 'plain']
+    assert copy_fields("a\\tb\tline\\nbreak\tback\\\\slash\n") == ['a\tb', 'line\nbreak', 'back\\slash']
+    # octal and hex escapes, and a literal "\N" inside a longer value
+    assert copy_fields("\\101\\x42\t\\\\N\t\n") == ['AB', '\\N', '']
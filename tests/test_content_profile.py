@@ -0,0 +1,130 @@
+import os
+from types import SimpleNamespace
+import pytest
+from backup.content_profile import (BYTEA_COLUMNS_QUERY, LARGE_OBJECTS_QUERY, ContentProfile, compressed_ratio,
+                                    profile_content)
+
+TEXT = b"".join(b'{"id": %d, "status": "shipped"}\n' % i for i in range(2000))
+PACKED = os.urandom(8192)
+GB = 1024 ** 3
+
+
+def test_compressed_ratio_tells_text_from_packed_bytes():
+    assert compressed_ratio(TEXT) < 0.2
+    assert compressed_ratio(PACKED) > 0.9
+    assert compressed_ratio(b"") == 1.0
+
+
+def test_incompressible_share_counts_large_objects_only_when_packed():
+    profile = ContentProfile(database_bytes=10 * GB, incompressible_bytes=3 * GB,
+                             large_objects=5, large_object_bytes=4 * GB, large_object_ratio=0.5)
+    assert profile.incompressible_share == pytest.approx(0.3)
+    profile.large_object_ratio = 0.95
+    assert profile.incompressible_share == pytest.approx(0.7)
+    profile.large_object_bytes = 20 * GB
+    assert profile.incompressible_share == 1.0
+    assert ContentProfile().incompressible_share == 0.0
+
+
+class FakeCursor:
+    # answers the profiling queries from a fixed picture of the database
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        text = query if isinstance(query, str) else repr(query)
+        if 'pg_database_size' in text:
+            self.result = [(10 * GB,)]
+        elif text == BYTEA_COLUMNS_QUERY:
+            self.result = [('public', 'documents', 'body', 6 * GB), ('public', 'documents', 'thumbnail', 6 * GB),
+                           ('public', 'events', 'payload', 2 * GB)]
+        elif 'TABLESAMPLE' in text:
+            column = 'payload' if "'payload'" in text else 'body' if "'body'" in text else 'thumbnail'
+            self.result = [({'body': PACKED, 'thumbnail': TEXT, 'payload': TEXT}[column],)]
+        elif text == LARGE_OBJECTS_QUERY:
+            if self.connection.large_objects_denied:
+                raise Exception("permission denied for large object")
+            self.result = [(3, GB)]
+        elif 'lo_get' in text:
+            self.result = [(PACKED,), (None,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, large_objects_denied: bool = False):
+        self.large_objects_denied = large_objects_denied
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+def test_profile_marks_tables_by_their_most_packed_column():
+    profile = profile_content(FakeConnection(), {})
+    assert list(profile.incompressible_tables) == ['public.documents']
+    assert profile.incompressible_bytes == 6 * GB
+    assert (profile.large_objects, profile.large_object_bytes) == (3, GB)
+    assert profile.large_object_ratio > 0.9
+    assert profile.incompressible_share == pytest.approx(0.7)
+
+
+def test_profile_without_large_object_access(capsys):
+    connection = FakeConnection(large_objects_denied=True)
+    profile = profile_content(connection, {})
+    assert connection.rolled_back and profile.large_object_ratio is None
+    assert "Could not sample large objects" in capsys.readouterr().out
+    # the bytea profile is kept
+    assert list(profile.incompressible_tables) == ['public.documents']
+    assert profile.incompressible_share == pytest.approx(0.6)
+
+
+@pytest.fixture
+def content_aware(monkeypatch):
+    # runs BackupManager.content_aware with the given content_aware settings
+    pytest.importorskip("pymongo")
+    from backup import backup_manager
+    monkeypatch.setattr(backup_manager, 'get_connection',
+                        lambda host=None, port=None: SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(backup_manager, 'profile_content', lambda connection, settings: ContentProfile(
+        database_bytes=10 * GB, incompressible_tables={'public.documents': 0.99}, incompressible_bytes=6 * GB))
+
+    def run(settings, engine, compress, backup_options, params):
+        manager = SimpleNamespace(config={'content_aware': settings})
+        return backup_manager.BackupManager.content_aware(manager, 'postgres', engine, compress,
+                                                          backup_options, params)
+    return run
+
+
+@pytest.mark.parametrize('share_threshold, level', [(0.5, 1), (0.8, 9)])
+def test_pg_dump_level_follows_the_incompressible_share(content_aware, share_threshold, level):
+    params = {'level': 9}
+    assert content_aware({'enabled': True, 'share_threshold': share_threshold}, 'pg_dump', True, {}, params)
+    assert params['level'] == level
+
+
+def test_parallel_copy_gets_per_table_levels(content_aware):
+    backup_options, params = {}, {'codec': 'gzip', 'level': 6}
+    content_aware({'enabled': True, 'incompressible_level': 2}, 'parallel_copy', True, backup_options, params)
+    assert backup_options == {'incompressible_tables': ['public.documents'], 'incompressible_level': 2}
+    # the engine compresses its own output, the artifact is not compressed again
+    assert (params['codec'], params['level']) == ('none', 0)
+
+
+def test_disabled_or_uncompressed_backups_are_not_profiled(content_aware):
+    assert content_aware({'enabled': True}, 'pg_dump', False, {}, {'level': 9}) is None
+    assert content_aware({}, 'pg_dump', True, {}, {'level': 9}) is None
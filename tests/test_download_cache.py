@@ -0,0 +1,106 @@
+import base64
+import json
+import os
+import shutil
+from pathlib import Path
+import pytest
+from backup.encryption import Keyring
+from backup.pipeline import prepare_artifact, unpack_artifact
+from storage.download_cache import DownloadCache
+
+PLAINTEXT = b"INSERT INTO secrets VALUES ('do not cache me');\n" * 2000
+
+
+class FakeCloud:
+    # the parts of CloudStorageManager the cache uses
+    def __init__(self, keyring: Keyring, bucket):
+        self.keyring = keyring
+        self.bucket = bucket
+        self.downloads = 0
+
+    def download_backup(self, cloud_path: str, local_dir: str, governor=None, unpack: bool = True) -> str:
+        self.downloads += 1
+        blob = self.bucket.objects[cloud_path]
+        Path(local_dir).mkdir(parents=True, exist_ok=True)
+        local_path = Path(local_dir) / Path(cloud_path).name
+        shutil.copyfile(blob.path, local_path)
+        return str(unpack_artifact(local_path, keyring=self.keyring)) if unpack else str(local_path)
+
+
+@pytest.fixture
+def cloud(keyring, make_bucket):
+    return FakeCloud(keyring, make_bucket("backups"))
+
+
+@pytest.fixture
+def keyring(monkeypatch):
+    monkeypatch.setenv("BACKUP_ENCRYPTION_KEY_TEST", base64.b64encode(os.urandom(32)).decode())
+    return Keyring({'enabled': True, 'key_id': 'test', 'chunk_size': 4096})
+
+
+def artifact(tmp_path: Path, name: str, keyring=None) -> Path:
+    dump = tmp_path / "source" / name
+    dump.parent.mkdir(exist_ok=True)
+    dump.write_bytes(PLAINTEXT)
+    path, _ = prepare_artifact(dump, True, keyring, level=6)
+    return path
+
+
+def cached_files(cache_dir: Path):
+    return [path for path in cache_dir.rglob("*") if path.is_file()]
+
+
+def test_encrypted_backups_are_cached_encrypted(tmp_path, keyring, cloud):
+    path = artifact(tmp_path, "supabase_backup_db_20240101000000.dump", keyring)
+    name = f"backups/20240101_000000_{path.name}"
+    cloud.bucket.add(name, crc32c="crc", path=path)
+    cache = DownloadCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+
+    for _ in range(2):
+        with cache.open(name, cloud) as local:
+            assert Path(local).read_bytes() == PLAINTEXT
+            assert not Path(local).is_relative_to(tmp_path / "cache")
+        # the decrypted copy is gone as soon as the restore is done
+        assert not Path(local).exists()
+
+    assert cloud.downloads == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    files = cached_files(tmp_path / "cache")
+    assert any(file.name.endswith(".dump.gz.enc") for file in files)
+    assert not any(b"do not cache me" in file.read_bytes() for file in files)
+
+
+def test_plain_backups_are_cached_unpacked(tmp_path, cloud):
+    path = artifact(tmp_path, "supabase_backup_db_20240101000000.dump")
+    name = f"backups/20240101_000000_{path.name}"
+    cloud.bucket.add(name, crc32c="crc", path=path)
+    cache = DownloadCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+
+    for _ in range(2):
+        with cache.open(name, cloud) as local:
+            assert Path(local).read_bytes() == PLAINTEXT
+            assert Path(local).is_relative_to(tmp_path / "cache")
+    assert cloud.downloads == 1
+
+
+def test_decrypted_entries_from_earlier_versions_are_removed(tmp_path, keyring, cloud):
+    path = artifact(tmp_path, "supabase_backup_db_20240101000000.dump", keyring)
+    name = f"backups/20240101_000000_{path.name}"
+    cloud.bucket.add(name, crc32c="crc", path=path)
+    cache = DownloadCache(str(tmp_path / "cache"), 10 * 1024 * 1024)
+    with cache.open(name, cloud):
+        pass
+
+    # rewrite the entry the way the cache used to store it
+    entry, = (tmp_path / "cache" / "entries").iterdir()
+    meta = json.loads((entry / "meta.json").read_text())
+    (entry / meta['file']).unlink()
+    meta['file'] = meta['file'].replace(".gz.enc", "")
+    (entry / meta['file']).write_bytes(PLAINTEXT)
+    (entry / "meta.json").write_text(json.dumps(meta))
+
+    with cache.open(name, cloud) as local:
+        assert Path(local).read_bytes() == PLAINTEXT
+    assert cloud.downloads == 2
+    assert not any(b"do not cache me" in file.read_bytes() for file in cached_files(tmp_path / "cache"))
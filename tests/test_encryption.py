@@ -0,0 +1,127 @@
+import base64
+import gzip
+import io
+import os
+import pytest
+from cryptography.exceptions import InvalidTag
+from backup.encryption import TAG_SIZE, DecryptingReader, EncryptingWriter, Keyring, read_header
+from backup.pipeline import prepare_artifact, unpack_artifact
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def keyring(monkeypatch):
+    monkeypatch.setenv("BACKUP_ENCRYPTION_KEY_TEST", base64.b64encode(os.urandom(32)).decode())
+    return Keyring({'enabled': True, 'key_id': 'test', 'chunk_size': CHUNK_SIZE, 'workers': 2})
+
+
+def encrypt(data: bytes, keyring: Keyring, pieces: int = 7) -> bytes:
+    out = io.BytesIO()
+    writer = EncryptingWriter(out, keyring)
+    step = max(1, len(data) // pieces)
+    for i in range(0, len(data), step):
+        writer.write(data[i:i + step])
+    writer.close()
+    return out.getvalue()
+
+
+def decrypt(data: bytes, keyring: Keyring, read_size: int = 333) -> bytes:
+    reader = DecryptingReader(io.BytesIO(data), keyring)
+    try:
+        return b''.join(iter(lambda: reader.read(read_size), b''))
+    finally:
+        reader.close()
+
+
+def body_offset(data: bytes) -> int:
+    return len(read_header(io.BytesIO(data))[0])
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE * 10 + 17, CHUNK_SIZE * 40])
+def test_round_trip(keyring, size):
+    data = os.urandom(size)
+    encrypted = encrypt(data, keyring)
+    chunks = max(1, -(-size // CHUNK_SIZE))
+    assert len(encrypted) == body_offset(encrypted) + size + chunks * TAG_SIZE
+    assert decrypt(encrypted, keyring) == data
+
+
+def test_flipped_byte_is_rejected(keyring):
+    encrypted = bytearray(encrypt(os.urandom(CHUNK_SIZE * 5), keyring))
+    encrypted[body_offset(encrypted) + CHUNK_SIZE * 2 + 100] ^= 0x01
+    with pytest.raises(InvalidTag):
+        decrypt(bytes(encrypted), keyring)
+
+
+def test_header_is_authenticated(keyring):
+    encrypted = bytearray(encrypt(os.urandom(CHUNK_SIZE * 2), keyring))
+    # the last byte of the header is part of the salt
+    encrypted[body_offset(encrypted) - 1] ^= 0x01
+    with pytest.raises(InvalidTag):
+        decrypt(bytes(encrypted), keyring)
+
+
+def test_truncated_final_chunk_is_rejected(keyring):
+    encrypted = encrypt(os.urandom(CHUNK_SIZE * 3 + 500), keyring)
+    with pytest.raises(InvalidTag):
+        decrypt(encrypted[:-10], keyring)
+
+
+def test_dropped_final_chunk_is_rejected(keyring):
+    # cutting on a chunk boundary leaves chunks that are valid on their own,
+    # but the new last one was not sealed as the final chunk
+    encrypted = encrypt(os.urandom(CHUNK_SIZE * 3 + 500), keyring)
+    with pytest.raises(InvalidTag):
+        decrypt(encrypted[:-(500 + TAG_SIZE)], keyring)
+
+
+def test_reordered_chunks_are_rejected(keyring):
+    encrypted = encrypt(os.urandom(CHUNK_SIZE * 4), keyring)
+    start, stored = body_offset(encrypted), CHUNK_SIZE + TAG_SIZE
+    first, second = encrypted[start:start + stored], encrypted[start + stored:start + 2 * stored]
+    swapped = encrypted[:start] + second + first + encrypted[start + 2 * stored:]
+    with pytest.raises(InvalidTag):
+        decrypt(swapped, keyring)
+
+
+def test_empty_body_is_rejected(keyring):
+    encrypted = encrypt(b'data', keyring)
+    with pytest.raises(ValueError, match="truncated"):
+        decrypt(encrypted[:body_offset(encrypted)], keyring)
+
+
+def test_wrong_key_is_rejected(keyring, monkeypatch):
+    encrypted = encrypt(os.urandom(CHUNK_SIZE * 2), keyring)
+    monkeypatch.setenv("BACKUP_ENCRYPTION_KEY_TEST", base64.b64encode(os.urandom(32)).decode())
+    with pytest.raises(InvalidTag):
+        decrypt(encrypted, keyring)
+
+
+def test_artifact_round_trip(keyring, tmp_path):
+    dump = tmp_path / "backup.dump"
+    data = b"COPY public.orders FROM stdin;\n" * 5000
+    dump.write_bytes(data)
+
+    artifact, metadata = prepare_artifact(dump, True, keyring, level=6)
+    assert artifact.name == "backup.dump.gz.enc"
+    assert metadata['key_id'] == 'test' and metadata['encryption'] == 'aes-256-gcm-chunked'
+    dump.unlink()
+
+    restored = unpack_artifact(artifact, tmp_path, keyring, remove_source=False)
+    assert restored.read_bytes() == data
+    assert gzip.decompress(decrypt(artifact.read_bytes(), keyring)) == data
+
+
+def test_tampered_artifact_leaves_no_output(keyring, tmp_path):
+    dump = tmp_path / "backup.dump"
+    dump.write_bytes(os.urandom(CHUNK_SIZE * 8))
+    artifact, _ = prepare_artifact(dump, False, keyring)
+    dump.unlink()
+    encrypted = bytearray(artifact.read_bytes())
+    encrypted[-1] ^= 0x01
+    artifact.write_bytes(bytes(encrypted))
+
+    with pytest.raises(InvalidTag):
+        unpack_artifact(artifact, tmp_path, keyring, remove_source=False)
+    assert not dump.exists()
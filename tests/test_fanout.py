@@ -0,0 +1,91 @@
+import os
+from types import SimpleNamespace
+import pytest
+from storage import fanout
+from storage.fanout import FanOut, LocalSink, Sink
+from storage.local_storage import LocalStorageManager
+
+
+class MemorySink(Sink):
+    def __init__(self, name: str, fail_at: int = None, required: bool = True):
+        super().__init__(name, required)
+        self.data = bytearray()
+        self.fail_at = fail_at
+        self.aborted = False
+
+    def write(self, chunk: bytes):
+        if self.fail_at is not None and len(self.data) >= self.fail_at:
+            raise IOError("disk full")
+        self.data += chunk
+
+    def finish(self) -> str:
+        return f"memory://{self.name}"
+
+    def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "artifact.dump.gz"
+    path.write_bytes(os.urandom(1024 * 1024 + 17))
+    return path
+
+
+def test_sinks_with_the_same_name_each_get_every_chunk(source):
+    sinks = [MemorySink("gcs"), MemorySink("gcs"), MemorySink("local")]
+    FanOut(sinks, queue_depth=2, chunk_size=4096).run(source)
+    expected = source.read_bytes()
+    for sink in sinks:
+        assert not sink.error
+        assert bytes(sink.data) == expected
+        assert sink.bytes_written == len(expected)
+        assert sink.location == f"memory://{sink.name}"
+
+
+def test_failing_sink_does_not_affect_the_others(source):
+    failing, healthy = MemorySink("offsite", fail_at=8192, required=False), MemorySink("local")
+    FanOut([failing, healthy], queue_depth=2, chunk_size=4096).run(source)
+    assert failing.error and failing.aborted and failing.location is None
+    assert not healthy.error and bytes(healthy.data) == source.read_bytes()
+
+
+def test_backup_sinks_rejects_duplicate_names(tmp_path):
+    pytest.importorskip("pymongo")
+    from backup.backup_manager import BackupManager
+    manager = SimpleNamespace(config={'destinations': [{'type': 'local'}, {'type': 'local', 'path': str(tmp_path)}]},
+                              local_storage=None, cloud_storage=None)
+    with pytest.raises(ValueError, match="Duplicate destination name: local"):
+        BackupManager.backup_sinks(manager, True, False, "backups/x.dump", {})
+
+
+@pytest.fixture
+def local_storage(tmp_path):
+    return LocalStorageManager(tmp_path / "local", fsync_policy='none')
+
+
+def test_local_sink_hardlinks_on_the_same_filesystem(source, local_storage):
+    sink = LocalSink("local", local_storage)
+    FanOut([sink]).run(source)
+    dest = local_storage.storage_dir / source.name
+    assert sink.method == 'hardlink' and sink.location == str(dest)
+    assert dest.stat().st_ino == source.stat().st_ino
+
+
+def test_local_sink_clones_across_filesystems(source, local_storage, monkeypatch):
+    monkeypatch.setattr(fanout, 'same_filesystem', lambda a, b: False)
+    sinks = [LocalSink("local", local_storage) for _ in range(2)]
+    FanOut(sinks[:1]).run(source)
+    dest = local_storage.storage_dir / source.name
+    assert sinks[0].method in ('reflink', 'copy')
+    assert dest.read_bytes() == source.read_bytes()
+    assert dest.stat().st_ino != source.stat().st_ino
+    assert not list(local_storage.storage_dir.glob(".*.partial"))
+
+    # the digest taken from the stream finds the identical copy
+    renamed = source.with_name("supabase_backup_copy_20240101120000.dump.gz")
+    source.rename(renamed)
+    dest.rename(local_storage.storage_dir / "supabase_backup_mydb_20240101000000.dump.gz")
+    FanOut(sinks[1:]).run(renamed)
+    copy = local_storage.storage_dir / renamed.name
+    assert copy.stat().st_nlink == 2
@@ -0,0 +1,142 @@
+import os
+import shutil
+import socket
+import subprocess
+import time
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+if not all(shutil.which(tool) for tool in ("mongod", "mongodump", "mongorestore")):
+    pytest.skip("mongod and the MongoDB Database Tools are not installed", allow_module_level=True)
+
+from backup.mongodb_backup import GZIP_MARKER, mongo_backup
+from restore.mongodb_restore import mongodb_restore
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def mongod(tmp_path_factory):
+    # a single-node replica set, --oplog needs one
+    data_dir = tmp_path_factory.mktemp("mongod")
+    port = free_port()
+    process = subprocess.Popen(["mongod", "--dbpath", str(data_dir), "--port", str(port),
+                                "--bind_ip", "127.0.0.1", "--replSet", "rs0"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    client = pymongo.MongoClient(f"mongodb://127.0.0.1:{port}/", directConnection=True,
+                                 serverSelectionTimeoutMS=30000)
+    try:
+        client.admin.command("ping")
+        client.admin.command("replSetInitiate", {"_id": "rs0", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+        deadline = time.monotonic() + 30
+        while not client.admin.command("hello").get("isWritablePrimary"):
+            if time.monotonic() > deadline:
+                raise Exception("mongod did not become primary")
+            time.sleep(0.2)
+        yield client, port
+    finally:
+        client.close()
+        process.terminate()
+        process.wait(30)
+
+
+@pytest.fixture
+def env(mongod, monkeypatch):
+    client, port = mongod
+    monkeypatch.setenv("MGDB_HOST", "127.0.0.1")
+    monkeypatch.setenv("MGDB_PORT", str(port))
+    monkeypatch.delenv("MGDB_USER", raising=False)
+    monkeypatch.delenv("MGDB_PASSWORD", raising=False)
+    for name in client.list_database_names():
+        if name not in ("admin", "local", "config"):
+            client.drop_database(name)
+    return client, monkeypatch
+
+
+def seed(client, name: str = "shop", count: int = 500):
+    client[name].orders.insert_many([{"_id": i, "status": "shipped" if i % 2 else "pending"} for i in range(count)])
+    client[name].customers.insert_many([{"_id": i, "name": f"customer {i}"} for i in range(50)])
+
+
+def test_archive_round_trip_into_another_database(env, tmp_path):
+    client, monkeypatch = env
+    monkeypatch.setenv("MGDB_NAME", "shop")
+    seed(client)
+
+    archive = mongo_backup(str(tmp_path), compress=False, parallel_collections=2)
+    try:
+        assert GZIP_MARKER not in os.path.basename(archive)
+        assert mongodb_restore(archive, target_db="shop_copy", insertion_workers=2, parallel_collections=2)
+    finally:
+        shutil.rmtree(os.path.dirname(archive), ignore_errors=True)
+
+    assert client.shop_copy.orders.count_documents({}) == 500
+    assert client.shop_copy.customers.count_documents({}) == 50
+    assert client.shop_copy.orders.find_one({"_id": 7})["status"] == "shipped"
+
+
+def test_gzip_archive_is_marked_and_restored(env, tmp_path):
+    client, monkeypatch = env
+    monkeypatch.setenv("MGDB_NAME", "shop")
+    seed(client)
+
+    archive = mongo_backup(str(tmp_path), compress=True)
+    try:
+        assert os.path.basename(archive).endswith(f"{GZIP_MARKER}.archive")
+        # collections are gzipped inside the archive, the archive itself is not gzip
+        with open(archive, 'rb') as f:
+            assert f.read(2) != b'\x1f\x8b'
+        client.shop.orders.delete_many({})
+        assert mongodb_restore(archive)
+    finally:
+        shutil.rmtree(os.path.dirname(archive), ignore_errors=True)
+
+    assert client.shop.orders.count_documents({}) == 500
+
+
+def test_oplog_dump_and_replay(env, tmp_path):
+    client, monkeypatch = env
+    monkeypatch.delenv("MGDB_NAME", raising=False)
+    seed(client)
+
+    with pytest.raises(Exception, match="MGDB_NAME is required"):
+        mongo_backup(str(tmp_path), oplog=False)
+
+    archive = mongo_backup(str(tmp_path), compress=True, oplog=True)
+    try:
+        assert "_all_" in os.path.basename(archive)
+        client.drop_database("shop")
+        assert mongodb_restore(archive, oplog_replay=True)
+    finally:
+        shutil.rmtree(os.path.dirname(archive), ignore_errors=True)
+
+    assert client.shop.orders.count_documents({}) == 500
+    assert client.shop.customers.count_documents({}) == 50
+
+
+def test_gzip_marker_controls_restore_flag(tmp_path, monkeypatch):
+    # mongorestore only decompresses with --gzip, which the file name decides
+    commands = []
+
+    class Result:
+        ok = True
+        warnings = []
+
+    class Runner:
+        def __init__(self, command, **kwargs):
+            commands.append(command)
+
+        def run(self):
+            return Result()
+
+    monkeypatch.setattr("restore.mongodb_restore.ProcessRunner", Runner)
+    for name in (f"mongodb_backup_shop_1{GZIP_MARKER}.archive", "mongodb_backup_shop_1.archive"):
+        path = tmp_path / name
+        path.write_bytes(b"")
+        assert mongodb_restore(str(path), oplog_replay=True)
+    assert "--gzip" in commands[0] and "--oplogReplay" in commands[0]
+    assert "--gzip" not in commands[1]
@@ -0,0 +1,55 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip("pymongo")
+from restore.multi_restore import ConnectionBudget, connections_needed, fit_to_budget, restore_targets
+
+
+def test_mongodb_cost_counts_insertion_workers_per_collection():
+    assert connections_needed('mongodb', 'backup.archive.gz', {}) == 16
+    assert connections_needed('mongodb', 'backup.archive.gz',
+                              {'parallel_collections': 3, 'insertion_workers': 2}) == 6
+
+
+@pytest.mark.parametrize('options, budget, expected', [
+    # the split that uses most of the budget, the more even one on a tie
+    ({}, 10, (3, 3)),
+    ({}, 8, (2, 4)),
+    ({'parallel_collections': 8, 'insertion_workers': 1}, 6, (6, 1)),
+    ({'parallel_collections': 1, 'insertion_workers': 12}, 5, (1, 5)),
+    ({}, 1, (1, 1)),
+])
+def test_mongodb_options_fit_the_budget(options, budget, expected):
+    fitted = fit_to_budget('mongodb', 'backup.archive.gz', options, budget)
+    assert (fitted['parallel_collections'], fitted['insertion_workers']) == expected
+    assert connections_needed('mongodb', 'backup.archive.gz', fitted) <= budget
+
+
+def test_options_within_budget_are_kept():
+    options = {'parallel_collections': 2, 'insertion_workers': 3, 'drop': True}
+    assert fit_to_budget('mongodb', 'backup.archive.gz', options, 6) == options
+
+
+def test_mongodb_targets_share_the_budget():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def restore_func(backup_file, target, governor=None, **options):
+        with lock:
+            running.append(target)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(target)
+        return options == {'parallel_collections': 2, 'insertion_workers': 2}
+
+    timings = {}
+    # 2x2 insertion workers twice fills a budget of 8
+    results = restore_targets('backup.archive.gz', ['a', 'b', 'c', 'd'], 'mongodb', restore_func,
+                              {'parallel_collections': 2, 'insertion_workers': 2}, None,
+                              ConnectionBudget(8), timings)
+    assert results == {'a': True, 'b': True, 'c': True, 'd': True}
+    assert max(peak) <= 2
+    assert set(timings) == {'a', 'b', 'c', 'd'}
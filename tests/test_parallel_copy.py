@@ -0,0 +1,149 @@
+import gzip
+import io
+import json
+import tarfile
+import pytest
+from backup import parallel_copy_backup
+from backup.parallel_copy_backup import ArchiveWriter, archive_members, dump_units, open_part
+from restore import parallel_copy_restore
+from restore.parallel_copy_restore import load_parts, restore_large_objects
+from restore.verify import verify_pcopy
+
+TABLES = {
+    'events': b"".join(b"%d\tshipped\n" % i for i in range(5000)),
+    'users': b"1\talice\n2\tbob\n",
+}
+OBJECTS = {101: bytes(range(256)) * 40, 102: b"small"}
+
+
+class FakeLargeObject:
+    def __init__(self, connection, oid: int):
+        self.connection = connection
+        self.oid = oid
+        self.data = OBJECTS.get(oid, b"")
+        self.offset = 0
+
+    def read(self, size: int) -> bytes:
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def write(self, chunk: bytes):
+        self.connection.objects[self.oid] = self.connection.objects.get(self.oid, b"") + chunk
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        pass
+
+    def copy_expert(self, query, stream):
+        name = next(name for name in TABLES if f"'{name}'" in repr(query))
+        if 'FROM STDIN' in repr(query):
+            self.connection.loaded[name] = stream.read()
+            return
+        data = TABLES[name]
+        for offset in range(0, len(data), 1000):
+            stream.write(data[offset:offset + 1000])
+
+
+class FakeConnection:
+    def __init__(self):
+        self.loaded = {}
+        self.objects = {}
+
+    def set_session(self, **kwargs):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def lobject(self, oid: int, mode: str):
+        return FakeLargeObject(self, oid)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def units():
+    tables = [{'schema': 'public', 'name': name, 'columns': ['id', 'value']} for name in TABLES]
+    return [{'table': table, 'range': None, 'part': 0} for table in tables] + [{'oids': list(OBJECTS), 'part': 0}]
+
+
+def dump(tmp_path, monkeypatch, level):
+    # small members, so every stream spans several of them
+    monkeypatch.setattr(parallel_copy_backup, 'BLOCK_SIZE', 4096)
+    monkeypatch.setattr(parallel_copy_backup, 'get_connection', lambda host=None, port=None: FakeConnection())
+    path = str(tmp_path / "backup.pcopy")
+    planned = units()
+    archive = ArchiveWriter(path)
+    dump_units(planned, "snapshot", archive, 2, level)
+    archive.close()
+    return path, planned
+
+
+@pytest.mark.parametrize('level, compression', [(6, 'gzip'), (None, 'none')])
+def test_streams_round_trip_through_archive_members(tmp_path, monkeypatch, level, compression):
+    path, planned = dump(tmp_path, monkeypatch, level)
+    members = archive_members(path)
+    assert len(planned[0]['members']) > 1
+    for unit in planned[:2]:
+        assert unit['bytes'] == sum(members[name].size for name in unit['members'])
+        with open_part(path, members, unit, compression) as data:
+            assert data.read() == TABLES[unit['table']['name']]
+
+    events = planned[0]['members'][0]
+    with tarfile.open(path) as archive:
+        raw = archive.extractfile(events).read(2)
+    assert (raw == b"\x1f\x8b") == (compression == 'gzip')
+
+
+def test_restore_reads_members_in_place(tmp_path, monkeypatch):
+    path, planned = dump(tmp_path, monkeypatch, 6)
+    members = archive_members(path)
+    manifest = {'compression': 'gzip', 'tables': {
+        f"public.{unit['table']['name']}": {**unit['table'], 'parts': [unit]} for unit in planned[:2]}}
+    connection = FakeConnection()
+    monkeypatch.setattr(parallel_copy_restore, 'get_connection', lambda db_name: connection)
+    load_parts(manifest, path, members, "target", 2, ['public'], {})
+    assert connection.loaded == TABLES
+
+    assert restore_large_objects(connection, [planned[2]], path, members) == 2
+    assert connection.objects == OBJECTS
+
+
+def test_version_2_archive_with_whole_members(tmp_path):
+    path = tmp_path / "old.pcopy"
+    part = tmp_path / "users.0.copy.gz"
+    part.write_bytes(gzip.compress(TABLES['users']))
+    with tarfile.open(path, 'w') as archive:
+        archive.add(part, arcname="data/public.users.0.copy.gz")
+    with open_part(str(path), archive_members(str(path)), {'file': "data/public.users.0.copy.gz"}) as data:
+        assert data.read() == TABLES['users']
+
+
+def test_verify_finds_missing_members(tmp_path, monkeypatch):
+    path, planned = dump(tmp_path, monkeypatch, 6)
+    manifest = {'tables': {'public.events': {'parts': [planned[0]]}},
+                'large_objects': [{'file': 'data/large_objects.0.gz', 'members': ['data/large_objects.0.gz.00009']}]}
+    with tarfile.open(path, 'a') as archive:
+        for name, data in (('schema.dump', b''), ('manifest.json', json.dumps(manifest).encode())):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    ok, message = verify_pcopy(tmp_path / "backup.pcopy")
+    assert not ok and 'large_objects.0.gz.00009' in message
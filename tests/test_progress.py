@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import pytest
+from backup import progress
+from backup.progress import ProgressTracker, parse_progress_line
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(progress, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def tracker(events=None) -> ProgressTracker:
+    return ProgressTracker('backup', [events.append] if events is not None else None, interval=5.0)
+
+
+def test_byte_rate_and_eta(clock):
+    events = []
+    progress_tracker = tracker(events)
+    progress_tracker.set_totals(bytes_total=1000)
+    clock.now = 110.0
+    progress_tracker.update_bytes(250)
+    # a monitor reading an older position never moves progress back
+    progress_tracker.update_bytes(200)
+    event = progress_tracker.event('progress')
+    assert event.bytes_done == 250 and event.percent == 25.0
+    assert event.throughput == 25.0
+    assert event.eta_seconds == 30.0
+    # one forced start event, then one update per interval
+    assert [e.phase for e in events] == ['start', 'progress']
+
+
+def test_item_eta_without_byte_totals(clock):
+    progress_tracker = tracker()
+    progress_tracker.set_totals(items_total=4)
+    clock.now = 110.0
+    progress_tracker.complete_item('public.users')
+    event = progress_tracker.event('progress')
+    assert event.throughput == 0.0 and event.percent == 25.0
+    assert event.eta_seconds == 30.0
+
+
+def test_items_add_their_size_once(clock):
+    progress_tracker = tracker()
+    progress_tracker.set_totals(bytes_total=300, items_total=2,
+                                item_sizes={'public.users': 100, 'public.orders': 200})
+    progress_tracker.start_item('public.users')
+    clock.now = 104.0
+    # the next table starting means the previous one is done
+    progress_tracker.start_item('public.orders')
+    progress_tracker.complete_item('public.users')
+    assert progress_tracker.bytes_done == 100 and progress_tracker.items_done == 1
+    assert progress_tracker.item_seconds == {'public.users': 4.0}
+
+    progress_tracker.complete_item('public.orders', seconds=2.5)
+    assert progress_tracker.bytes_done == 300 and progress_tracker.current_item is None
+    assert progress_tracker.item_seconds['public.orders'] == 2.5
+
+
+def test_measured_bytes_replace_size_estimates(clock):
+    progress_tracker = tracker()
+    progress_tracker.set_totals(bytes_total=300, item_sizes={'public.users': 100})
+    progress_tracker.byte_source = '/backups/db.dump'
+    progress_tracker.update_bytes(40)
+    progress_tracker.complete_item('public.users')
+    assert progress_tracker.bytes_done == 40
+    progress_tracker.finish()
+    assert progress_tracker.bytes_done == 300
+
+
+@pytest.mark.parametrize('line, current', [
+    ('pg_dump: dumping contents of table "public.users"', 'public.users'),
+    ('pg_restore: processing data for table "public.orders"', 'public.orders'),
+    ('2024-01-01T00:00:00.000+0000\twriting app.events to archive on stdout', 'app.events'),
+])
+def test_tool_output_starts_items(clock, line, current):
+    progress_tracker = tracker()
+    parse_progress_line(line, progress_tracker)
+    assert progress_tracker.current_item == current
+
+
+def test_tool_output_completes_items(clock):
+    progress_tracker = tracker()
+    parse_progress_line('writing app.events to archive on stdout', progress_tracker)
+    parse_progress_line('done dumping app.events (42 documents)', progress_tracker)
+    parse_progress_line('finished restoring app.users (42 documents, 0 failures)', progress_tracker)
+    assert progress_tracker.completed == {'app.events', 'app.users'} and progress_tracker.current_item is None
@@ -0,0 +1,63 @@
+import os
+import time
+import pytest
+from backup.pipeline import prepare_artifact
+from storage.local_storage import LocalStorageManager
+from storage.recompaction import Recompactor
+
+OLD = time.time() - 30 * 86400
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorageManager(tmp_path / "local", fsync_policy='none', dedupe=False)
+
+
+def old_backup(storage, name: str, data: bytes):
+    dump = storage.storage_dir / name
+    dump.write_bytes(data)
+    artifact, _ = prepare_artifact(dump, True, level=1, codec='gzip')
+    os.utime(artifact, (OLD, OLD))
+    return artifact
+
+
+def recompactor(storage, calls):
+    recompactor = Recompactor({'recompaction': {'codec': 'xz', 'level': 6}}, local_storage=storage)
+    recode = recompactor.recode
+
+    def counted(source, work_dir):
+        calls.append(source.name)
+        return recode(source, work_dir)
+
+    recompactor.recode = counted
+    return recompactor
+
+
+def test_local_backup_without_gain_is_not_recoded_again(storage):
+    # xz has a larger header than gzip, a tiny dump never shrinks
+    kept = old_backup(storage, "supabase_backup_mydb_20240101120000.dump", b"x" * 10)
+    calls = []
+    report = recompactor(storage, calls).run(force=True)
+    assert report['kept'] == 1 and report['recompacted'] == 0
+    assert kept.exists()
+
+    report = recompactor(storage, calls).run(force=True)
+    assert calls == [kept.name]
+    assert report['kept'] == 0 and report['bytes_read'] == 0
+
+    # a changed file is checked again
+    kept.write_bytes(kept.read_bytes())
+    os.utime(kept, (OLD + 60, OLD + 60))
+    recompactor(storage, calls).run(force=True)
+    assert calls == [kept.name, kept.name]
+
+
+def test_local_backup_is_replaced_when_smaller(storage):
+    text = b"".join(b"INSERT INTO events VALUES (%d, 'shipped');\n" % i for i in range(50000))
+    artifact = old_backup(storage, "supabase_backup_mydb_20240102120000.dump", text)
+    calls = []
+    report = recompactor(storage, calls).run(force=True)
+    assert report['recompacted'] == 1 and report['bytes_saved'] > 0
+    assert not artifact.exists()
+    recoded = storage.storage_dir / "supabase_backup_mydb_20240102120000.dump.xz"
+    assert recoded.stat().st_mtime == pytest.approx(OLD)
@@ -0,0 +1,29 @@
+import math
+import pytest
+from backup.regression import MAD_SCALE, robust_scores, rolling_baseline
+
+np = pytest.importorskip("numpy")
+
+# five runs of two metrics, the last one an outlier in the first; the
+# second metric was not recorded for one run
+HISTORY = [[10.0, 5.0], [12.0, math.nan], [11.0, 5.0], [13.0, 5.0], [100.0, 5.0]]
+
+
+def test_rolling_baseline_uses_only_earlier_runs():
+    median, mad, counts = rolling_baseline(np.array(HISTORY), 3)
+    assert np.isnan(median[0]).all() and counts[0].tolist() == [0, 0]
+    assert median[:, 0].tolist()[1:] == [10.0, 11.0, 11.0, 12.0]
+    assert mad[:, 0].tolist()[1:] == [0.0, 1.0, 1.0, 1.0]
+    # missing values are left out of the window instead of poisoning it
+    assert counts[:, 1].tolist() == [0, 1, 1, 2, 2]
+    assert median[4, 1] == 5.0 and mad[4, 1] == 0.0
+
+
+def test_robust_scores_need_enough_history():
+    score, change, median = robust_scores(np.array(HISTORY), 3, min_runs=3)
+    assert np.isnan(score[:3, 0]).all()
+    assert score[3, 0] == pytest.approx(2 / MAD_SCALE)
+    assert score[4, 0] == pytest.approx(88 / MAD_SCALE)
+    assert change[4, 0] == pytest.approx(100 / 12 - 1)
+    # two runs of history is not a baseline yet
+    assert np.isnan(score[4, 1])
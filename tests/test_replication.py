@@ -0,0 +1,116 @@
+import json
+import pytest
+from storage.replication import Replicator
+
+
+class FakeCloud:
+    # the parts of CloudStorageManager the replicator uses
+    def __init__(self, make_bucket):
+        self.bucket = make_bucket("primary")
+        self.buckets = {'offsite': make_bucket("offsite-bucket")}
+
+    def named_bucket(self, name: str):
+        return self.buckets[name]
+
+
+@pytest.fixture
+def cloud(make_bucket):
+    return FakeCloud(make_bucket)
+
+
+def replicator(tmp_path, cloud) -> Replicator:
+    return Replicator({'local_storage_dir': str(tmp_path),
+                       'cloud_storage': {'replication': {'targets': ['offsite']}}}, cloud)
+
+
+def saved_state(tmp_path):
+    path = tmp_path / '.replication_state.json'
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def test_plan_skips_up_to_date_copies(tmp_path, cloud):
+    source, offsite = cloud.bucket, cloud.buckets['offsite']
+    source.add('backups/same.dump', 500, 'aaa')
+    source.add('backups/changed.dump', 500, 'bbb')
+    source.add('backups/new.dump', 500, 'ccc')
+    offsite.add('backups/same.dump', 500, 'aaa')
+    offsite.add('backups/changed.dump', 500, 'old')
+    offsite.add('backups/removed.dump', 500, 'ddd')
+
+    rep = replicator(tmp_path, cloud)
+    destination, pending, stale = rep.plan('offsite')
+    assert destination is offsite
+    assert sorted(blob.name for blob in pending) == ['backups/changed.dump', 'backups/new.dump']
+    assert [blob.name for blob in stale] == ['backups/removed.dump']
+    assert rep.report['up_to_date'] == 1
+
+
+def test_interrupted_copy_resumes_from_saved_token(tmp_path, cloud):
+    blob = cloud.bucket.add('backups/big.dump', 450, 'aaa', generation=7)
+    offsite = cloud.buckets['offsite']
+    offsite.interrupt_after = 2
+    with pytest.raises(ConnectionError):
+        replicator(tmp_path, cloud).copy(blob, offsite, 'offsite')
+    state = saved_state(tmp_path)['offsite/backups/big.dump']
+    assert state['generation'] == 7 and state['bytes'] == 200
+
+    offsite.interrupt_after = None
+    offsite.calls.clear()
+    rep = replicator(tmp_path, cloud)
+    assert rep.copy(blob, offsite, 'offsite') == 450
+    # continued at 200 bytes instead of starting over
+    assert offsite.calls[0] == state['token'] and len(offsite.calls) == 3
+    assert rep.report['resumed'] == 1
+    assert offsite.objects['backups/big.dump'].crc32c == 'aaa'
+    assert saved_state(tmp_path) == {}
+
+
+def test_expired_token_restarts_copy(tmp_path, cloud):
+    blob = cloud.bucket.add('backups/big.dump', 250, 'aaa', generation=7)
+    offsite = cloud.buckets['offsite']
+    (tmp_path / '.replication_state.json').write_text(json.dumps(
+        {'offsite/backups/big.dump': {'token': 'expired', 'generation': 7, 'bytes': 200, 'size': 250}}))
+
+    assert replicator(tmp_path, cloud).copy(blob, offsite, 'offsite') == 250
+    assert offsite.calls == ['expired', None, 'token-2', 'token-3']
+    assert 'backups/big.dump' in offsite.objects
+    assert saved_state(tmp_path) == {}
+
+
+def test_token_for_older_generation_is_not_used(tmp_path, cloud):
+    blob = cloud.bucket.add('backups/big.dump', 150, 'aaa', generation=8)
+    offsite = cloud.buckets['offsite']
+    offsite.tokens['stale'] = 100
+    (tmp_path / '.replication_state.json').write_text(json.dumps(
+        {'offsite/backups/big.dump': {'token': 'stale', 'generation': 7, 'bytes': 100, 'size': 150}}))
+
+    rep = replicator(tmp_path, cloud)
+    rep.copy(blob, offsite, 'offsite')
+    assert offsite.calls[0] is None
+    assert rep.report['resumed'] == 0
+
+
+def test_checksum_mismatch_deletes_copy(tmp_path, cloud):
+    blob = cloud.bucket.add('backups/bad.dump', 150, 'aaa')
+    offsite = cloud.buckets['offsite']
+    offsite.corrupt.add('backups/bad.dump')
+
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        replicator(tmp_path, cloud).copy(blob, offsite, 'offsite')
+    assert offsite.deleted == ['backups/bad.dump']
+    assert 'backups/bad.dump' not in offsite.objects
+
+
+def test_replicate_reports_each_object(tmp_path, cloud):
+    source, offsite = cloud.bucket, cloud.buckets['offsite']
+    source.add('backups/a.dump', 120, 'aaa')
+    source.add('backups/bad.dump', 80, 'bbb')
+    source.add('backups/same.dump', 50, 'ccc')
+    offsite.add('backups/same.dump', 50, 'ccc')
+    offsite.corrupt.add('backups/bad.dump')
+
+    report = replicator(tmp_path, cloud).run()
+    assert report['copied'] == 1 and report['bytes_copied'] == 120
+    assert report['failed'] == 1 and report['errors'][0].startswith('offsite/backups/bad.dump')
+    assert report['up_to_date'] == 1
+    assert sorted(offsite.objects) == ['backups/a.dump', 'backups/same.dump']
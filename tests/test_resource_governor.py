@@ -0,0 +1,90 @@
+import os
+import shutil
+import pytest
+from backup import resource_governor
+from backup.resource_governor import PostgresLatencyProbe, ProbeUnavailable, ResourceGovernor
+
+
+@pytest.mark.skipif(not shutil.which('nice'), reason="nice is not installed")
+def test_nice_is_applied_without_preexec():
+    governor = ResourceGovernor({'nice': 5})
+    assert governor.wrap_command(['pg_dump'])[:3] == ['nice', '-n', '5']
+    # nice with no arguments prints the niceness it runs at
+    result = governor.run(['nice'], capture_output=True)
+    assert int(result.stdout) == min(19, os.nice(0) + 5)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query):
+        self.connection.queries.append(query)
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.autocommit = False
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    from connectors import postgres_connector
+    made = []
+
+    def get_connection(host=None, port=None):
+        made.append(FakeConnection())
+        return made[-1]
+
+    monkeypatch.setattr(postgres_connector, 'get_connection', get_connection)
+    return made
+
+
+def test_probe_connection_is_closed_when_governor_stops(connections):
+    probe = PostgresLatencyProbe("SELECT 1")
+    governor = ResourceGovernor({'adaptive': {'latency_ms': 50}}, probe)
+    with governor:
+        governor._adjust()
+        governor._adjust()
+    assert len(connections) == 1
+    assert connections[0].queries == ["SELECT 1", "SELECT 1"]
+    assert connections[0].closed
+
+
+def test_unreachable_database_turns_off_latency_mode(monkeypatch):
+    from connectors import postgres_connector
+    attempts = []
+    monkeypatch.setattr(postgres_connector, 'get_connection', lambda host=None, port=None: attempts.append(host))
+    governor = ResourceGovernor({'adaptive': {'latency_ms': 50}}, PostgresLatencyProbe(host="replica-1"))
+    governor.factor = 0.5
+    with pytest.raises(ProbeUnavailable):
+        PostgresLatencyProbe()()
+
+    governor._adjust()
+    # the monitor loop only probes while there is a probe
+    assert governor.probe is None and governor.factor == 1.0
+    assert attempts == [None, "replica-1"]
+
+
+def test_probe_factory_builds_closable_probe():
+    governor = ResourceGovernor.from_config(
+        {'resource_limits': {'postgres': {'adaptive': {'probe_query': 'SELECT now()'}}}}, 'postgres', 'db', '6432')
+    assert isinstance(governor.probe, resource_governor.PostgresLatencyProbe)
+    assert (governor.probe.query, governor.probe.host, governor.probe.port) == ('SELECT now()', 'db', '6432')
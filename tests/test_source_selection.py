@@ -0,0 +1,69 @@
+import pytest
+from backup import source_selection
+from backup.source_selection import Source, parse_candidate, select_source
+
+# what each replica reports: (role, lag, active sessions, latency) or an error
+STATUS = {
+    'replica-1': ('replica', 2.0, 3, 4.0),
+    'replica-2': ('replica', 0.0, 1, 9.0),
+    'replica-3': ('replica', 0.0, 1, 2.0),
+    'lagging': ('replica', 900.0, 0, 1.0),
+    'busy': ('replica', 0.0, 40, 1.0),
+    'promoted': ('primary', None, 0, 1.0),
+    'down': "connection failed",
+}
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    monkeypatch.setenv("SUPABASE_HOST", "primary.internal")
+    monkeypatch.setenv("SUPABASE_PORT", "6543")
+    probed = []
+
+    def probe_source(source: Source, timeout: int) -> Source:
+        probed.append((source.address, timeout))
+        status = STATUS[source.host]
+        if isinstance(status, str):
+            source.error = status
+        else:
+            source.role, source.lag_seconds, source.active, source.latency_ms = status
+        return source
+
+    monkeypatch.setattr(source_selection, 'probe_source', probe_source)
+    return probed
+
+
+def test_candidates_default_to_the_primary_port():
+    assert parse_candidate("replica-1", "6543").address == "replica-1:6543"
+    assert parse_candidate("replica-1:5433", "6543").address == "replica-1:5433"
+    assert parse_candidate({'host': "replica-1", 'port': 5433}, "6543").address == "replica-1:5433"
+
+
+def test_without_replicas_the_primary_is_used(probes):
+    source = select_source({})
+    assert (source.address, source.role) == ("primary.internal:6543", 'primary')
+    assert probes == []
+
+
+def test_least_busy_then_fastest_replica_wins(probes):
+    source = select_source({'replicas': ['replica-1', 'replica-2', 'replica-3'], 'connect_timeout': 2})
+    assert source.address == "replica-3:6543"
+    assert sorted(probes) == [("replica-1:6543", 2), ("replica-2:6543", 2), ("replica-3:6543", 2)]
+    assert source.metadata() == {'source_host': "replica-3:6543", 'source_role': 'replica',
+                                 'source_lag_seconds': "0.0"}
+
+
+def test_ineligible_replicas_are_skipped(probes, capsys):
+    source = select_source({'replicas': ['down', 'promoted', 'lagging', 'busy', 'replica-1'], 'max_active': 10})
+    assert source.address == "replica-1:6543"
+    output = capsys.readouterr().out
+    assert "down:6543: connection failed" in output
+    assert "promoted:6543: not in recovery" in output
+    assert "lagging:6543: lag 900.0s over 300s" in output
+    assert "busy:6543: 40 active sessions over 10" in output
+
+
+def test_falls_back_to_the_primary_when_no_replica_qualifies(probes, capsys):
+    source = select_source({'replicas': ['down', 'lagging'], 'max_lag_seconds': 800})
+    assert source.address == "primary.internal:6543" and source.role == 'primary'
+    assert "No replica is usable" in capsys.readouterr().out
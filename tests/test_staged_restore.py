@@ -0,0 +1,172 @@
+import pytest
+from backup.process_runner import ProcessResult, ToolMessage
+from restore import staged_restore as staged
+from restore.staged_restore import clean_statements, report_restore, restore_failed, staged_restore
+
+SCHEMA_NOISE = ToolMessage('error', 'could not execute query: ERROR:  schema "auth" already exists',
+                           ['Command was: CREATE SCHEMA auth;'])
+TRIGGER_NOISE = ToolMessage('error', 'could not execute query: ERROR:  permission denied: '
+                            '"RI_ConstraintTrigger_a_1" is a system trigger',
+                            ['Command was: ALTER TABLE public.orders DISABLE TRIGGER ALL;'])
+COPY_FAILED = ToolMessage('error', 'COPY failed for table "orders": ERROR:  invalid input syntax for type integer')
+
+
+def pg_restore_result(returncode: int, messages, ignored=None, **kwargs) -> ProcessResult:
+    tail = [f"pg_restore: {message}" for message in messages]
+    if ignored is not None:
+        tail.append(f"pg_restore: warning: errors ignored on restore: {ignored}")
+    return ProcessResult('pg_restore', returncode, tail, list(messages), {}, 1.0, **kwargs)
+
+
+def test_clean_exit_and_stopped_restores():
+    assert not restore_failed(pg_restore_result(0, []))
+    # stopped before the end of the archive: no summary line
+    assert restore_failed(pg_restore_result(1, [SCHEMA_NOISE]))
+    assert restore_failed(pg_restore_result(1, [], ignored=0, timed_out=True))
+    assert restore_failed(pg_restore_result(-9, [], ignored=0))
+
+
+def test_ignored_schema_errors_are_warnings():
+    result = pg_restore_result(1, [SCHEMA_NOISE, SCHEMA_NOISE], ignored=2)
+    for section in (None, 'pre-data', 'post-data'):
+        assert not restore_failed(result, section)
+    report_restore(result, 'pre-data')
+
+
+def test_failed_copy_is_a_failure_in_any_section():
+    result = pg_restore_result(1, [SCHEMA_NOISE, COPY_FAILED], ignored=2)
+    assert restore_failed(result)
+    assert restore_failed(result, 'data')
+    with pytest.raises(Exception, match="pg_restore failed during restore"):
+        report_restore(result)
+
+
+def test_data_stage_only_tolerates_trigger_toggles():
+    assert not restore_failed(pg_restore_result(1, [TRIGGER_NOISE, TRIGGER_NOISE], ignored=2), 'data')
+    # an error that was not printed in full still counts
+    assert restore_failed(pg_restore_result(1, [TRIGGER_NOISE], ignored=2), 'data')
+    with pytest.raises(Exception, match="failed during data stage"):
+        report_restore(pg_restore_result(1, [SCHEMA_NOISE], ignored=1), 'data')
+
+
+def test_max_ignored_errors_threshold():
+    result = pg_restore_result(1, [SCHEMA_NOISE] * 3, ignored=3)
+    assert not restore_failed(result, 'pre-data', max_ignored_errors=3)
+    assert restore_failed(result, 'pre-data', max_ignored_errors=2)
+    assert restore_failed(result, max_ignored_errors=0)
+
+
+SCHEMA_SQL = b"""\
+--
+-- PostgreSQL database dump
+--
+ALTER TABLE IF EXISTS ONLY public.orders DROP CONSTRAINT IF EXISTS orders_user_id_fkey;
+DROP INDEX IF EXISTS public.orders_created_idx;
+ALTER TABLE IF EXISTS ONLY public.users DROP CONSTRAINT IF EXISTS users_pkey;
+ALTER TABLE public.users ALTER COLUMN id DROP DEFAULT;
+DROP TABLE IF EXISTS public.users;
+DROP EXTENSION IF EXISTS pgcrypto;
+DROP SCHEMA IF EXISTS extensions;
+CREATE SCHEMA extensions;
+DROP TABLE IF EXISTS public.never_reached;
+"""
+
+
+class FakeRunner:
+    # replays pg_restore output through the runner's line callback
+    def __init__(self, command, env, *args, **kwargs):
+        self.command = command
+
+    def run(self, stdout_handler=None):
+        stdout_handler(iter(SCHEMA_SQL.splitlines(keepends=True)))
+        return pg_restore_result(-13, [])
+
+
+def test_clean_statements_stop_at_the_first_create(monkeypatch):
+    monkeypatch.setattr(staged, 'ProcessRunner', FakeRunner)
+    statements = clean_statements("backup.dump", ["--schema=public"], {})
+    # schemas and extensions stay, other DROPs and dropped constraints run in order
+    assert statements == [
+        "ALTER TABLE IF EXISTS ONLY public.orders DROP CONSTRAINT IF EXISTS orders_user_id_fkey;",
+        "DROP INDEX IF EXISTS public.orders_created_idx;",
+        "ALTER TABLE IF EXISTS ONLY public.users DROP CONSTRAINT IF EXISTS users_pkey;",
+        "DROP TABLE IF EXISTS public.users;",
+    ]
+
+
+def test_clean_statements_fail_when_pg_restore_cannot_read_the_archive(monkeypatch):
+    class BrokenRunner(FakeRunner):
+        def run(self, stdout_handler=None):
+            stdout_handler(iter([]))
+            return pg_restore_result(1, [ToolMessage('error', 'input file does not appear to be a valid archive')])
+
+    monkeypatch.setattr(staged, 'ProcessRunner', BrokenRunner)
+    with pytest.raises(Exception, match="Could not read the schema"):
+        clean_statements("backup.dump", [], {})
+
+
+class FakeCursor:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, statement):
+        self.calls.append(('execute', statement))
+
+
+class FakeConnection:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def cursor(self):
+        return FakeCursor(self.calls)
+
+    def commit(self):
+        self.calls.append(('commit',))
+
+
+def test_sections_run_in_order_after_cleaning(monkeypatch):
+    calls = []
+
+    def run_pg_restore(command, env, backup_file, governor=None, progress=None, timeout=None):
+        calls.append(('pg_restore', command, env.get("PGOPTIONS"), progress))
+        return pg_restore_result(0, [])
+
+    monkeypatch.setattr(staged, 'clean_statements', lambda backup_file, filters, env: ["DROP TABLE public.users;"])
+    monkeypatch.setattr(staged, 'run_pg_restore', run_pg_restore)
+    progress = object()
+    timings = staged_restore("backup.dump", FakeConnection(calls), "--dbname=target", ["--no-owner"],
+                             {"PGOPTIONS": "-c statement_timeout=0"}, data_jobs=6, index_jobs=4,
+                             maintenance_work_mem='2GB', progress=progress)
+
+    assert list(timings) == ['clean', 'pre-data', 'data', 'post-data']
+    assert calls[:2] == [('execute', "DROP TABLE public.users;"), ('commit',)]
+    pre, data, post = calls[2:]
+    assert pre[1] == ["pg_restore", "--section=pre-data", "--no-owner", "--dbname=target", "backup.dump"]
+    assert data[1][:4] == ["pg_restore", "--section=data", "--jobs=6", "--disable-triggers"]
+    assert post[1][:3] == ["pg_restore", "--section=post-data", "--jobs=4"]
+    # session settings are added to the caller's PGOPTIONS for the heavy stages
+    assert pre[2] == "-c statement_timeout=0"
+    assert data[2] == "-c statement_timeout=0 -c synchronous_commit=off -c maintenance_work_mem=2GB"
+    assert post[2] == "-c statement_timeout=0 -c maintenance_work_mem=2GB -c max_parallel_maintenance_workers=2"
+    # only the data stage reports progress
+    assert [call[3] for call in (pre, data, post)] == [None, progress, None]
+
+
+def test_failed_stage_stops_the_restore(monkeypatch):
+    sections = []
+
+    def run_pg_restore(command, *args, **kwargs):
+        sections.append(command[1])
+        return pg_restore_result(1, [COPY_FAILED], ignored=1)
+
+    monkeypatch.setattr(staged, 'clean_statements', lambda backup_file, filters, env: [])
+    monkeypatch.setattr(staged, 'run_pg_restore', run_pg_restore)
+    with pytest.raises(Exception, match="failed during pre-data stage"):
+        staged_restore("backup.dump", FakeConnection([]), "--dbname=target", [], {})
+    assert sections == ["--section=pre-data"]
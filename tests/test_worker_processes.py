@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from jobs import worker as worker_module
+from jobs.queue import JobQueue
+from jobs.worker import Worker
+
+# worker processes inherit the patched job runner, which needs fork
+fork = multiprocessing.get_context('fork')
+
+
+def record_job(config, kind, payload, results):
+    # stands in for execute_job: logs when the job ran, in which process
+    with open(payload['log'], 'a') as f:
+        f.write(f"start {payload['n']} {payload['target']} {time.time()} {os.getpid()}\n")
+    time.sleep(payload.get('seconds', 0.05))
+    with open(payload['log'], 'a') as f:
+        f.write(f"end {payload['n']} {payload['target']} {time.time()} {os.getpid()}\n")
+    results.send((True, f"job {payload['n']}"))
+
+
+def run_worker(settings, worker_id):
+    worker_module.execute_job = record_job
+    Worker({'job_queue': settings}, JobQueue(settings), worker_id=worker_id).run(exit_when_idle=True)
+
+
+def queue_settings(path, **overrides):
+    return {'path': str(path), 'lease_seconds': 10, 'heartbeat_seconds': 1, 'slots': 2,
+            'poll_seconds': 0.1, **overrides}
+
+
+def test_jobs_run_once_and_targets_never_overlap(tmp_path):
+    settings = queue_settings(tmp_path / "jobs.db")
+    queue = JobQueue(settings)
+    log = tmp_path / "runs.log"
+    targets = ['postgres', 'mongodb', 'storage']
+    for n in range(30):
+        target = targets[n % len(targets)]
+        queue.enqueue('backup', {'n': n, 'target': target, 'log': str(log), 'db_type': target}, target=target)
+
+    workers = [fork.Process(target=run_worker, args=(settings, f"worker-{i}")) for i in range(3)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(120)
+        assert process.exitcode == 0
+
+    starts, ends, intervals = defaultdict(int), defaultdict(int), defaultdict(list)
+    pids = set()
+    for line in log.read_text().splitlines():
+        event, n, target, at, pid = line.split()
+        if event == 'start':
+            starts[int(n)] += 1
+            intervals[target].append([float(at), None])
+            pids.add(pid)
+        else:
+            ends[int(n)] += 1
+            next(i for i in intervals[target] if i[1] is None)[1] = float(at)
+
+    assert dict(starts) == {n: 1 for n in range(30)}
+    assert dict(ends) == {n: 1 for n in range(30)}
+    for target, spans in intervals.items():
+        spans.sort()
+        for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+            assert start >= previous_end, f"two {target} jobs overlapped"
+
+    jobs = queue.list_jobs(limit=100)
+    assert len(jobs) == 30
+    assert all(job.status == 'done' and job.attempts == 1 for job in jobs)
+    # the work was spread over more than one worker
+    assert len({job.lease_owner for job in jobs}) > 1
+
+
+def test_expired_lease_is_taken_over_and_old_owner_fenced(tmp_path):
+    settings = queue_settings(tmp_path / "jobs.db", lease_seconds=1)
+    queue = JobQueue(settings)
+    job_id = queue.enqueue('verify', {'file': 'a.dump'})
+
+    stale = queue.claim('worker-a')
+    assert stale.id == job_id
+    # the target is busy while the lease holds
+    assert queue.claim('worker-b') is None
+    time.sleep(1.2)
+
+    # another process takes the job over once the lease has expired
+    claimed = fork.Queue()
+
+    def claim_in_other_process():
+        job = JobQueue(settings).claim('worker-b')
+        claimed.put((job.id, job.lease_token, job.attempts))
+
+    process = fork.Process(target=claim_in_other_process)
+    process.start()
+    process.join(30)
+    new_id, new_token, attempts = claimed.get(timeout=5)
+    assert new_id == job_id and new_token != stale.lease_token and attempts == 2
+
+    # every write from the old owner is rejected
+    assert not queue.heartbeat(stale)
+    assert not queue.complete(stale, "done by a")
+    assert not queue.fail(stale, "failed in a")
+    assert not queue.release(stale)
+
+    connection = sqlite3.connect(settings['path'])
+    status, owner, token, error = connection.execute(
+        "SELECT status, lease_owner, lease_token, error FROM backup_jobs WHERE id = ?", (job_id,)).fetchone()
+    connection.close()
+    assert (status, owner, token) == ('running', 'worker-b', new_token)
+    assert error == "lease of worker-a expired"
+
+
+def test_expired_lease_fails_after_last_attempt(tmp_path):
+    settings = queue_settings(tmp_path / "jobs.db", lease_seconds=0.2, max_attempts=1)
+    queue = JobQueue(settings)
+    job_id = queue.enqueue('retention', {'keep_last': 3})
+    assert queue.claim('worker-a').id == job_id
+    time.sleep(0.3)
+    assert queue.claim('worker-b') is None
+    job, = queue.list_jobs()
+    assert job.status == 'failed' and job.error == "lease of worker-a expired"